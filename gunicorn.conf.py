@@ -0,0 +1,26 @@
+"""
+Gunicorn settings.
+
+By default the ASGI app is served by uvicorn workers, so the async polling
+endpoints don't hold a worker while they wait on the database:
+
+    gunicorn parcel_tracking_system.asgi:application -c gunicorn.conf.py
+
+To run the classic WSGI deployment (e.g. to compare with `manage.py loadtest`):
+
+    GUNICORN_WORKER_CLASS=sync gunicorn parcel_tracking_system.wsgi:application -c gunicorn.conf.py
+"""
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'uvicorn.workers.UvicornWorker')
+# Only used by the threaded sync worker (GUNICORN_WORKER_CLASS=gthread)
+threads = int(os.environ.get('GUNICORN_THREADS', 1))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+keepalive = 5
+# Recycle workers now and then to bound memory growth
+max_requests = 2000
+max_requests_jitter = 200
+accesslog = '-'
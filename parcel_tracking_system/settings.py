@@ -10,8 +10,13 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+from corsheaders.defaults import default_headers
+
+from .database import database_settings, shard_aliases
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -44,6 +49,7 @@ INSTALLED_APPS = [
 AUTH_USER_MODEL = 'tracking.User'
 
 MIDDLEWARE = [
+    'tracking.metrics.MetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -62,13 +68,20 @@ TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [],
-        'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
             ],
+            # Compile each template once per process, also with DEBUG on
+            # (runserver's autoreloader clears it when a template changes)
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
         },
     },
 ]
@@ -78,13 +91,43 @@ WSGI_APPLICATION = 'parcel_tracking_system.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
+# Configured from the environment, see parcel_tracking_system/database.py
+
+DATABASES = database_settings(BASE_DIR)
+
+# Parcels, with their jobs, events and notifications, are placed on one of
+# these by tracking number hash (tracking/sharding.py). Just `default`
+# unless shard databases are configured; don't change the list once parcels
+# have been stored, rows aren't moved between shards.
+SHARD_DATABASES = shard_aliases(DATABASES)
+
+DATABASE_ROUTERS = ['tracking.routers.ShardRouter', 'tracking.routers.ReplicaRouter']
+
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# Cache
+# Shared tier of tracking/cache.py: Redis when REDIS_URL is set, otherwise a
+# per-process in-memory cache (development and tests).
+
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
     }
-}
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        }
+    }
+
+# In-process tier: entry count, and how long an entry may outlive an
+# invalidation made by another process
+CACHE_LOCAL_SIZE = 2048
+CACHE_LOCAL_TTL = 5
+CACHE_LOCK_TIMEOUT = 10
 
 
 # Password validation
@@ -132,6 +175,7 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
+        'tracking.authentication.SignedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
         'rest_framework.authentication.BasicAuthentication',
     ],
@@ -139,17 +183,118 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticated',
     ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
-    'PAGE_SIZE': 20
+    'PAGE_SIZE': 20,
+    'DEFAULT_THROTTLE_RATES': {
+        'public_tracking': '60/min',
+    },
 }
 
+# Bloom filter of known tracking numbers in front of public tracking (tracking/bloom.py)
+BLOOM_ERROR_RATE = 0.001
+BLOOM_MIN_CAPACITY = 100000
+BLOOM_REFRESH_INTERVAL = 5
+
+# Signed API tokens (tracking/authentication.py). To rotate, add a new key,
+# make it active, and remove the old one after AUTH_TOKEN_TTL has passed.
+AUTH_TOKEN_KEYS = {}  # key id -> secret; defaults to a key derived from SECRET_KEY
+AUTH_TOKEN_ACTIVE_KEY = None
+AUTH_TOKEN_TTL = 7 * 24 * 3600
+AUTH_TOKEN_USER_CACHE_SIZE = 1024
+AUTH_TOKEN_USER_CACHE_TTL = 300
+
+# Request metrics (tracking/metrics.py), scraped from /metrics with
+# `Authorization: Bearer <METRICS_TOKEN>`; refused while no token is set.
+METRICS_ENABLED = True
+METRICS_SLOW_REQUEST_MS = 500
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
 # CORS settings
 CORS_ALLOW_ALL_ORIGINS = True
 CORS_ALLOW_CREDENTIALS = True
+CORS_ALLOW_HEADERS = (*default_headers, 'idempotency-key')
+CORS_EXPOSE_HEADERS = ['Idempotent-Replayed']
 
 # Media files
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Background tasks (tracking/taskqueue.py), run by `manage.py run_worker`.
+# TASKS_EAGER runs them in the web process after commit instead.
+TASKS_EAGER = os.environ.get('TASKS_EAGER') == '1'
+TASK_WORKER_THREADS = 4
+TASK_BATCH_SIZE = 10
+TASK_VISIBILITY_TIMEOUT = 300
+TASK_POLL_INTERVAL = 1.0
+TASK_MAX_ATTEMPTS = 5
+TASK_RETRY_BACKOFF = 10  # seconds, doubled on every retry
+
+# Driver job delta sync (tracking/sync.py). Cursors trail the clock by the
+# overlap so slow transactions aren't missed; cursors older than the
+# tombstone retention get a full resync.
+SYNC_CURSOR_OVERLAP = 10  # seconds
+SYNC_TOMBSTONE_DAYS = 30
+
+# Parcel address coordinates (tracking/geo.py) and arrival geofences
+# (tracking/geofence.py). GEOCODER is an optional dotted path to a function
+# address -> (latitude, longitude) or None, used for addresses missing from
+# the geocode cache.
+GEOCODER = os.environ.get('GEOCODER') or None
+GEOFENCE_ARRIVING_M = 500
+GEOFENCE_ARRIVED_M = 75
+GEOFENCE_INDEX_TTL = 600  # seconds
+
+# Parcel search (tracking/search.py): most results a ranked search returns
+SEARCH_MAX_RESULTS = 200
+
+# Admin changelists (tracking/paginator.py): counts stop at this many rows;
+# unfiltered lists of bigger tables show the database's row estimate
+ADMIN_EXACT_COUNT_LIMIT = 100000
+
+# Driver workload registry (tracking/registry.py): a driver has capacity while
+# on duty with fewer open jobs than the limit and room left in the vehicle.
+# The load and volume limits apply to drivers without their own.
+DRIVER_MAX_OPEN_JOBS = 20
+DRIVER_MAX_LOAD_KG = 500
+DRIVER_MAX_VOLUME_M3 = None  # no limit unless the driver's vehicle has one
+DRIVER_REGISTRY_REFRESH_INTERVAL = 30  # seconds between full rebuilds, in the background
+
+# Heatmap tiles (tracking/heatmap.py), updated by `manage.py build_heatmaps`.
+# Each zoom's map tiles are split into TILE_BINS x TILE_BINS cells; a parcel
+# waiting for the geocoder holds back its shard's parcels for up to
+# GEOCODE_WAIT seconds.
+HEATMAP_ZOOMS = (8, 11, 14)
+HEATMAP_TILE_BINS = 64
+HEATMAP_BATCH_SIZE = 5000
+HEATMAP_GEOCODE_WAIT = 3600
+
+# Load planning (tracking/loading.py): volumetric weight is L x W x H in cm
+# over the divisor; a plan considers at most this many waiting parcels
+VOLUMETRIC_DIVISOR = 5000
+LOAD_PLAN_MAX_PARCELS = 5000
+
+# Largest list accepted by the batched driver actions endpoint (tracking/batch.py)
+DRIVER_BATCH_MAX_ACTIONS = 200
+
+# Idempotency-Key support on the write endpoints (tracking/idempotency.py).
+# Keys are kept for the TTL; an in-progress key whose request died is
+# released after the lock timeout.
+IDEMPOTENCY_KEY_TTL = 24 * 3600  # seconds
+IDEMPOTENCY_LOCK_TIMEOUT = 60  # seconds
+IDEMPOTENCY_LOCAL_SIZE = 4096
+
+# Proof-of-delivery processing (tracking/media.py)
+PROOF_IMAGE_MAX_SIZE = 1600
+PROOF_IMAGE_QUALITY = 82
+PROOF_THUMBNAIL_SIZE = 320
+
+# Resumable uploads (tracking/uploads.py)
+UPLOAD_MAX_SIZE = 25 * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+# Driver location pings, one row per ping: `manage.py purge_location_pings`
+# (e.g. daily from cron) deletes those older than this, once heatmapped
+LOCATION_PING_RETENTION_DAYS = 30
+
 
 # Custom user model
 AUTH_USER_MODEL = 'tracking.User'
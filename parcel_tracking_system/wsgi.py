@@ -14,3 +14,10 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'parcel_tracking_system.settings')
 
 application = get_wsgi_application()
+
+# Load the tracking number filter and the driver registry before the first request
+from tracking.bloom import tracking_numbers  # noqa: E402
+from tracking.registry import drivers  # noqa: E402
+
+tracking_numbers.start()
+drivers.start()
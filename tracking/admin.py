@@ -1,13 +1,69 @@
+from django import forms
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
-from .models import User, Driver, Parcel, TrackingEvent, Job, Notification ,AboutSection
+from django.utils import timezone
+from . import sharding
+from .loading import dimension_fields
+from .models import User, Driver, Parcel, ParcelEvent, TrackingEvent, Job, Notification ,AboutSection, ArchivedParcel, MediaAsset, StagedMedia, Task
+from .paginator import EstimatedCountPaginator
+from .search import search
+from .transitions import InvalidTransition, apply_event, event_for_status, next_status, record_booking
+
+
+class ShardFilter(admin.SimpleListFilter):
+    """
+    A changelist's queries run on one database, so with several shards
+    (tracking/sharding.py) the list of a sharded table shows the shard picked
+    here, the first one until another is.
+    """
+    title = 'shard'
+    parameter_name = 'shard'
+
+    def lookups(self, request, model_admin):
+        return [(alias, alias) for alias in sharding.shards()]
+
+    def value(self):
+        value = super().value()
+        return value if value in sharding.shards() else sharding.shards()[0]
+
+    def choices(self, changelist):
+        for alias, title in self.lookup_choices:
+            yield {
+                'selected': self.value() == alias,
+                'query_string': changelist.get_query_string({self.parameter_name: alias}),
+                'display': title,
+            }
+
+    def queryset(self, request, queryset):
+        return queryset.using(self.value())
+
+
+class LargeTableMixin:
+    """
+    Changelists for tables that grow without bound: counts stop at
+    ADMIN_EXACT_COUNT_LIMIT (tracking/paginator.py), filtered lists don't also
+    count the whole table, and the app's change_list.html template draws
+    date_hierarchy from index lookups (templatetags/tracking_admin.py).
+    Sharded tables get a shard filter when there are several shards.
+    Subclasses should set list_select_related for the foreign keys they
+    display, and use raw_id_fields or autocomplete_fields so forms don't
+    render a whole table into a dropdown.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_list_filter(self, request):
+        list_filter = super().get_list_filter(request)
+        if sharding.enabled() and sharding.is_sharded(self.model):
+            return (ShardFilter, *list_filter)
+        return list_filter
 
 @admin.register(AboutSection)
 class AboutAdmin(admin.ModelAdmin):
     list_display = ('heading', 'experience_years')
 
 @admin.register(User)
-class UserAdmin(BaseUserAdmin):
+class UserAdmin(LargeTableMixin, BaseUserAdmin):
     list_display = ('username', 'email', 'user_type', 'first_name', 'last_name', 'is_staff')
     list_filter = ('user_type', 'is_staff', 'is_superuser', 'is_active')
     search_fields = ('username', 'email', 'first_name', 'last_name')
@@ -22,18 +78,46 @@ class UserAdmin(BaseUserAdmin):
 
 
 @admin.register(Driver)
-class DriverAdmin(admin.ModelAdmin):
-    list_display = ('user', 'vehicle_details', 'is_available', 'current_latitude', 'current_longitude')
+class DriverAdmin(LargeTableMixin, admin.ModelAdmin):
+    list_display = ('user', 'vehicle_details', 'max_load_kg', 'cargo_volume_m3', 'is_available',
+                    'current_latitude', 'current_longitude')
+    list_select_related = ('user',)
+    autocomplete_fields = ('user',)
     list_filter = ('is_available',)
     search_fields = ('user__username', 'user__email', 'vehicle_details')
 
 
+class ParcelAdminForm(forms.ModelForm):
+    class Meta:
+        model = Parcel
+        fields = '__all__'
+
+    def clean_status(self):
+        new_status = self.cleaned_data['status']
+        if not self.instance.pk:
+            initial = next_status('', 'booked')
+            if new_status != initial:
+                raise forms.ValidationError(f"New parcels start as '{initial}'.")
+        elif new_status != self.instance.status:
+            try:
+                self.status_event = event_for_status(self.instance.status, new_status)
+            except InvalidTransition:
+                raise forms.ValidationError(
+                    f"A parcel cannot move from '{self.instance.status}' to '{new_status}'.")
+        return new_status
+
+
 @admin.register(Parcel)
-class ParcelAdmin(admin.ModelAdmin):
+class ParcelAdmin(LargeTableMixin, admin.ModelAdmin):
+    form = ParcelAdminForm
     list_display = ('tracking_number', 'customer', 'status', 'current_driver', 'booked_at', 'expected_delivery_date','can_customer_track')
-    list_filter = ('status', 'booked_at','can_customer_track')
+    list_filter = ('status', 'can_customer_track')
+    list_select_related = ('customer', 'current_driver__user')
+    autocomplete_fields = ('customer', 'current_driver')
+    date_hierarchy = 'booked_at'
+    # Searched through the full-text index (get_search_results), not with LIKE
     search_fields = ('tracking_number', 'customer__username', 'recipient_name', 'pickup_address', 'delivery_address')
-    readonly_fields = ('tracking_number', 'booked_at')
+    readonly_fields = ('tracking_number', 'booked_at', 'can_customer_track', 'length_cm', 'width_cm', 'height_cm')
     
     fieldsets = (
         ('Basic Info', {
@@ -43,34 +127,129 @@ class ParcelAdmin(admin.ModelAdmin):
             'fields': ('pickup_address', 'delivery_address', 'recipient_name', 'recipient_phone')
         }),
         ('Parcel Details', {
-            'fields': ('description', 'weight', 'dimensions', 'delivery_instructions', 'can_customer_track')
+            'fields': ('description', 'weight', 'dimensions', ('length_cm', 'width_cm', 'height_cm'),
+                       'delivery_instructions', 'can_customer_track')
         }),
         ('Timestamps', {
             'fields': ('booked_at', 'expected_delivery_date')
         }),
     )
 
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip():
+            return queryset, False
+        # On the shard ShardFilter picked
+        return search(queryset.using(queryset.db), search_term, ranked=False), False
+
+    def save_model(self, request, obj, form, change):
+        if 'dimensions' in form.changed_data:
+            for field, value in dimension_fields(obj.dimensions).items():
+                setattr(obj, field, value)
+        # Bookings and status changes go through the event stream rather than a plain save
+        event_type = getattr(form, 'status_event', None)
+        if not change:
+            super().save_model(request, obj, form, change)
+            record_booking(obj, created_by=request.user)
+        elif event_type:
+            obj.status = form.initial['status']
+            super().save_model(request, obj, form, change)
+            apply_event(obj, event_type, created_by=request.user, source='admin')
+        else:
+            super().save_model(request, obj, form, change)
+
 
 @admin.register(TrackingEvent)
-class TrackingEventAdmin(admin.ModelAdmin):
+class TrackingEventAdmin(LargeTableMixin, admin.ModelAdmin):
     list_display = ('parcel', 'status_update', 'timestamp', 'location', 'created_by')
-    list_filter = ('timestamp', 'status_update')
+    # No list_filter: status_update is free text, and listing its values
+    # means a DISTINCT over the whole table on every page
+    list_select_related = ('parcel', 'created_by')
+    raw_id_fields = ('parcel',)
+    autocomplete_fields = ('created_by',)
+    date_hierarchy = 'timestamp'
     search_fields = ('parcel__tracking_number', 'status_update', 'location', 'notes')
     readonly_fields = ('timestamp',)
 
 
+@admin.register(ParcelEvent)
+class ParcelEventAdmin(LargeTableMixin, admin.ModelAdmin):
+    list_display = ('parcel', 'event_type', 'from_status', 'to_status', 'timestamp', 'created_by')
+    list_filter = ('event_type',)
+    list_select_related = ('parcel', 'created_by')
+    raw_id_fields = ('parcel', 'created_by')
+    search_fields = ('parcel__tracking_number',)
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
 @admin.register(Job)
-class JobAdmin(admin.ModelAdmin):
+class JobAdmin(LargeTableMixin, admin.ModelAdmin):
     list_display = ('parcel', 'driver', 'job_type', 'status', 'assigned_at', 'accepted_at', 'completed_at')
-    list_filter = ('job_type', 'status', 'assigned_at')
+    list_filter = ('job_type', 'status')
+    list_select_related = ('parcel', 'driver__user')
+    raw_id_fields = ('parcel',)
+    autocomplete_fields = ('driver',)
+    date_hierarchy = 'assigned_at'
     search_fields = ('parcel__tracking_number', 'driver__user__username')
     readonly_fields = ('assigned_at',)
 
 
 @admin.register(Notification)
-class NotificationAdmin(admin.ModelAdmin):
+class NotificationAdmin(LargeTableMixin, admin.ModelAdmin):
     list_display = ('user', 'title', 'is_read', 'created_at', 'parcel')
-    list_filter = ('is_read', 'created_at')
+    list_filter = ('is_read',)
+    list_select_related = ('user', 'parcel')
+    raw_id_fields = ('parcel',)
+    autocomplete_fields = ('user',)
+    date_hierarchy = 'created_at'
     search_fields = ('user__username', 'title', 'message')
     readonly_fields = ('created_at',)
 
+
+
+@admin.register(ArchivedParcel)
+class ArchivedParcelAdmin(LargeTableMixin, admin.ModelAdmin):
+    list_display = ('tracking_number', 'customer', 'status', 'booked_at', 'closed_at', 'archived_at')
+    list_filter = ('status',)
+    search_fields = ('tracking_number',)
+    list_select_related = ('customer',)
+    date_hierarchy = 'closed_at'
+
+    def get_queryset(self, request):
+        # The snapshots are only shown on the change page, which loads them
+        return super().get_queryset(request).defer('detail', 'tracking', 'jobs', 'status_events', 'media')
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(MediaAsset)
+class MediaAssetAdmin(LargeTableMixin, admin.ModelAdmin):
+    list_display = ('sha256', 'width', 'height', 'size', 'created_at')
+    search_fields = ('sha256',)
+
+
+@admin.register(StagedMedia)
+class StagedMediaAdmin(LargeTableMixin, admin.ModelAdmin):
+    list_display = ('tracking_event', 'field', 'status', 'created_at', 'processed_at')
+    list_filter = ('status', 'field')
+    list_select_related = ('tracking_event__parcel',)
+    raw_id_fields = ('tracking_event',)
+
+
+@admin.register(Task)
+class TaskAdmin(LargeTableMixin, admin.ModelAdmin):
+    list_display = ('name', 'status', 'attempts', 'max_attempts', 'run_at', 'locked_by', 'created_at')
+    list_filter = ('status', 'name')
+    readonly_fields = ('last_error',)
+    actions = ['requeue']
+
+    @admin.action(description="Requeue selected tasks")
+    def requeue(self, request, queryset):
+        count = queryset.exclude(status='running').update(
+            status='queued', attempts=0, run_at=timezone.now(), locked_by='', locked_until=None)
+        self.message_user(request, f"Requeued {count} tasks")
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class TrackingConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'tracking'
+
+    def ready(self):
+        # Connect signal receivers
+        from . import authentication, bloom, cache, metrics, registry, search, sync  # noqa: F401
@@ -0,0 +1,162 @@
+"""
+Hot/cold archival of closed parcels.
+
+Delivered and cancelled parcels closed more than N days ago are moved, in
+batches, out of Parcel/Job/TrackingEvent/ParcelEvent into a single
+ArchivedParcel row holding serialized snapshots. Public tracking and
+customer history fall back to the archive when a parcel is not found in the
+hot tables. Each shard's parcels are archived in transactions on that shard
+(and `default`, which holds the archive).
+
+Notifications stay in the customer's feed: they're detached from the parcel
+and keep its tracking number. Processed proof images are content-addressed
+and may be shared (tracking/media.py), so they're kept and the snapshot
+lists their storage names; raw uploads that were never processed are
+deleted.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import OuterRef, Q, Subquery
+from django.utils import timezone
+
+from . import sharding
+from .models import ArchivedParcel, Notification, Parcel, StagedMedia
+from .serializers import ParcelSerializer, ParcelTrackingSerializer
+from .transitions import TERMINAL_STATUSES
+
+PROOF_FIELDS = ('image', 'signature', 'image_thumbnail', 'signature_thumbnail')
+
+
+def archivable_parcels(older_than_days):
+    cutoff = timezone.now() - timedelta(days=older_than_days)
+    return Parcel.objects.filter(
+        Q(closed_at__lt=cutoff) | Q(closed_at__isnull=True, booked_at__lt=cutoff),
+        status__in=TERMINAL_STATUSES,
+    )
+
+
+def archive_batch(parcel_ids):
+    """Move the given parcels, all of one shard, and their dependent rows into the archive."""
+    if not parcel_ids:
+        return 0
+    alias = sharding.shard_for_id(parcel_ids[0])
+    parcels = (
+        Parcel.objects.filter(pk__in=parcel_ids, status__in=TERMINAL_STATUSES)
+        .select_related('customer', 'current_driver__user')
+        .prefetch_related('tracking_events__created_by', 'jobs', 'status_events')
+    )
+    archived = []
+    for parcel in parcels:
+        tracking = ParcelTrackingSerializer(parcel).data
+        tracking['driver_latitude'] = tracking['driver_longitude'] = None
+        archived.append(ArchivedParcel(
+            tracking_number=parcel.tracking_number,
+            original_id=parcel.pk,
+            customer_id=parcel.customer_id,
+            status=parcel.status,
+            can_customer_track=parcel.can_customer_track,
+            booked_at=parcel.booked_at,
+            closed_at=parcel.closed_at,
+            detail=ParcelSerializer(parcel).data,
+            tracking=tracking,
+            jobs=[
+                {
+                    'id': job.pk, 'driver_id': job.driver_id, 'job_type': job.job_type,
+                    'status': job.status, 'assigned_at': job.assigned_at,
+                    'accepted_at': job.accepted_at, 'completed_at': job.completed_at,
+                    'notes': job.notes,
+                }
+                for job in parcel.jobs.all()
+            ],
+            status_events=[
+                {
+                    'event_type': event.event_type, 'from_status': event.from_status,
+                    'to_status': event.to_status, 'data': event.data,
+                    'created_by_id': event.created_by_id, 'timestamp': event.timestamp,
+                }
+                for event in parcel.status_events.all()
+            ],
+            media=[
+                getattr(event, field).name
+                for event in parcel.tracking_events.all()
+                for field in PROOF_FIELDS
+                if getattr(event, field)
+            ],
+        ))
+
+    archived_ids = [a.original_id for a in archived]
+    unprocessed = list(
+        StagedMedia.objects.using(alias)
+        .filter(tracking_event__parcel_id__in=archived_ids)
+        .exclude(status='done')
+        .values_list('file', flat=True)
+    )
+    with sharding.atomic(alias):
+        ArchivedParcel.objects.bulk_create(archived)
+        tracking_number = Parcel.objects.using(alias).filter(pk=OuterRef('parcel_id')).values('tracking_number')
+        Notification.objects.using(alias).filter(parcel_id__in=archived_ids).update(
+            tracking_number=Subquery(tracking_number[:1]))
+        # Cascades to jobs, tracking events, status events and staged media;
+        # notifications are detached
+        Parcel.objects.filter(pk__in=archived_ids).delete()
+        transaction.on_commit(lambda: _delete_files(unprocessed), using=alias)
+    return len(archived)
+
+
+def _delete_files(names):
+    for name in names:
+        if name:
+            StagedMedia.file.field.storage.delete(name)
+
+
+def archive_closed_parcels(older_than_days, batch_size=500, max_batches=None):
+    """Archive closed parcels batch by batch; returns the number archived."""
+    total = batches = 0
+    for alias in sharding.shards():
+        while max_batches is None or batches < max_batches:
+            ids = list(archivable_parcels(older_than_days).using(alias)
+                       .order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if not ids:
+                break
+            total += archive_batch(ids)
+            batches += 1
+    return total
+
+
+def find_archived(tracking_number, **filters):
+    return ArchivedParcel.objects.filter(tracking_number=tracking_number, **filters).first()
+
+
+class ChainedResults:
+    """
+    Live queryset followed by archived rows, sliceable and countable so it
+    can be handed to a paginator in place of a queryset.
+    """
+
+    def __init__(self, live, archived):
+        self.live = live
+        self.archived = archived
+        self._live_count = None
+
+    def _count_live(self):
+        if self._live_count is None:
+            self._live_count = self.live.count()
+        return self._live_count
+
+    def count(self):
+        return self._count_live() + self.archived.count()
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        start = index.start or 0
+        stop = index.stop if index.stop is not None else self.count()
+        live_count = self._count_live()
+        items = list(self.live[start:min(stop, live_count)]) if start < live_count else []
+        if stop > live_count:
+            items += list(self.archived[max(start - live_count, 0):stop - live_count])
+        return items
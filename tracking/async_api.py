@@ -0,0 +1,87 @@
+"""
+Helpers for the async API views.
+
+The polling endpoints (public tracking, driver jobs, notifications, location
+updates) are plain async Django views so that, under an ASGI server, a
+request waiting on the database doesn't hold a worker. These helpers give
+them the same authentication, throttling, pagination and error format as
+the DRF views.
+"""
+import math
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse
+from rest_framework import exceptions
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+def json_response(data, status=200):
+    return JsonResponse(data, status=status, encoder=DjangoJSONEncoder, safe=False)
+
+
+def error_response(exc):
+    """Render a DRF APIException the way DRF's exception handler would."""
+    data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+    response = json_response(data, status=exc.status_code)
+    if isinstance(exc, exceptions.Throttled) and exc.wait is not None:
+        response['Retry-After'] = str(math.ceil(exc.wait))
+    return response
+
+
+def _authenticated_request(request):
+    api_request = Request(
+        request,
+        parsers=[parser() for parser in api_settings.DEFAULT_PARSER_CLASSES],
+        authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES],
+    )
+    if not api_request.user.is_authenticated:
+        raise exceptions.NotAuthenticated()
+    return api_request
+
+
+async def authenticated_request(request):
+    """
+    Wrap `request` in a DRF Request authenticated with the configured
+    authenticators (signed token, session with CSRF checks, basic). Raises
+    an APIException if nobody is logged in.
+    """
+    return await sync_to_async(_authenticated_request)(request)
+
+
+def check_throttles(request, throttle_classes):
+    for throttle_class in throttle_classes:
+        throttle = throttle_class()
+        if not throttle.allow_request(request, None):
+            raise exceptions.Throttled(throttle.wait())
+
+
+async def paginate(request, queryset, serializer_class):
+    """Return a page in the same shape as DRF's PageNumberPagination."""
+    page_size = api_settings.PAGE_SIZE
+    count = await queryset.acount()
+    pages = max(math.ceil(count / page_size), 1)
+    page = request.GET.get('page', 1)
+    try:
+        number = pages if page == 'last' else int(page)
+    except (TypeError, ValueError):
+        number = 0
+    if not 1 <= number <= pages:
+        raise exceptions.NotFound('Invalid page.')
+
+    start = (number - 1) * page_size
+    rows = [row async for row in queryset[start:start + page_size]]
+
+    url = request.build_absolute_uri()
+    next_url = replace_query_param(url, 'page', number + 1) if number < pages else None
+    if number == 1:
+        previous_url = None
+    elif number == 2:
+        previous_url = remove_query_param(url, 'page')
+    else:
+        previous_url = replace_query_param(url, 'page', number - 1)
+
+    results = serializer_class(rows, many=True, context={'request': request}).data
+    return {'count': count, 'next': next_url, 'previous': previous_url, 'results': results}
@@ -0,0 +1,141 @@
+"""
+Stateless signed-token authentication for drivers and integration clients.
+
+A token is `<user_id>.<issued_at>.<key_id>.<signature>` where the signature is
+an HMAC-SHA256 of the first three parts under the key named by key_id.
+Verifying one is a single HMAC plus a lookup in a small in-process LRU of
+users, instead of a PBKDF2 hash (BasicAuthentication) or a session read.
+
+Keys live in settings.AUTH_TOKEN_KEYS; new tokens are signed with
+AUTH_TOKEN_ACTIVE_KEY and any listed key is accepted, so keys can be rotated
+by adding a new one, switching the active id, and dropping the old one once
+its tokens have expired.
+"""
+import base64
+import hashlib
+import hmac
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework import exceptions
+from rest_framework.authentication import BaseAuthentication, get_authorization_header
+
+from .models import User
+
+
+def _keys():
+    keys = getattr(settings, 'AUTH_TOKEN_KEYS', None)
+    if not keys:
+        derived = hmac.new(settings.SECRET_KEY.encode(), b'tracking.auth-token', hashlib.sha256)
+        keys = {'default': derived.hexdigest()}
+    return keys
+
+
+def _active_key_id():
+    return getattr(settings, 'AUTH_TOKEN_ACTIVE_KEY', None) or next(iter(_keys()))
+
+
+def _ttl():
+    return getattr(settings, 'AUTH_TOKEN_TTL', 7 * 24 * 3600)
+
+
+def _sign(key, payload):
+    digest = hmac.new(key.encode(), payload.encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b'=').decode()
+
+
+def issue_token(user, now=None):
+    """Return (token, expires_at_epoch) for `user` signed with the active key."""
+    issued_at = int(now if now is not None else time.time())
+    key_id = _active_key_id()
+    payload = f'{user.pk}.{issued_at}.{key_id}'
+    return f'{payload}.{_sign(_keys()[key_id], payload)}', issued_at + _ttl()
+
+
+def verify_token(token, now=None):
+    """Return the user id a token was issued for, or raise AuthenticationFailed."""
+    try:
+        user_id, issued_at, key_id, signature = token.split('.')
+        issued_at = int(issued_at)
+    except ValueError:
+        raise exceptions.AuthenticationFailed('Malformed token.')
+
+    key = _keys().get(key_id)
+    if key is None:
+        raise exceptions.AuthenticationFailed('Token signing key has been retired.')
+    if not hmac.compare_digest(signature, _sign(key, f'{user_id}.{issued_at}.{key_id}')):
+        raise exceptions.AuthenticationFailed('Invalid token.')
+    if issued_at + _ttl() < (now if now is not None else time.time()):
+        raise exceptions.AuthenticationFailed('Token has expired.')
+    return user_id
+
+
+class UserCache:
+    """Small thread-safe LRU of active users keyed by primary key."""
+
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(user_id)
+            if entry is not None and entry[1] > now:
+                self._data.move_to_end(user_id)
+                return entry[0]
+        user = User.objects.filter(pk=user_id, is_active=True).first()
+        if user is not None:
+            with self._lock:
+                self._data[user_id] = (user, now + self.ttl)
+                self._data.move_to_end(user_id)
+                while len(self._data) > self.maxsize:
+                    self._data.popitem(last=False)
+        return user
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._data.pop(str(user_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+user_cache = UserCache(
+    maxsize=getattr(settings, 'AUTH_TOKEN_USER_CACHE_SIZE', 1024),
+    ttl=getattr(settings, 'AUTH_TOKEN_USER_CACHE_TTL', 300),
+)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def _invalidate_cached_user(sender, instance, **kwargs):
+    user_cache.invalidate(instance.pk)
+
+
+class SignedTokenAuthentication(BaseAuthentication):
+    """Accepts `Authorization: Bearer <token>` (or `Token <token>`)."""
+    keywords = (b'bearer', b'token')
+
+    def authenticate(self, request):
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() not in self.keywords:
+            return None
+        if len(auth) != 2:
+            raise exceptions.AuthenticationFailed('Invalid token header.')
+
+        user_id = verify_token(auth[1].decode('latin-1'))
+        user = user_cache.get(user_id)
+        if user is None:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+        return user, None
+
+    def authenticate_header(self, request):
+        return 'Bearer'
@@ -0,0 +1,190 @@
+"""
+Batched driver actions.
+
+POST /api/jobs/batch/ takes an ordered list of accept / scan / complete
+actions, e.g. a run of scans at the depot or actions queued while a driver
+was offline, and applies them in one transaction:
+
+- the jobs and their parcels are loaded, and locked, with one query;
+- the actions are applied in order to those instances, following the same
+  rules as the single-job endpoints, so a later action sees the effect of
+  an earlier one (scan the pickup, then the delivery of the same parcel);
+- everything is written with one bulk statement per table, and the cache
+  tags are invalidated once.
+
+With several shards (tracking/sharding.py) each shard's actions are applied
+in a transaction of their own; a parcel's jobs share a shard, so actions
+that depend on each other are always applied together.
+
+Every action gets its own result and a failed one doesn't stop the rest.
+The client's timestamp (when the driver acted) is kept as the event time,
+capped at the present. Repeating an action that was already applied
+succeeds without changing anything, so an offline queue can be re-sent.
+"""
+from django.utils import timezone
+
+from . import sharding
+
+from .cache import driver_tag, invalidate, parcel_tag, stops_tag, user_tag
+from .media import stage_file
+from .models import Job, Parcel, ParcelEvent, TrackingEvent
+from .notifications import notify
+from .registry import job_closed
+from .taskqueue import defer_many
+from .transitions import InvalidTransition, next_status, stage_event
+from .uploads import PROOF_UPLOAD_FIELDS, UploadError, claim_all
+
+
+class DriverBatch:
+    def __init__(self, user, now=None):
+        self.user = user
+        self.now = now or timezone.now()
+        self.jobs = {}
+        self.parcels = {}
+        self.parcel_events = []
+        self.tracking_events = []
+        self.staged_files = []
+        self.notifications = []
+        self.closed = []
+
+    def run(self, actions):
+        """Apply `actions` (validated dicts) and return one result per action."""
+        results = [None] * len(actions)
+        shards = sharding.by_shard(enumerate(actions), key=lambda item: item[1]['job_id'])
+        for alias, indexed in shards.items():
+            batch = self if len(shards) == 1 else DriverBatch(self.user, self.now)
+            for index, result in batch._run(alias, indexed):
+                results[index] = result
+        return results
+
+    def _run(self, alias, indexed):
+        with sharding.atomic(alias):
+            loaded = {}
+            parcels = {}
+            queryset = (
+                Job.objects.select_for_update()
+                .select_related('parcel')
+                .filter(pk__in={action['job_id'] for _, action in indexed})
+            )
+            for job in queryset:
+                # Jobs of the same parcel must share one instance
+                job.parcel = parcels.setdefault(job.parcel_id, job.parcel)
+                loaded[job.pk] = job
+
+            results = [(index, self._apply(index, action, loaded.get(action['job_id'])))
+                       for index, action in indexed]
+            self._write()
+        return results
+
+    def _apply(self, index, action, job):
+        result = {'index': index, 'job_id': action['job_id'], 'action': action['action']}
+        if job is None:
+            return {**result, 'status': 404, 'error': 'Job not found'}
+        if job.driver_id != self.user.pk:
+            return {**result, 'status': 403, 'error': 'You can only act on your own jobs'}
+
+        at = min(action.get('timestamp') or self.now, self.now)
+        try:
+            message = getattr(self, f"_{action['action']}")(job, at, action)
+        except InvalidTransition as exc:
+            return {**result, 'status': 409, 'error': str(exc)}
+        except UploadError as exc:
+            return {**result, 'status': 400, 'error': str(exc)}
+        return {**result, 'status': 200, 'message': message}
+
+    # Actions
+
+    def _accept(self, job, at, action):
+        if job.status != 'assigned':
+            return f'Job already {job.get_status_display().lower()}'
+        job.status = 'accepted'
+        job.accepted_at = at
+        self._changed(job)
+        self._track(job, at, f'Driver accepted {job.job_type} job',
+                    f'Driver {self.user.username} accepted the job')
+        return 'Job accepted successfully'
+
+    def _scan(self, job, at, action):
+        if job.status in ('en_route', 'completed'):
+            return 'Parcel already scanned'
+        if job.job_type == 'pickup':
+            event_type, status_message = 'collected', 'Parcel collected and scanned'
+        else:
+            event_type, status_message = 'out_for_delivery', 'Parcel scanned for delivery'
+
+        self._event(job, event_type, at)
+        job.status = 'en_route'
+        self._changed(job)
+        if job.job_type == 'pickup':
+            self.closed.append(job)
+        self._track(job, at, status_message, f'Parcel scanned by driver {self.user.username}')
+        self._notify(job, 'Parcel Status Update',
+                     f'Your parcel {job.parcel.tracking_number} has been {status_message.lower()}')
+        return 'Parcel scanned successfully'
+
+    def _complete(self, job, at, action):
+        if job.status == 'completed':
+            return 'Delivery already completed'
+        # Check the transition before consuming any uploads
+        next_status(job.parcel.status, 'delivered')
+        claimed = claim_all(self.user, {key: action[key] for key in PROOF_UPLOAD_FIELDS if action.get(key)})
+        files = [(PROOF_UPLOAD_FIELDS[key], upload.file.name) for key, upload in claimed.items()]
+
+        self._event(job, 'delivered', at)
+        job.status = 'completed'
+        job.completed_at = at
+        job.notes = action.get('notes', '')
+        self._changed(job)
+        self.closed.append(job)
+        event = self._track(job, at, 'Delivered successfully', action.get('notes') or 'Package delivered')
+        self.staged_files.extend((event, field, name) for field, name in files)
+        self._notify(job, 'Parcel Delivered',
+                     f'Your parcel {job.parcel.tracking_number} has been delivered successfully')
+        return 'Delivery completed successfully'
+
+    # Collecting writes
+
+    def _event(self, job, event_type, at):
+        self.parcel_events.append(
+            stage_event(job.parcel, event_type, created_by=self.user, timestamp=at, job_id=job.pk))
+
+    def _changed(self, job):
+        job.updated_at = self.now
+        self.jobs[job.pk] = job
+
+    def _track(self, job, at, status_update, notes):
+        parcel = job.parcel
+        parcel.updated_at = self.now
+        self.parcels[parcel.pk] = parcel
+        event = TrackingEvent(parcel=parcel, timestamp=at, status_update=status_update,
+                              notes=notes, created_by=self.user)
+        self.tracking_events.append(event)
+        return event
+
+    def _notify(self, job, title, message):
+        self.notifications.append(
+            ((job.parcel.customer_id,), {'title': title, 'message': message, 'parcel_id': job.parcel_id}))
+
+    def _write(self):
+        if not self.jobs:
+            return
+        ParcelEvent.objects.bulk_create(self.parcel_events)
+        TrackingEvent.objects.bulk_create(self.tracking_events)
+        # The rows are locked; bumping their versions fails concurrent optimistic updates
+        for row in (*self.parcels.values(), *self.jobs.values()):
+            row.version += 1
+        Parcel.objects.bulk_update(self.parcels.values(),
+                                   ['status', 'can_customer_track', 'closed_at', 'updated_at', 'version'])
+        Job.objects.bulk_update(self.jobs.values(),
+                                ['status', 'accepted_at', 'completed_at', 'notes', 'updated_at', 'version'])
+        for event, field, name in self.staged_files:
+            stage_file(event, field, name)
+        defer_many(notify, self.notifications)
+        for job in self.closed:
+            job_closed(job)
+
+        # Bulk writes send no signals
+        tags = {driver_tag(self.user.pk), user_tag(self.user.pk), stops_tag(self.user.pk)}
+        for parcel in self.parcels.values():
+            tags.update((parcel_tag(parcel.pk), user_tag(parcel.customer_id)))
+        invalidate(*tags)
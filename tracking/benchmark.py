@@ -0,0 +1,724 @@
+"""
+API benchmarks and traffic replay against a generated dataset.
+
+Requests go through the full middleware stack in-process (Django's test
+client), so results reflect view, ORM, serializer and cache costs rather than
+the web server; use `manage.py loadtest` against a running server to compare
+deployments. Queries per request come from the per-view histograms in
+tracking/metrics.py.
+
+- `run_endpoints` measures every URL in tracking/urls.py that has a scenario
+  below. A scenario builds one request, setting up the state it needs (e.g. an
+  assigned job to accept) before the clock starts.
+- `Replay` mixes workloads on a schedule: driver location pings, public
+  tracking polls, dashboard loads and dispatch bursts, run by a pool of
+  worker threads. Schedule lag (how late requests were sent) shows when the
+  pool is saturated.
+- `contention` races read-modify-write updates of a few hot jobs, with
+  optimistic version checks or with select_for_update.
+
+All of them write to the database, so run them against a scratch copy filled by
+`generate_synthetic_data`.
+"""
+import heapq
+import json
+import math
+import queue
+import random
+import threading
+import time
+from collections import namedtuple
+from io import BytesIO
+
+from django.db import DatabaseError, close_old_connections, transaction
+from django.db.models import Max, Min
+from django.test import Client
+from django.utils import timezone
+from PIL import Image
+
+from . import heatmap, metrics, uploads
+from .authentication import issue_token
+from .concurrency import StaleObject, versioned_update
+from .models import Driver, HeatmapTile, Job, Notification, Parcel, TrackingEvent, User
+from .transitions import apply_event, record_booking
+
+BENCH_PREFIX = 'bench'
+BENCH_PASSWORD = 'bench-password'
+SAMPLE_BLOCKS = 20
+
+# One request. `session_user` logs the client in first (outside the timing);
+# `fresh_session` does so again for requests that end the session.
+Call = namedtuple('Call', ['method', 'path', 'data', 'headers', 'session_user', 'fresh_session'],
+                  defaults=(None, None, None, False))
+
+
+class Dataset:
+    """Benchmark users plus a sample of existing rows to draw requests from."""
+
+    def __init__(self, seed=0, sample_size=500):
+        self.rng = random.Random(seed)
+        self._tokens = {}
+        self._lock = threading.Lock()
+        self._sequence = 0
+
+        self.customer = self._user('customer')
+        self.driver = self._user('driver')
+        self.controller = self._user('controller')
+        Driver.objects.get_or_create(user=self.driver)
+
+        # Customers (and the public) can only see parcels that are out for delivery or later
+        trackable = Parcel.objects.filter(can_customer_track=True)
+        self.parcels = self._sample(trackable, ('customer_id', 'tracking_number'), sample_size)
+        self.tracking_numbers = [tracking_number for _, tracking_number in self.parcels]
+        self.driver_ids = sorted({row[0] for row in self._sample(Job.objects.all(), ('driver_id',), sample_size)})
+        self.notified_users = [row[0] for row in self._sample(Notification.objects.all(), ('user_id',), sample_size)]
+        # (layer, zoom, x, y); before the heatmap has been refreshed, the empty tile over the synthetic city
+        self.heatmap_tiles = self._sample(HeatmapTile.objects.all(), ('layer', 'zoom', 'x', 'y'), sample_size)
+        if not self.heatmap_tiles:
+            zoom = heatmap.zooms()[0]
+            x, y = heatmap.world_position(40.7, -74.0)
+            self.heatmap_tiles = [(heatmap.LAYERS[0], zoom, int(x * (1 << zoom)), int(y * (1 << zoom)))]
+        if not (self.parcels and self.driver_ids):
+            raise ValueError("The database has no tracked parcels or jobs; run generate_synthetic_data first")
+
+    def _user(self, user_type):
+        username = f'{BENCH_PREFIX}_{user_type}'
+        user, created = User.objects.get_or_create(
+            username=username, defaults={'user_type': user_type, 'email': f'{username}@example.com'})
+        if created:
+            user.set_password(BENCH_PASSWORD)
+            user.save(update_fields=['password'])
+        return user
+
+    def _sample(self, queryset, fields, size):
+        """Rows from a few random pk ranges; avoids ORDER BY RANDOM() on big tables."""
+        bounds = queryset.model.objects.aggregate(low=Min('pk'), high=Max('pk'))
+        if bounds['low'] is None:
+            return []
+        block = math.ceil(size / SAMPLE_BLOCKS)
+        rows = []
+        for _ in range(SAMPLE_BLOCKS):
+            start = self.rng.randint(bounds['low'], bounds['high'])
+            rows.extend(queryset.filter(pk__gte=start).order_by('pk').values_list(*fields)[:block])
+        return rows
+
+    def choice(self, values):
+        with self._lock:
+            return self.rng.choice(values)
+
+    def unique(self):
+        with self._lock:
+            self._sequence += 1
+            return f'{self.rng.getrandbits(32):08x}{self._sequence}'
+
+    def auth(self, user_id):
+        """Headers authenticating as `user_id` with a signed token."""
+        token = self._tokens.get(user_id)
+        if token is None:
+            token = self._tokens[user_id] = issue_token(User(pk=user_id))[0]
+        return {'HTTP_AUTHORIZATION': f'Bearer {token}'}
+
+    def remote_addr(self):
+        """A random client address, so per-IP throttles see many visitors."""
+        with self._lock:
+            return {'REMOTE_ADDR': f'10.{self.rng.randint(0, 255)}.{self.rng.randint(0, 255)}.{self.rng.randint(1, 254)}'}
+
+    # State for requests that change it
+
+    def new_parcel(self):
+        parcel = Parcel.objects.create(
+            customer=self.customer,
+            pickup_address='1 Benchmark Way',
+            delivery_address='2 Benchmark Way',
+            recipient_name='Benchmark Recipient',
+            recipient_phone='+10000000000',
+            description='Benchmark parcel',
+            weight=1.0,
+            dimensions='10 x 10 x 10',
+        )
+        record_booking(parcel, created_by=self.customer)
+        return parcel
+
+    def job(self, job_type, events=()):
+        """A job for the benchmark driver, with the parcel moved through `events` first."""
+        parcel = self.new_parcel()
+        driver = self.driver.driver
+        for event_type in events:
+            apply_event(parcel, event_type, fields={'current_driver': driver})
+        return Job.objects.create(parcel=parcel, driver=driver, job_type=job_type)
+
+
+# Scenarios: URL name -> function(dataset) returning a Call
+
+SCENARIOS = {}
+
+
+def scenario(name):
+    def decorator(func):
+        SCENARIOS[name] = func
+        return func
+    return decorator
+
+
+@scenario('register')
+def _register(data):
+    username = f'{BENCH_PREFIX}_user_{data.unique()}'
+    return Call('POST', '/api/auth/register/', {
+        'username': username, 'password': BENCH_PASSWORD, 'email': f'{username}@example.com',
+        'user_type': 'customer',
+    })
+
+
+@scenario('login')
+def _login(data):
+    return Call('POST', '/api/auth/login/', {'username': data.customer.username, 'password': BENCH_PASSWORD})
+
+
+@scenario('token_obtain')
+def _token_obtain(data):
+    return Call('POST', '/api/auth/token/', {'username': data.driver.username, 'password': BENCH_PASSWORD})
+
+
+@scenario('token_refresh')
+def _token_refresh(data):
+    return Call('POST', '/api/auth/token/refresh/', headers=data.auth(data.driver.pk))
+
+
+@scenario('logout')
+def _logout(data):
+    return Call('POST', '/api/auth/logout/', headers=data.auth(data.customer.pk))
+
+
+@scenario('book_parcel')
+def _book_parcel(data):
+    return Call('POST', '/api/parcels/book/', {
+        'pickup_address': '1 Benchmark Way', 'delivery_address': '2 Benchmark Way',
+        'recipient_name': 'Benchmark Recipient', 'recipient_phone': '+10000000000',
+        'description': 'Benchmark parcel', 'weight': 1.5, 'dimensions': '10 x 10 x 10',
+    }, headers=data.auth(data.customer.pk))
+
+
+@scenario('customer_parcels')
+def _customer_parcels(data):
+    customer_id, _ = data.choice(data.parcels)
+    return Call('GET', '/api/parcels/my_parcels/', headers=data.auth(customer_id))
+
+
+@scenario('parcel_detail')
+def _parcel_detail(data):
+    customer_id, tracking_number = data.choice(data.parcels)
+    return Call('GET', f'/api/parcels/{tracking_number}/', headers=data.auth(customer_id))
+
+
+@scenario('public_tracking')
+def _public_tracking(data):
+    return Call('GET', f'/api/public/track/{data.choice(data.tracking_numbers)}/', headers=data.remote_addr())
+
+
+@scenario('all_parcels')
+def _all_parcels(data):
+    return Call('GET', '/api/parcels/', headers=data.auth(data.controller.pk))
+
+
+@scenario('search_parcels')
+def _search_parcels(data):
+    return Call('GET', '/api/parcels/search/?q=main', headers=data.auth(data.controller.pk))
+
+
+@scenario('all_drivers')
+def _all_drivers(data):
+    return Call('GET', '/api/drivers/', headers=data.auth(data.controller.pk))
+
+
+@scenario('available_drivers')
+def _available_drivers(data):
+    return Call('GET', '/api/drivers/available/?weight=5&latitude=40.7&longitude=-74.0',
+                headers=data.auth(data.controller.pk))
+
+
+@scenario('load_plan')
+def _load_plan(data):
+    return Call('GET', '/api/loads/plan/', headers=data.auth(data.controller.pk))
+
+
+@scenario('heatmap_coverage')
+def _heatmap_coverage(data):
+    layer, zoom, _, _ = data.choice(data.heatmap_tiles)
+    return Call('GET', f'/api/heatmaps/{layer}/{zoom}/', headers=data.auth(data.controller.pk))
+
+
+@scenario('heatmap_tile')
+def _heatmap_tile(data):
+    layer, zoom, x, y = data.choice(data.heatmap_tiles)
+    return Call('GET', f'/api/heatmaps/{layer}/{zoom}/{x}/{y}/', headers=data.auth(data.controller.pk))
+
+
+@scenario('assign_driver')
+def _assign_driver(data, parcel=None):
+    parcel = parcel or data.new_parcel()
+    return Call('POST', f'/api/parcels/{parcel.pk}/assign_driver/',
+                {'driver_id': data.choice(data.driver_ids), 'job_type': 'pickup'},
+                headers=data.auth(data.controller.pk))
+
+
+@scenario('driver_jobs')
+def _driver_jobs(data):
+    return Call('GET', '/api/jobs/my_jobs/', headers=data.auth(data.choice(data.driver_ids)))
+
+
+@scenario('accept_job')
+def _accept_job(data):
+    job = data.job('pickup', ['pickup_assigned'])
+    return Call('POST', f'/api/jobs/{job.pk}/accept/', headers=data.auth(data.driver.pk))
+
+
+@scenario('scan_parcel')
+def _scan_parcel(data):
+    job = data.job('pickup', ['pickup_assigned'])
+    return Call('POST', f'/api/jobs/{job.pk}/scan_parcel/', headers=data.auth(data.driver.pk))
+
+
+@scenario('complete_delivery')
+def _complete_delivery(data):
+    job = data.job('delivery', ['pickup_assigned', 'collected', 'departed', 'delivery_assigned', 'out_for_delivery'])
+    return Call('POST', f'/api/jobs/{job.pk}/complete_delivery/', {'notes': 'Left at the door'},
+                headers=data.auth(data.driver.pk))
+
+
+@scenario('driver_batch')
+def _driver_batch(data, size=10):
+    jobs = [data.job('pickup', ['pickup_assigned']) for _ in range(size)]
+    actions = [{'action': action, 'job_id': job.pk} for job in jobs for action in ('accept', 'scan')]
+    return Call('POST', '/api/jobs/batch/', {'actions': actions}, headers=data.auth(data.driver.pk))
+
+
+@scenario('update_location')
+def _update_location(data, driver_id=None):
+    with data._lock:
+        latitude, longitude = 40.7 + data.rng.uniform(-0.2, 0.2), -74.0 + data.rng.uniform(-0.2, 0.2)
+    return Call('POST', '/api/driver/update_location/', {'latitude': latitude, 'longitude': longitude},
+                headers=data.auth(driver_id or data.choice(data.driver_ids)))
+
+
+@scenario('upload_create')
+def _upload_create(data):
+    return Call('POST', '/api/uploads/', {'filename': 'proof.jpg', 'size': 1024},
+                headers=data.auth(data.driver.pk))
+
+
+@scenario('upload_session')
+def _upload_session(data):
+    session = uploads.create_session(data.driver, 'proof.jpg', 1024)
+    return Call('GET', f'/api/uploads/{session.pk}/', headers=data.auth(data.driver.pk))
+
+
+@scenario('upload_finalize')
+def _upload_finalize(data):
+    image = BytesIO()
+    Image.new('RGB', (64, 64), 'white').save(image, 'PNG')
+    session = uploads.create_session(data.driver, 'proof.png', image.tell())
+    image.seek(0)
+    uploads.write_chunk(session, image, 0)
+    return Call('POST', f'/api/uploads/{session.pk}/finalize/', headers=data.auth(data.driver.pk))
+
+
+@scenario('notifications')
+def _notifications(data):
+    return Call('GET', '/api/notifications/', headers=data.auth(data.choice(data.notified_users or [data.customer.pk])))
+
+
+@scenario('mark_notification_read')
+def _mark_notification_read(data):
+    notification = Notification.objects.create(user=data.customer, title='Benchmark', message='Benchmark')
+    return Call('POST', f'/api/notifications/{notification.pk}/mark_read/', headers=data.auth(data.customer.pk))
+
+
+def _page(name, path, user=None, fresh_session=False):
+    @scenario(name)
+    def page(data):
+        user_id = getattr(data, user).pk if user else None
+        return Call('GET', path, session_user=user_id, fresh_session=fresh_session)
+    return page
+
+
+_page('home1', '/')
+_page('home', '/home/')
+_page('about-us', '/about-us/')
+_page('services', '/services/')
+_page('login_page', '/login/')
+_page('register_page', '/register/')
+_page('track_parcel', '/track/')
+_page('logout_page', '/logout/', 'customer', fresh_session=True)
+_page('book_parcel_page', '/book-parcel/', 'customer')
+_page('my_parcels', '/my-parcels/', 'customer')
+_page('admin_dashboard', '/admin-dashboard/', 'controller')
+_page('driver_dashboard', '/driver-dashboard/', 'driver')
+_page('profile', '/profile/', 'customer')
+
+
+def uncovered():
+    """URL names in tracking/urls.py without a scenario."""
+    from .urls import urlpatterns
+    return sorted({pattern.name for pattern in urlpatterns if pattern.name not in SCENARIOS})
+
+
+# Running requests
+
+class ClientPool:
+    """Test clients for one thread: an anonymous one and one per session user."""
+
+    def __init__(self):
+        self.anonymous = Client()
+        self.sessions = {}
+
+    def prepare(self, call):
+        """Return the client for `call`, logging in first if needed (not timed)."""
+        if call.session_user is None:
+            self.anonymous.cookies.clear()
+            return self.anonymous
+        client = self.sessions.get(call.session_user)
+        if client is None or call.fresh_session:
+            client = self.sessions[call.session_user] = Client()
+            client.force_login(User.objects.get(pk=call.session_user))
+        return client
+
+    @staticmethod
+    def send(client, call):
+        headers = call.headers or {}
+        if call.method == 'GET':
+            return client.get(call.path, call.data, **headers)
+        return client.generic(call.method, call.path, json.dumps(call.data or {}),
+                              content_type='application/json', **headers)
+
+
+def _query_totals():
+    totals = {}
+    for (view, _), (total, count) in metrics.request_queries.totals().items():
+        previous = totals.get(view, (0, 0))
+        totals[view] = (previous[0] + total, previous[1] + count)
+    return totals
+
+
+def _queries_per_request(before, after, view):
+    total, count = after.get(view, (0, 0))
+    previous_total, previous_count = before.get(view, (0, 0))
+    if count == previous_count:
+        return None
+    return round((total - previous_total) / (count - previous_count), 2)
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(int(len(sorted_values) * fraction), len(sorted_values) - 1)]
+
+
+def summarize(latencies, errors, elapsed, queries=None):
+    latencies = sorted(latencies)
+    done = len(latencies) + errors
+    return {
+        'requests': done,
+        'errors': errors,
+        'rps': round(done / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(_percentile(latencies, 0.50) * 1000, 2),
+        'p95_ms': round(_percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(_percentile(latencies, 0.99) * 1000, 2),
+        'max_ms': round((latencies[-1] if latencies else 0) * 1000, 2),
+        'queries_per_request': queries,
+    }
+
+
+def _execute(calls, concurrency):
+    """Send `calls` from `concurrency` threads; returns (latencies, errors, elapsed)."""
+    position = iter(range(len(calls)))
+    lock = threading.Lock()
+    latencies = []
+    errors = 0
+    started = threading.Barrier(concurrency + 1)
+
+    def worker():
+        nonlocal errors
+        pool = ClientPool()
+        local_latencies, local_errors = [], 0
+        started.wait()
+        try:
+            while True:
+                with lock:
+                    index = next(position, None)
+                if index is None:
+                    break
+                call = calls[index]
+                client = pool.prepare(call)
+                start = time.perf_counter()
+                response = pool.send(client, call)
+                if response.status_code < 400:
+                    local_latencies.append(time.perf_counter() - start)
+                else:
+                    local_errors += 1
+        finally:
+            close_old_connections()
+            with lock:
+                latencies.extend(local_latencies)
+                errors += local_errors
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    started.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return latencies, errors, time.perf_counter() - start
+
+
+def run_endpoints(dataset, names, requests=50, concurrency=1, warmup=5, log=None):
+    """Benchmark each scenario in `names` in turn; returns {name: summary}."""
+    results = {}
+    for name in names:
+        build = SCENARIOS[name]
+        if warmup:
+            _execute([build(dataset) for _ in range(warmup)], 1)
+        calls = [build(dataset) for _ in range(requests)]
+        before = _query_totals()
+        latencies, errors, elapsed = _execute(calls, concurrency)
+        results[name] = summarize(latencies, errors, elapsed,
+                                  _queries_per_request(before, _query_totals(), name))
+        if log:
+            log(name, results[name])
+    return results
+
+
+# Traffic replay
+
+Actor = namedtuple('Actor', ['workload', 'interval', 'calls'])
+
+
+class Replay:
+    """
+    Open-loop traffic mix: every simulated client sends its requests at a
+    fixed interval (with a random initial offset) whether or not earlier
+    requests have finished, like real devices polling.
+    """
+
+    def __init__(self, dataset, duration=60, concurrency=16, drivers=100, ping_interval=10,
+                 trackers=200, poll_interval=30, dashboards=5, dashboard_interval=15,
+                 dispatch_interval=30, dispatch_size=20):
+        self.dataset = dataset
+        self.duration = duration
+        self.concurrency = concurrency
+        self.actors = []
+
+        driver_ids = dataset.driver_ids
+        for i in range(drivers):
+            driver_id = driver_ids[i % len(driver_ids)]
+            self.actors.append(Actor('driver_pings', ping_interval,
+                                     lambda driver_id=driver_id: [('update_location', _update_location(dataset, driver_id))]))
+        for _ in range(trackers):
+            # Each visitor keeps polling one parcel from one address
+            call = _public_tracking(dataset)
+            self.actors.append(Actor('public_tracking', poll_interval, lambda call=call: [('public_tracking', call)]))
+        for _ in range(dashboards):
+            self.actors.append(Actor('dashboard', dashboard_interval, lambda: [
+                ('all_parcels', _all_parcels(dataset)),
+                ('all_drivers', _all_drivers(dataset)),
+                ('notifications', Call('GET', '/api/notifications/', headers=dataset.auth(dataset.controller.pk))),
+            ]))
+        if dispatch_size:
+            # Parcels to dispatch are booked up front, outside the measurement
+            bursts = int(duration // dispatch_interval) + 1
+            self.dispatch_parcels = [dataset.new_parcel() for _ in range(bursts * dispatch_size)]
+            self.actors.append(Actor('dispatch', dispatch_interval, lambda: [
+                ('assign_driver', _assign_driver(dataset, self.dispatch_parcels.pop()))
+                for _ in range(min(dispatch_size, len(self.dispatch_parcels)))
+            ]))
+
+    def run(self):
+        """Returns ({endpoint: summary}, {'lag_p50_ms', 'lag_p95_ms', 'lag_max_ms'})."""
+        work = queue.Queue()
+        lock = threading.Lock()
+        samples = {}
+        lags = []
+
+        def worker():
+            pool = ClientPool()
+            try:
+                while True:
+                    item = work.get()
+                    if item is None:
+                        return
+                    due, name, call = item
+                    client = pool.prepare(call)
+                    start = time.perf_counter()
+                    response = pool.send(client, call)
+                    elapsed = time.perf_counter() - start
+                    with lock:
+                        latencies, errors = samples.setdefault(name, ([], [0]))
+                        if response.status_code < 400:
+                            latencies.append(elapsed)
+                        else:
+                            errors[0] += 1
+                        lags.append(max(start - due, 0))
+            finally:
+                close_old_connections()
+
+        threads = [threading.Thread(target=worker) for _ in range(self.concurrency)]
+        for thread in threads:
+            thread.start()
+
+        before = _query_totals()
+        start = time.perf_counter()
+        end = start + self.duration
+        rng = self.dataset.rng
+        schedule = [(start + rng.uniform(0, actor.interval), i, actor) for i, actor in enumerate(self.actors)]
+        heapq.heapify(schedule)
+        while schedule and schedule[0][0] < end:
+            due, i, actor = heapq.heappop(schedule)
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            for name, call in actor.calls():
+                work.put((due, name, call))
+            heapq.heappush(schedule, (due + actor.interval, i, actor))
+
+        for _ in threads:
+            work.put(None)
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        after = _query_totals()
+
+        results = {
+            name: summarize(latencies, errors[0], elapsed, _queries_per_request(before, after, name))
+            for name, (latencies, errors) in sorted(samples.items())
+        }
+        lags.sort()
+        lag = {
+            'lag_p50_ms': round(_percentile(lags, 0.50) * 1000, 2),
+            'lag_p95_ms': round(_percentile(lags, 0.95) * 1000, 2),
+            'lag_max_ms': round((lags[-1] if lags else 0) * 1000, 2),
+        }
+        return results, lag
+
+
+# Write contention
+
+MAX_RETRIES = 50
+
+
+def _write_optimistic(job_id, hold, value):
+    """Read, think, write guarded on the version; returns the retries needed."""
+    for retries in range(MAX_RETRIES):
+        job = Job.objects.get(pk=job_id)
+        time.sleep(hold)
+        try:
+            versioned_update(job, estimated_arrival_time=value)
+            return retries
+        except StaleObject:
+            continue
+    raise StaleObject(job, None)
+
+
+def _write_locking(job_id, hold, value):
+    with transaction.atomic():
+        job = Job.objects.select_for_update().get(pk=job_id)
+        time.sleep(hold)
+        job.estimated_arrival_time = value
+        job.save(update_fields=['estimated_arrival_time', 'updated_at'])
+    return 0
+
+
+CONTENTION_STRATEGIES = {'optimistic': _write_optimistic, 'locking': _write_locking}
+
+
+def contention(dataset, strategy, rows=10, concurrency=8, operations=500, hold_ms=2.0):
+    """
+    Concurrent read-modify-write of a few hot jobs, like a controller and
+    drivers updating the same jobs. Each operation reads a job, spends
+    `hold_ms` on the decision (the rest of the view's work) and writes an
+    ETA back: `optimistic` without locks, retrying on StaleObject (see
+    tracking/concurrency.py); `locking` inside a transaction with
+    select_for_update. Returns a summary plus the number of retries.
+    """
+    write = CONTENTION_STRATEGIES[strategy]
+    job_ids = [dataset.job('delivery').pk for _ in range(rows)]
+    hold = hold_ms / 1000
+    position = iter(range(operations))
+    lock = threading.Lock()
+    latencies = []
+    errors = retries = 0
+    started = threading.Barrier(concurrency + 1)
+
+    def worker():
+        nonlocal errors, retries
+        local_latencies, local_errors, local_retries = [], 0, 0
+        started.wait()
+        try:
+            while True:
+                with lock:
+                    index = next(position, None)
+                if index is None:
+                    break
+                job_id = dataset.choice(job_ids)
+                start = time.perf_counter()
+                try:
+                    local_retries += write(job_id, hold, timezone.now())
+                except (DatabaseError, StaleObject):
+                    local_errors += 1
+                else:
+                    local_latencies.append(time.perf_counter() - start)
+        finally:
+            close_old_connections()
+            with lock:
+                latencies.extend(local_latencies)
+                errors += local_errors
+                retries += local_retries
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    started.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return {**summarize(latencies, errors, time.perf_counter() - start), 'retries': retries}
+
+
+# Reports
+
+def report(mode, options, results, **extra):
+    return {
+        'mode': mode,
+        'created_at': timezone.now().isoformat(),
+        'dataset': {
+            'parcels': Parcel.objects.everywhere().count(),
+            'tracking_events': TrackingEvent.objects.everywhere().count(),
+            'drivers': Driver.objects.count(),
+        },
+        'options': options,
+        'results': results,
+        **extra,
+    }
+
+
+def compare(baseline, current, threshold=0.2, min_delta_ms=1.0):
+    """
+    List regressions of `current` against `baseline` (both report dicts): a
+    latency percentile more than `threshold` (and `min_delta_ms`) slower,
+    more queries per request, or a higher error rate.
+    """
+    regressions = []
+    for name, result in current['results'].items():
+        before = baseline['results'].get(name)
+        if before is None:
+            continue
+        for key in ('p50_ms', 'p95_ms', 'p99_ms'):
+            if result[key] > before[key] * (1 + threshold) and result[key] - before[key] >= min_delta_ms:
+                regressions.append(f"{name}: {key} {before[key]} -> {result[key]}")
+        queries, previous_queries = result['queries_per_request'], before['queries_per_request']
+        if queries is not None and previous_queries is not None and queries > previous_queries:
+            regressions.append(f"{name}: queries per request {previous_queries} -> {queries}")
+        error_rate = result['errors'] / result['requests'] if result['requests'] else 0
+        previous_rate = before['errors'] / before['requests'] if before['requests'] else 0
+        if error_rate > previous_rate:
+            regressions.append(f"{name}: error rate {previous_rate:.1%} -> {error_rate:.1%}")
+    return regressions
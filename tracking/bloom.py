@@ -0,0 +1,141 @@
+"""
+In-memory Bloom filter of known tracking numbers.
+
+The public_tracking view checks it before touching the database so guessed
+tracking numbers are rejected without a query. The filter is built from the
+Parcel and ArchivedParcel tables when a server process starts (wsgi.py /
+asgi.py), or on first use if that failed, and updated when a parcel is
+booked in this process. Parcels booked by another worker process are picked
+up by an incremental refresh (parcels with a higher id than the last one
+seen on each shard) that runs at most once every BLOOM_REFRESH_INTERVAL
+seconds, and only when a lookup misses.
+"""
+import hashlib
+import logging
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from . import sharding
+from .models import ArchivedParcel, Parcel
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = max(int(capacity), 1)
+        self.error_rate = error_rate
+        self.size = max(int(-self.capacity * math.log(error_rate) / (math.log(2) ** 2)), 8)
+        self.hashes = max(int(round(self.size / self.capacity * math.log(2))), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        # Double hashing: two 64-bit halves of one digest give all k positions
+        digest = hashlib.blake2b(str(item).encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7))
+                   for position in self._positions(item))
+
+
+class TrackingNumberFilter:
+    def __init__(self):
+        self._filter = None
+        self._last_parcel_ids = {}
+        self._last_refresh = 0.0
+        self._lock = threading.Lock()
+
+    def _setting(self, name, default):
+        return getattr(settings, name, default)
+
+    def build(self):
+        """(Re)build the filter from every live and archived tracking number."""
+        with self._lock:
+            expected = Parcel.objects.everywhere().count() + ArchivedParcel.objects.count()
+            bloom = BloomFilter(
+                max(expected * 2, self._setting('BLOOM_MIN_CAPACITY', 100000)),
+                self._setting('BLOOM_ERROR_RATE', 0.001),
+            )
+            last_ids = {}
+            for alias in sharding.shards():
+                last_id = 0
+                parcels = Parcel.objects.using(alias).values_list('pk', 'tracking_number')
+                for pk, tracking_number in parcels.iterator(chunk_size=10000):
+                    bloom.add(tracking_number)
+                    last_id = max(last_id, pk)
+                last_ids[alias] = last_id
+            for tracking_number in ArchivedParcel.objects.values_list('tracking_number', flat=True).iterator(chunk_size=10000):
+                bloom.add(tracking_number)
+            self._filter = bloom
+            self._last_parcel_ids = last_ids
+            self._last_refresh = time.monotonic()
+
+    def start(self):
+        """Build the filter before the first request; once per server process."""
+        try:
+            self.build()
+        except DatabaseError:
+            # E.g. before the first migrate; lookups will build it
+            logger.exception("Could not build the tracking number filter")
+        finally:
+            connections.close_all()
+
+    def refresh(self):
+        """Add parcels booked since the last build/refresh (e.g. by other processes)."""
+        with self._lock:
+            self._last_refresh = time.monotonic()
+            for alias in sharding.shards():
+                last_id = self._last_parcel_ids.get(alias, 0)
+                new = Parcel.objects.using(alias).filter(pk__gt=last_id).values_list('pk', 'tracking_number')
+                for pk, tracking_number in new.iterator(chunk_size=10000):
+                    self._filter.add(tracking_number)
+                    last_id = max(last_id, pk)
+                self._last_parcel_ids[alias] = last_id
+            overfull = self._filter.count > self._filter.capacity
+        if overfull:
+            self.build()
+
+    def add(self, tracking_number):
+        if self._filter is None:
+            return
+        with self._lock:
+            self._filter.add(tracking_number)
+
+    def might_exist(self, tracking_number):
+        if self._filter is None:
+            self.build()
+        if tracking_number in self._filter:
+            return True
+        interval = self._setting('BLOOM_REFRESH_INTERVAL', 5)
+        if time.monotonic() - self._last_refresh >= interval:
+            self.refresh()
+            return tracking_number in self._filter
+        return False
+
+    def reset(self):
+        with self._lock:
+            self._filter = None
+
+
+tracking_numbers = TrackingNumberFilter()
+
+
+@receiver(post_save, sender=Parcel)
+def _add_booked_parcel(sender, instance, created, **kwargs):
+    if created:
+        tracking_numbers.add(instance.tracking_number)
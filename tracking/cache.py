@@ -0,0 +1,371 @@
+"""
+Two-tier response cache for read-heavy views.
+
+Lookups go to a small in-process LRU first and then to the shared Django cache
+(Redis when REDIS_URL is set, otherwise an in-memory LocMemCache). Entries
+carry tags such as `parcel:<id>`, `driver:<id>` and `user:<id>`; invalidating
+a tag sets its version in the shared cache to the current time, so every
+entry cached under the old version is treated as a miss from then on. Local
+entries are dropped immediately in the invalidating process and live at
+most CACHE_LOCAL_TTL seconds in the others.
+
+A value is stored under the tag versions read before it was computed, so an
+invalidation that lands while it is being computed leaves it stale rather
+than hiding the change.
+
+Concurrent misses for the same key are collapsed: one thread per process
+computes the value, and across processes the first one to take a short lock
+in the shared cache computes it while the rest wait for the result.
+
+Views opt in with CachedViewMixin (DRF) or the @cached_view decorator;
+@cached_page caches public pages once for all anonymous visitors.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.core.cache import cache as shared_cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+from rest_framework.response import Response
+
+from .models import AboutSection, Driver, Job, Parcel, TrackingEvent, User
+
+_MISSING = object()
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def parcel_tag(parcel_id):
+    return f'parcel:{parcel_id}'
+
+
+def driver_tag(driver_id):
+    return f'driver:{driver_id}'
+
+
+def user_tag(user_id):
+    return f'user:{user_id}'
+
+
+def stops_tag(driver_id):
+    """The stops a driver's geofence watches (tracking/geofence.py)."""
+    return f'stops:{driver_id}'
+
+
+class LocalCache:
+    """Thread-safe, size-bounded LRU with per-entry expiry and tags."""
+
+    def __init__(self, maxsize=2048):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return _MISSING
+            expires, _tags, value = entry
+            if expires <= now:
+                del self._data[key]
+                return _MISSING
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl, tags=()):
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, frozenset(tags), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, tags):
+        tags = set(tags)
+        with self._lock:
+            stale = [key for key, (_, entry_tags, _) in self._data.items() if entry_tags & tags]
+            for key in stale:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class TieredCache:
+    def __init__(self, backend, local):
+        self.backend = backend
+        self.local = local
+        self._key_locks = {}
+        self._key_locks_guard = threading.Lock()
+
+    def _tag_key(self, tag):
+        return f'tag:{tag}'
+
+    def _tag_versions(self, tags, create=False, now=None):
+        if not tags:
+            return {}
+        keys = {self._tag_key(tag): tag for tag in tags}
+        found = self.backend.get_many(list(keys))
+        versions = {keys[key]: value for key, value in found.items()}
+        if create:
+            for tag in set(tags) - set(versions):
+                # Start from a clock value so a tag evicted from the backend
+                # never comes back with a version an old entry still carries
+                self.backend.add(self._tag_key(tag), now or time.time_ns(), None)
+                versions[tag] = self.backend.get(self._tag_key(tag))
+        return versions
+
+    def _get_shared(self, key):
+        entry = self.backend.get(key)
+        if entry is None:
+            return _MISSING, ()
+        versions, value = entry
+        if versions and self._tag_versions(versions) != versions:
+            return _MISSING, ()
+        return value, tuple(versions)
+
+    def get(self, key):
+        value = self.local.get(key)
+        if value is not _MISSING:
+            return value
+        value, tags = self._get_shared(key)
+        if value is not _MISSING:
+            self.local.set(key, value, _setting('CACHE_LOCAL_TTL', 5), tags)
+        return value
+
+    def set(self, key, value, timeout, tags=(), versions=None):
+        """Store `value`; pass the tag `versions` read before computing it."""
+        if versions is None:
+            versions = self._tag_versions(tags, create=True)
+        self.backend.set(key, (versions, value), timeout)
+        self.local.set(key, value, min(timeout, _setting('CACHE_LOCAL_TTL', 5)), tags)
+
+    def invalidate(self, *tags):
+        now = time.time_ns()
+        self.backend.set_many({self._tag_key(tag): now for tag in tags}, None)
+        self.local.invalidate(tags)
+
+    def _key_lock(self, key):
+        with self._key_locks_guard:
+            lock, users = self._key_locks.get(key, (None, 0))
+            if lock is None:
+                lock = threading.Lock()
+            self._key_locks[key] = (lock, users + 1)
+        return lock
+
+    def _release_key_lock(self, key):
+        with self._key_locks_guard:
+            lock, users = self._key_locks[key]
+            if users == 1:
+                del self._key_locks[key]
+            else:
+                self._key_locks[key] = (lock, users - 1)
+
+    def get_or_set(self, key, producer, timeout, tags=(), cacheable=None):
+        """
+        Return the cached value for `key`, calling `producer()` on a miss.
+
+        `tags` may be a callable taking the produced value. If `cacheable`
+        is given and returns False for the produced value, it is returned
+        without being stored.
+        """
+        value = self.get(key)
+        if value is not _MISSING:
+            return value
+
+        lock = self._key_lock(key)
+        try:
+            with lock:
+                value = self.get(key)
+                if value is not _MISSING:
+                    return value
+                return self._produce(key, producer, timeout, tags, cacheable)
+        finally:
+            self._release_key_lock(key)
+
+    def _produce(self, key, producer, timeout, tags, cacheable):
+        lock_key = f'lock:{key}'
+        lock_timeout = _setting('CACHE_LOCK_TIMEOUT', 10)
+        locked = self.backend.add(lock_key, 1, lock_timeout)
+        if not locked:
+            # Another process is computing it; wait for its result, then
+            # fall back to computing it ourselves
+            deadline = time.monotonic() + lock_timeout
+            while not locked and time.monotonic() < deadline:
+                time.sleep(0.05)
+                value = self.get(key)
+                if value is not _MISSING:
+                    return value
+                locked = self.backend.add(lock_key, 1, lock_timeout)
+        try:
+            if callable(tags):
+                # The tags depend on the value; check below that none of them
+                # was invalidated after this
+                started, versions = time.time_ns(), None
+            else:
+                versions = self._tag_versions(tags, create=True)
+            value = producer()
+            if cacheable is None or cacheable(value):
+                if versions is None:
+                    tags = tags(value)
+                    versions = self._tag_versions(tags, create=True, now=started)
+                    if any(version > started for version in versions.values()):
+                        return value
+                self.set(key, value, timeout, tags, versions)
+            return value
+        finally:
+            if locked:
+                self.backend.delete(lock_key)
+
+
+cache = TieredCache(shared_cache, LocalCache(maxsize=_setting('CACHE_LOCAL_SIZE', 2048)))
+
+
+def invalidate(*tags):
+    """Invalidate `tags` once the current transaction (if any) commits."""
+    tags = [tag for tag in tags if tag]
+    if tags:
+        transaction.on_commit(lambda: cache.invalidate(*tags))
+
+
+def _request_key(prefix, request):
+    user = request.user
+    user_part = user.pk if user.is_authenticated else 'anon'
+    digest = hashlib.blake2b(request.build_absolute_uri().encode(), digest_size=16).hexdigest()
+    return f'view:{prefix}:{user_part}:{digest}'
+
+
+class CachedViewMixin:
+    """
+    Cache successful GET responses of a DRF view per user and URL.
+
+    Set `cache_timeout` and override `get_cache_tags(data)` to return the tags
+    whose invalidation should evict the response.
+    """
+    cache_timeout = 60
+
+    def get_cache_tags(self, data):
+        return [user_tag(self.request.user.pk)]
+
+    def get(self, request, *args, **kwargs):
+        response = None
+
+        def produce():
+            nonlocal response
+            response = super(CachedViewMixin, self).get(request, *args, **kwargs)
+            return response.data
+
+        data = cache.get_or_set(
+            _request_key(type(self).__name__, request), produce, self.cache_timeout,
+            tags=self.get_cache_tags,
+            cacheable=lambda data: response.status_code == 200,
+        )
+        return response if response is not None else Response(data)
+
+
+def _cached_response(key, view, request, args, kwargs, timeout, tags):
+    response = None
+
+    def produce():
+        nonlocal response
+        response = view(request, *args, **kwargs)
+        return response.content, response['Content-Type']
+
+    content, content_type = cache.get_or_set(
+        key, produce, timeout, tags=tags,
+        # Pages that rendered a CSRF token are specific to the client
+        cacheable=lambda value: (response.status_code == 200
+                                 and not request.META.get('CSRF_COOKIE_NEEDS_UPDATE')),
+    )
+    if response is not None:
+        return response
+    return HttpResponse(content, content_type=content_type)
+
+
+def cached_view(timeout=60, tags=()):
+    """Cache a function view's successful GET responses per user and URL."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method != 'GET':
+                return view(request, *args, **kwargs)
+            return _cached_response(_request_key(view.__name__, request), view, request,
+                                    args, kwargs, timeout, tags)
+        return wrapper
+    return decorator
+
+
+def cached_page(timeout=300, tags=()):
+    """
+    Cache a page's GET responses for anonymous visitors, shared by all of them.
+
+    Signed-in users (and visitors with a flash message waiting) get a freshly
+    rendered page, since the navigation and messages depend on them. A cache
+    hit runs no queries: an anonymous request without a session cookie never
+    loads a session or user. Responses vary on Cookie so HTTP caches in front
+    keep the two apart too.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if (request.method != 'GET' or request.user.is_authenticated
+                    or CookieStorage.cookie_name in request.COOKIES):
+                response = view(request, *args, **kwargs)
+            else:
+                response = _cached_response(_request_key(f'page:{view.__name__}', request), view, request,
+                                            args, kwargs, timeout, ('pages',) + tuple(tags))
+            patch_vary_headers(response, ('Cookie',))
+            return response
+        return wrapper
+    return decorator
+
+
+# Rows changed with .update() (transitions.apply_event, the job views'
+# versioned updates, media processing) don't send signals; those call
+# invalidate() themselves.
+
+@receiver(post_save, sender=Parcel)
+@receiver(post_delete, sender=Parcel)
+def _invalidate_parcel(sender, instance, **kwargs):
+    invalidate(parcel_tag(instance.pk), user_tag(instance.customer_id))
+
+
+@receiver(post_save, sender=TrackingEvent)
+@receiver(post_delete, sender=TrackingEvent)
+def _invalidate_tracking_event(sender, instance, **kwargs):
+    invalidate(parcel_tag(instance.parcel_id))
+
+
+@receiver(post_save, sender=Job)
+@receiver(post_delete, sender=Job)
+def _invalidate_job(sender, instance, **kwargs):
+    invalidate(parcel_tag(instance.parcel_id), driver_tag(instance.driver_id), stops_tag(instance.driver_id))
+
+
+@receiver(post_save, sender=Driver)
+@receiver(post_delete, sender=Driver)
+def _invalidate_driver(sender, instance, **kwargs):
+    invalidate(driver_tag(instance.pk), 'drivers')
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def _invalidate_user(sender, instance, **kwargs):
+    invalidate(user_tag(instance.pk), 'drivers' if instance.user_type == 'driver' else None)
+
+
+@receiver(post_save, sender=AboutSection)
+@receiver(post_delete, sender=AboutSection)
+def _invalidate_about(sender, instance, **kwargs):
+    invalidate('about')
@@ -0,0 +1,53 @@
+"""
+Optimistic concurrency for Job and Parcel.
+
+Both carry a `version` counter (models.VersionedModel). A state change reads
+the row without locking it and then writes only the columns it changed:
+
+    UPDATE ... SET status = ..., version = version + 1
+    WHERE id = ... AND version = <version that was read>
+
+If another request changed the row in between, no row matches and
+StaleObject is raised carrying the row as it is now; the views answer 409
+with that state so the client can look again and retry. Nothing is held
+between the read and the write, so concurrent writers never wait on each
+other, whereas select_for_update keeps the row (on SQLite, the whole
+database) locked until the transaction ends. `manage.py benchmark_api
+contention` compares the two under load.
+"""
+from django.db.models import F
+from django.utils import timezone
+
+
+class StaleObject(Exception):
+    """The row changed (or was deleted) since it was read; `current` is its
+    state now, or None."""
+
+    def __init__(self, instance, current):
+        self.instance = instance
+        self.current = current
+        super().__init__(
+            f"{type(instance)._meta.verbose_name.capitalize()} {instance.pk} was changed by another request")
+
+
+def current_state(model, pk):
+    return model._default_manager.filter(pk=pk).values().first()
+
+
+def versioned_update(instance, **changes):
+    """
+    Write `changes` to `instance`'s row only if it is still at
+    `instance.version`, bumping the version; raise StaleObject otherwise.
+    `instance` is updated in place.
+    """
+    model = type(instance)
+    # update() skips auto_now
+    if any(field.name == 'updated_at' for field in model._meta.concrete_fields):
+        changes.setdefault('updated_at', timezone.now())
+    updated = model._default_manager.filter(pk=instance.pk, version=instance.version).update(
+        version=F('version') + 1, **changes)
+    if not updated:
+        raise StaleObject(instance, current_state(model, instance.pk))
+    for name, value in changes.items():
+        setattr(instance, name, value)
+    instance.version += 1
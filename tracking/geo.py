@@ -0,0 +1,179 @@
+"""
+Coordinates for parcel addresses.
+
+Addresses are free text, so they are matched on a normalized form (case,
+punctuation and spacing folded) against the GeocodedAddress table, a local
+cache filled from a gazetteer file (`manage.py load_gazetteer`) and by the
+optional GEOCODER, a dotted path to a function taking an address and
+returning (latitude, longitude) or None.
+
+Booking only looks the addresses up in the table; when one is missing and a
+geocoder is configured, `locate_parcel` runs in the background, so a slow or
+unavailable geocoder never holds up a request.
+"""
+import hashlib
+import math
+import re
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.module_loading import import_string
+
+from . import sharding
+from .cache import invalidate, stops_tag
+from .models import GeocodedAddress, Job, Parcel
+from .taskqueue import task
+
+EARTH_RADIUS_M = 6371008.8
+METERS_PER_DEGREE = 111320.0
+
+STOPS = (
+    ('pickup', 'pickup_address', 'pickup_latitude', 'pickup_longitude'),
+    ('delivery', 'delivery_address', 'delivery_latitude', 'delivery_longitude'),
+)
+
+
+def normalize_address(address):
+    return ' '.join(re.sub(r'[^\w]+', ' ', address.casefold()).split())
+
+
+def address_key(address):
+    return hashlib.sha256(normalize_address(address).encode()).hexdigest()
+
+
+def distance_m(lat1, lng1, lat2, lng2):
+    """Great-circle distance in meters."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lng2 - lng1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+def cached_coordinates(addresses):
+    """{address: (latitude, longitude)} for those of `addresses` in the table."""
+    keys = {address_key(address): address for address in addresses if address}
+    found = GeocodedAddress.objects.filter(key__in=keys).values_list('key', 'latitude', 'longitude')
+    return {keys[key]: (latitude, longitude) for key, latitude, longitude in found}
+
+
+def remember(address, latitude, longitude, source='gazetteer'):
+    GeocodedAddress.objects.update_or_create(
+        key=address_key(address),
+        defaults={'address': normalize_address(address), 'latitude': latitude,
+                  'longitude': longitude, 'source': source},
+    )
+
+
+def geocoder():
+    path = getattr(settings, 'GEOCODER', None)
+    return import_string(path) if path else None
+
+
+def geocode(address):
+    """Coordinates of `address` from the table, or from the geocoder (then cached)."""
+    found = cached_coordinates([address]).get(address)
+    if found is None:
+        lookup = geocoder()
+        found = lookup(address) if lookup else None
+        if found is not None:
+            remember(address, *found, source='geocoder')
+    return found
+
+
+def parcel_coordinates(pickup_address, delivery_address):
+    """Coordinate fields for a new parcel, from the table only."""
+    found = cached_coordinates([pickup_address, delivery_address])
+    fields = {}
+    for address, (_, _, lat_field, lng_field) in zip((pickup_address, delivery_address), STOPS):
+        if address in found:
+            fields[lat_field], fields[lng_field] = found[address]
+    return fields
+
+
+def needs_geocoding(parcel):
+    return geocoder() is not None and any(getattr(parcel, lat_field) is None for _, _, lat_field, _ in STOPS)
+
+
+@task()
+def locate_parcel(parcel_id):
+    """Fill in a parcel's missing coordinates."""
+    parcel = Parcel.objects.filter(pk=parcel_id).first()
+    if parcel is None:
+        return
+    fields = {}
+    for _, address_field, lat_field, lng_field in STOPS:
+        if getattr(parcel, lat_field) is None:
+            found = geocode(getattr(parcel, address_field))
+            if found is not None:
+                fields[lat_field], fields[lng_field] = found
+    if fields:
+        # Coordinates aren't part of the parcel's state, so no version bump
+        Parcel.objects.filter(pk=parcel_id).update(**fields)
+        # Jobs may already be assigned; their drivers' geofences need the new stops
+        invalidate(*(stops_tag(driver_id) for driver_id in parcel.jobs.values_list('driver_id', flat=True)))
+
+
+def load_gazetteer(rows, batch_size=1000):
+    """Upsert (address, latitude, longitude) rows into the table; returns the count."""
+    count = 0
+    batch = {}
+
+    def flush():
+        GeocodedAddress.objects.bulk_create(
+            batch.values(), update_conflicts=True, unique_fields=['key'],
+            update_fields=['address', 'latitude', 'longitude', 'source'],
+        )
+        batch.clear()
+
+    for address, latitude, longitude in rows:
+        key = address_key(address)
+        batch[key] = GeocodedAddress(key=key, address=normalize_address(address),
+                                     latitude=float(latitude), longitude=float(longitude))
+        count += 1
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    return count
+
+
+def backfill_coordinates(batch_size=500, use_geocoder=False):
+    """Fill in missing coordinates of open parcels; returns how many changed."""
+    missing = Q()
+    for _, _, lat_field, _ in STOPS:
+        missing |= Q(**{f'{lat_field}__isnull': True})
+    return sum(_backfill_shard(alias, missing, batch_size, use_geocoder) for alias in sharding.shards())
+
+
+def _backfill_shard(alias, missing, batch_size, use_geocoder):
+    changed = 0
+    last_pk = 0
+    open_parcels = Parcel.objects.using(alias).filter(missing, closed_at__isnull=True).order_by('pk')
+    while True:
+        parcels = list(open_parcels.filter(pk__gt=last_pk)[:batch_size])
+        if not parcels:
+            return changed
+        last_pk = parcels[-1].pk
+        found = cached_coordinates({getattr(parcel, field) for parcel in parcels
+                                    for _, field, _, _ in STOPS})
+        updated = []
+        for parcel in parcels:
+            before = [getattr(parcel, lat_field) for _, _, lat_field, _ in STOPS]
+            for _, address_field, lat_field, lng_field in STOPS:
+                address = getattr(parcel, address_field)
+                if getattr(parcel, lat_field) is not None:
+                    continue
+                coordinates = found.get(address)
+                if coordinates is None and use_geocoder:
+                    coordinates = geocode(address)
+                if coordinates is not None:
+                    setattr(parcel, lat_field, coordinates[0])
+                    setattr(parcel, lng_field, coordinates[1])
+            if [getattr(parcel, lat_field) for _, _, lat_field, _ in STOPS] != before:
+                updated.append(parcel)
+        Parcel.objects.using(alias).bulk_update(
+            updated, [field for _, _, lat, lng in STOPS for field in (lat, lng)])
+        drivers = Job.objects.using(alias).filter(parcel__in=updated).values_list('driver_id', flat=True).distinct()
+        invalidate(*(stops_tag(driver_id) for driver_id in drivers))
+        changed += len(updated)
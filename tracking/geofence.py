@@ -0,0 +1,165 @@
+"""
+Arrival events from driver location pings.
+
+Each driver's active stops (the pickup address of a pickup job not yet
+collected, the delivery address of an accepted delivery job) are kept in a
+StopGrid: a dict of square cells of GEOFENCE_ARRIVING_M, so a ping only
+measures the stops in the cells around it. The grid is cached per driver
+under stops_tag(driver) and rebuilt, with one query on the driver's jobs,
+after any of them changes, so a ping costs at most the driver's own active
+stops and never looks at other parcels.
+
+Coming within GEOFENCE_ARRIVING_M of a stop records an "arriving" tracking
+event and notifies the customer; within GEOFENCE_ARRIVED_M, "arrived".
+Job.geofence_status only moves forward, with a guarded UPDATE, so each stop
+gets each event once however many pings (or processes) see it. Stops without
+coordinates (see tracking/geo.py) are skipped.
+"""
+import math
+from collections import defaultdict, namedtuple
+
+from django.conf import settings
+from django.db.models import Q
+
+from . import sharding
+from .cache import cache, invalidate, stops_tag
+from .geo import METERS_PER_DEGREE, distance_m
+from .models import Job, TrackingEvent
+from .notifications import notify
+from .taskqueue import defer
+
+STAGES = ('', 'arriving', 'arrived')
+
+# Job statuses in which the driver is still heading for the job's stop
+ACTIVE_STATUSES = {
+    'pickup': ('assigned', 'accepted'),
+    'delivery': ('accepted', 'en_route'),
+}
+
+TEXT = {
+    ('pickup', 'arriving'): ('Driver arriving for pickup', 'Driver is about {distance} m from the pickup address',
+                             'Driver Nearby', 'The driver collecting parcel {tracking_number} is about {distance} m away'),
+    ('pickup', 'arrived'): ('Driver arrived for pickup', 'Driver is at the pickup address',
+                            'Driver Arrived', 'The driver collecting parcel {tracking_number} has arrived'),
+    ('delivery', 'arriving'): ('Driver arriving', 'Driver is about {distance} m from the delivery address',
+                               'Driver Nearby', 'The driver delivering parcel {tracking_number} is about {distance} m away'),
+    ('delivery', 'arrived'): ('Driver arrived', 'Driver is at the delivery address',
+                              'Driver Arrived', 'The driver delivering parcel {tracking_number} has arrived'),
+}
+
+Stop = namedtuple('Stop', ['job_id', 'job_type', 'stage', 'parcel_id', 'customer_id', 'tracking_number',
+                           'latitude', 'longitude'])
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class StopGrid:
+    """Stops bucketed into cells of about `cell_m` meters."""
+
+    def __init__(self, stops, cell_m):
+        self.cell_m = cell_m
+        self.lat_step = cell_m / METERS_PER_DEGREE
+        self.cells = defaultdict(list)
+        for stop in stops:
+            self.cells[self._cell(stop.latitude, stop.longitude)].append(stop)
+        self.cells = dict(self.cells)
+
+    def __len__(self):
+        return sum(len(stops) for stops in self.cells.values())
+
+    def _cell(self, latitude, longitude):
+        # Fixed steps in degrees; near() widens the search where a degree of
+        # longitude is short
+        return math.floor(latitude / self.lat_step), math.floor(longitude / self.lat_step)
+
+    def near(self, latitude, longitude, radius_m):
+        """Stops in the cells within `radius_m` of the point (a superset of those in range)."""
+        if not self.cells:
+            return []
+        row, col = self._cell(latitude, longitude)
+        rows = math.ceil(radius_m / self.cell_m)
+        meters_per_col = self.cell_m * max(math.cos(math.radians(latitude)), 1e-6)
+        cols = math.ceil(radius_m / meters_per_col)
+        found = []
+        for r in range(row - rows, row + rows + 1):
+            for c in range(col - cols, col + cols + 1):
+                found.extend(self.cells.get((r, c), ()))
+        return found
+
+
+def active_stops(driver_id):
+    stops = []
+    jobs = (
+        Job.objects.filter(driver_id=driver_id, geofence_status__in=STAGES[:-1])
+        .filter(Q(job_type='pickup', status__in=ACTIVE_STATUSES['pickup'],
+                  parcel__pickup_latitude__isnull=False, parcel__pickup_longitude__isnull=False)
+                | Q(job_type='delivery', status__in=ACTIVE_STATUSES['delivery'],
+                    parcel__delivery_latitude__isnull=False, parcel__delivery_longitude__isnull=False))
+        .values_list('pk', 'job_type', 'geofence_status', 'parcel_id', 'parcel__customer_id',
+                     'parcel__tracking_number', 'parcel__pickup_latitude', 'parcel__pickup_longitude',
+                     'parcel__delivery_latitude', 'parcel__delivery_longitude')
+        .everywhere()
+    )
+    for (job_id, job_type, stage, parcel_id, customer_id, tracking_number,
+         pickup_lat, pickup_lng, delivery_lat, delivery_lng) in jobs:
+        latitude, longitude = (pickup_lat, pickup_lng) if job_type == 'pickup' else (delivery_lat, delivery_lng)
+        stops.append(Stop(job_id, job_type, stage, parcel_id, customer_id, tracking_number, latitude, longitude))
+    return stops
+
+
+def stop_grid(driver_id):
+    return cache.get_or_set(
+        f'geofence:{driver_id}',
+        lambda: StopGrid(active_stops(driver_id), _setting('GEOFENCE_ARRIVING_M', 500)),
+        _setting('GEOFENCE_INDEX_TTL', 600),
+        tags=[stops_tag(driver_id)],
+    )
+
+
+def _advance(driver_id, stop, stage, distance):
+    """Move the job's geofence status forward to `stage`, once, with its event."""
+    tracking_text, tracking_notes, title, message = TEXT[stop.job_type, stage]
+    distance = round(distance, -1)
+    with sharding.atomic(sharding.shard_for_id(stop.job_id)):
+        advanced = Job.objects.filter(
+            pk=stop.job_id,
+            status__in=ACTIVE_STATUSES[stop.job_type],
+            geofence_status__in=STAGES[:STAGES.index(stage)],
+        ).update(geofence_status=stage)
+        if not advanced:
+            return False
+        TrackingEvent.objects.create(
+            parcel_id=stop.parcel_id,
+            status_update=tracking_text,
+            notes=tracking_notes.format(distance=int(distance)),
+            created_by_id=driver_id,
+        )
+        defer(
+            notify, stop.customer_id,
+            title=title,
+            message=message.format(tracking_number=stop.tracking_number, distance=int(distance)),
+            parcel_id=stop.parcel_id,
+        )
+    return True
+
+
+def check_ping(driver_id, latitude, longitude):
+    """Emit the arrival events a ping at (latitude, longitude) triggers; returns [(job_id, stage)]."""
+    arriving_m = _setting('GEOFENCE_ARRIVING_M', 500)
+    arrived_m = _setting('GEOFENCE_ARRIVED_M', 75)
+    emitted = []
+    for stop in stop_grid(driver_id).near(latitude, longitude, arriving_m):
+        distance = distance_m(latitude, longitude, stop.latitude, stop.longitude)
+        if distance <= arrived_m:
+            stage = 'arrived'
+        elif distance <= arriving_m:
+            stage = 'arriving'
+        else:
+            continue
+        if STAGES.index(stage) > STAGES.index(stop.stage) and _advance(driver_id, stop, stage, distance):
+            emitted.append((stop.job_id, stage))
+    if emitted:
+        invalidate(stops_tag(driver_id))
+    return emitted
@@ -0,0 +1,199 @@
+"""
+Heatmaps of where drivers spend their time and where parcels are picked up
+and delivered.
+
+Points are binned on the Web Mercator tile grid of the dashboard map: at each
+zoom in HEATMAP_ZOOMS every map tile is split into HEATMAP_TILE_BINS squared
+cells, and one HeatmapTile row per layer and tile holds the cell counts as a
+uint32 array. Tiles are keyed by quadkey, so the tiles inside a bigger one
+share its quadkey as a prefix. Serving a tile is a single-row read; nothing
+is aggregated per request.
+
+`refresh()` (`manage.py build_heatmaps`, e.g. from cron) adds the points
+recorded since its previous run, a batch at a time. Each batch is read past a
+HeatmapCursor, binned for every zoom at once with NumPy, added into the tiles
+it touches, and the cursor moved, all in one transaction. So a run can be
+interrupted or overlap another one without counting anything twice. The
+layers are:
+
+- drivers: location pings. Apps ping at a steady rate, so counts follow time
+  spent.
+- pickups and deliveries: parcel addresses, once geocoded. A parcel waiting
+  for the geocoder holds back its shard's parcels for up to
+  HEATMAP_GEOCODE_WAIT seconds. After that it's passed over, and only
+  `build_heatmaps --rebuild` picks up coordinates added later.
+"""
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import geo, pings, sharding
+from .cache import invalidate
+from .models import HeatmapCursor, HeatmapTile, LocationPing, Parcel
+
+LAYERS = [layer for layer, _ in HeatmapTile.LAYERS]
+# Web Mercator's limits, where the map is square
+MAX_LATITUDE = 85.05112878
+COUNT_DTYPE = np.dtype('<u4')
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def zooms():
+    return tuple(sorted(_setting('HEATMAP_ZOOMS', (8, 11, 14))))
+
+
+def tile_bins():
+    return _setting('HEATMAP_TILE_BINS', 64)
+
+
+def quadkey(zoom, x, y):
+    digits = []
+    for level in range(zoom, 0, -1):
+        mask = 1 << (level - 1)
+        digits.append(str((1 if x & mask else 0) + (2 if y & mask else 0)))
+    return ''.join(digits)
+
+
+def world_position(latitudes, longitudes):
+    """Points as fractions of the world map's width and height, from its top left."""
+    latitudes = np.radians(np.clip(latitudes, -MAX_LATITUDE, MAX_LATITUDE))
+    x = (np.asarray(longitudes, dtype=float) + 180.0) / 360.0
+    y = (1.0 - np.arcsinh(np.tan(latitudes)) / np.pi) / 2.0
+    return np.clip(x, 0.0, 1.0), np.clip(y, 0.0, 1.0)
+
+
+def bin_points(latitudes, longitudes, zoom, bins):
+    """
+    [(x, y, cells, counts)] for the tiles at `zoom` holding the points: the
+    flat (row-major) indexes of the tile's cells that have points, and how many.
+    """
+    x, y = world_position(latitudes, longitudes)
+    size = (1 << zoom) * bins
+    columns = np.minimum((x * size).astype(np.int64), size - 1)
+    rows = np.minimum((y * size).astype(np.int64), size - 1)
+    tiles = (columns // bins) * (1 << zoom) + rows // bins
+    cells = (rows % bins) * bins + columns % bins
+    # One histogram over (tile, cell) pairs, then split per tile
+    keys, counts = np.unique(tiles * (bins * bins) + cells, return_counts=True)
+    tiles, cells = np.divmod(keys, bins * bins)
+    found, starts = np.unique(tiles, return_index=True)
+    return [(int(tile) >> zoom, int(tile) & ((1 << zoom) - 1), tile_cells, tile_counts)
+            for tile, tile_cells, tile_counts in zip(found, np.split(cells, starts[1:]), np.split(counts, starts[1:]))]
+
+
+def cells(tile):
+    """A tile's counts as a square array."""
+    counts = np.frombuffer(tile.counts, dtype=COUNT_DTYPE)
+    bins = int(round(counts.size ** 0.5))
+    return counts.reshape(bins, bins)
+
+
+def add(layer, latitudes, longitudes):
+    """Count the points into `layer`'s tiles at every zoom; returns how many were counted."""
+    latitudes = np.asarray(latitudes, dtype=float)
+    longitudes = np.asarray(longitudes, dtype=float)
+    known = np.isfinite(latitudes) & np.isfinite(longitudes)
+    latitudes, longitudes = latitudes[known], longitudes[known]
+    if not latitudes.size:
+        return 0
+    bins = tile_bins()
+    binned = {}
+    for zoom in zooms():
+        for x, y, tile_cells, tile_counts in bin_points(latitudes, longitudes, zoom, bins):
+            binned[quadkey(zoom, x, y)] = (zoom, x, y, tile_cells, tile_counts)
+    existing = {tile.quadkey: tile for tile in HeatmapTile.objects.filter(layer=layer, quadkey__in=list(binned))}
+    now = timezone.now()
+    tiles = []
+    for key, (zoom, x, y, tile_cells, tile_counts) in binned.items():
+        tile = existing.get(key)
+        if tile is None:
+            tile = HeatmapTile(layer=layer, zoom=zoom, x=x, y=y, quadkey=key)
+            counts = np.zeros(bins * bins, dtype=COUNT_DTYPE)
+        else:
+            counts = np.frombuffer(tile.counts, dtype=COUNT_DTYPE).copy()
+            if counts.size != bins * bins:
+                raise ValueError("HEATMAP_TILE_BINS changed; run `manage.py build_heatmaps --rebuild`")
+        counts[tile_cells] += tile_counts.astype(COUNT_DTYPE)
+        tile.counts = counts.tobytes()
+        tile.total += int(tile_counts.sum())
+        tile.updated_at = now
+        tiles.append(tile)
+    # One upsert for new and existing tiles; bulk_update's CASE per row is far slower
+    HeatmapTile.objects.bulk_create(tiles, update_conflicts=True, unique_fields=['layer', 'quadkey'],
+                                    update_fields=['counts', 'total', 'updated_at'])
+    return int(latitudes.size)
+
+
+def tile(layer, zoom, x, y):
+    """The stored tile, or an empty unsaved one."""
+    key = quadkey(zoom, x, y)
+    found = HeatmapTile.objects.filter(layer=layer, quadkey=key).first()
+    return found or HeatmapTile(layer=layer, zoom=zoom, x=x, y=y, quadkey=key, counts=b'')
+
+
+# Sources: each reads the rows after a cursor and returns the last id read
+# (None when there's nothing to read yet) and the points per layer.
+
+def _pings(after, limit):
+    rows = list(LocationPing.objects.filter(pk__gt=after).order_by('pk')
+                .values_list('pk', 'latitude', 'longitude')[:limit])
+    if not rows:
+        return None, {}
+    points = np.array([row[1:] for row in rows], dtype=float)
+    return rows[-1][0], {'drivers': (points[:, 0], points[:, 1])}
+
+
+def _parcels(alias, after, limit):
+    rows = list(Parcel.objects.using(alias).filter(pk__gt=after).order_by('pk').values_list(
+        'pk', 'booked_at', 'pickup_latitude', 'pickup_longitude', 'delivery_latitude', 'delivery_longitude')[:limit])
+    if geo.geocoder() is not None:
+        waiting_since = timezone.now() - timedelta(seconds=_setting('HEATMAP_GEOCODE_WAIT', 3600))
+        for index, row in enumerate(rows):
+            if None in row[2:] and row[1] > waiting_since:
+                rows = rows[:index]
+                break
+    if not rows:
+        return None, {}
+    points = np.array([row[2:] for row in rows], dtype=float)
+    return rows[-1][0], {'pickups': (points[:, 0], points[:, 1]), 'deliveries': (points[:, 2], points[:, 3])}
+
+
+def _sources():
+    yield pings.HEATMAP_CURSOR, _pings
+    for alias in sharding.shards():
+        yield f'parcels:{alias}', lambda after, limit, alias=alias: _parcels(alias, after, limit)
+
+
+def refresh(batch_size=None):
+    """Count the points recorded since the last refresh; returns how many per layer."""
+    batch_size = batch_size or _setting('HEATMAP_BATCH_SIZE', 5000)
+    added = dict.fromkeys(LAYERS, 0)
+    for name, read in _sources():
+        HeatmapCursor.objects.get_or_create(name=name)
+        while True:
+            with transaction.atomic():
+                cursor = HeatmapCursor.objects.select_for_update().get(name=name)
+                last_id, points = read(cursor.last_id, batch_size)
+                if last_id is None:
+                    break
+                for layer, (latitudes, longitudes) in points.items():
+                    added[layer] += add(layer, latitudes, longitudes)
+                cursor.last_id = last_id
+                cursor.save(update_fields=['last_id'])
+                invalidate('heatmap')
+    return added
+
+
+def rebuild(batch_size=None):
+    """Count every point again from scratch."""
+    with transaction.atomic():
+        HeatmapTile.objects.all().delete()
+        HeatmapCursor.objects.all().delete()
+        invalidate('heatmap')
+    return refresh(batch_size)
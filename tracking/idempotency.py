@@ -0,0 +1,189 @@
+"""
+Idempotency keys for the write endpoints.
+
+Drivers on flaky connections retry POSTs whose response they never saw. A
+client that sends an `Idempotency-Key` header (any unique string, e.g. a
+UUID per user action) gets the first response replayed for every retry
+with the same key, marked with `Idempotent-Replayed: true`, and the view
+doesn't run again, so no second TrackingEvent or Notification is written
+and the Job and Parcel rows aren't touched.
+
+Keys are scoped to the user and remembered for IDEMPOTENCY_KEY_TTL seconds
+in the IdempotencyKey table, with recently seen responses also kept in an
+in-process LRU of IDEMPOTENCY_LOCAL_SIZE entries so most retries are
+answered without a query. The first request inserts its key before the
+view runs; the unique constraint makes a concurrent duplicate fail with
+409 instead of running twice. Reusing a key for a different request (other
+method, path or payload) is rejected with 422.
+
+Responses with a 5xx status or a 409 (the outcome depended on a concurrent
+change, see tracking/concurrency.py), and requests that raise (404,
+validation errors), aren't stored: their key is released so the client can
+retry.
+An in-progress key left behind by a crashed process is taken over after
+IDEMPOTENCY_LOCK_TIMEOUT seconds.
+"""
+import hashlib
+import json
+from collections import namedtuple
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .cache import LocalCache
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = 255
+
+StoredResponse = namedtuple('StoredResponse', 'fingerprint status_code data')
+
+
+class KeyReused(Exception):
+    pass
+
+
+class RequestInProgress(Exception):
+    pass
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+_local = LocalCache(maxsize=_setting('IDEMPOTENCY_LOCAL_SIZE', 4096))
+
+
+def _ttl():
+    return _setting('IDEMPOTENCY_KEY_TTL', 24 * 3600)
+
+
+def _describe(value):
+    if isinstance(value, UploadedFile):
+        return [value.name, value.size]
+    return str(value)
+
+
+def fingerprint(request):
+    """Hash of what makes two requests "the same": method, path and payload."""
+    data = request.data
+    if hasattr(data, 'lists'):
+        data = dict(data.lists())
+    payload = json.dumps([request.method, request.path, data], sort_keys=True, default=_describe)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _remember(user_id, key, stored, created_at):
+    remaining = _ttl() - (timezone.now() - created_at).total_seconds()
+    if remaining > 0:
+        _local.set((user_id, key), stored, remaining)
+
+
+def _check(stored, request_fingerprint):
+    if stored.fingerprint != request_fingerprint:
+        raise KeyReused
+    return stored
+
+
+def claim(user_id, key, request_fingerprint):
+    """
+    Return the StoredResponse to replay for this key, or the id of a new
+    in-progress IdempotencyKey row that the caller now owns and must either
+    complete() or release().
+    """
+    stored = _local.get((user_id, key))
+    if isinstance(stored, StoredResponse):
+        return _check(stored, request_fingerprint)
+
+    for _ in range(3):
+        now = timezone.now()
+        try:
+            with transaction.atomic():
+                return IdempotencyKey.objects.create(
+                    user_id=user_id, key=key, fingerprint=request_fingerprint, created_at=now).pk
+        except IntegrityError:
+            pass
+
+        row = IdempotencyKey.objects.filter(user_id=user_id, key=key).first()
+        if row is None:
+            # Released or purged in between
+            continue
+        expired = row.created_at <= now - timedelta(seconds=_ttl())
+        abandoned = (row.status_code is None and row.created_at
+                     <= now - timedelta(seconds=_setting('IDEMPOTENCY_LOCK_TIMEOUT', 60)))
+        if expired or abandoned:
+            taken = IdempotencyKey.objects.filter(pk=row.pk, created_at=row.created_at).update(
+                fingerprint=request_fingerprint, status_code=None, response=None, created_at=now)
+            if taken:
+                return row.pk
+            continue
+        if row.fingerprint != request_fingerprint:
+            raise KeyReused
+        if row.status_code is None:
+            raise RequestInProgress
+        stored = StoredResponse(row.fingerprint, row.status_code, row.response)
+        _remember(user_id, key, stored, row.created_at)
+        return stored
+    raise RequestInProgress
+
+
+def complete(pk, user_id, key, request_fingerprint, status_code, data):
+    IdempotencyKey.objects.filter(pk=pk).update(status_code=status_code, response=data)
+    # Round-trip through JSON so a local replay matches a replay from the table
+    data = json.loads(json.dumps(data, cls=DjangoJSONEncoder))
+    _remember(user_id, key, StoredResponse(request_fingerprint, status_code, data), timezone.now())
+
+
+def release(pk):
+    IdempotencyKey.objects.filter(pk=pk, status_code__isnull=True).delete()
+
+
+def purge_expired(ttl=None):
+    ttl = _ttl() if ttl is None else ttl
+    deleted, _ = IdempotencyKey.objects.filter(
+        created_at__lt=timezone.now() - timedelta(seconds=ttl)).delete()
+    return deleted
+
+
+def idempotent(view_method):
+    """Honour the Idempotency-Key header on a DRF view's write method."""
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if key is None or not request.user.is_authenticated:
+            return view_method(self, request, *args, **kwargs)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return Response({'error': f'{HEADER} must be 1 to {MAX_KEY_LENGTH} characters'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        request_fingerprint = fingerprint(request)
+        try:
+            claimed = claim(request.user.pk, key, request_fingerprint)
+        except KeyReused:
+            return Response({'error': f'{HEADER} was already used for a different request'},
+                            status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        except RequestInProgress:
+            return Response({'error': f'A request with this {HEADER} is still in progress'},
+                            status=status.HTTP_409_CONFLICT)
+        if isinstance(claimed, StoredResponse):
+            return Response(claimed.data, status=claimed.status_code, headers={REPLAYED_HEADER: 'true'})
+
+        try:
+            response = view_method(self, request, *args, **kwargs)
+        except BaseException:
+            release(claimed)
+            raise
+        if response.status_code >= 500 or response.status_code == status.HTTP_409_CONFLICT:
+            release(claimed)
+        else:
+            complete(claimed, request.user.pk, key, request_fingerprint, response.status_code, response.data)
+        return response
+    return wrapper
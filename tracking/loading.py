@@ -0,0 +1,164 @@
+"""
+Parcel dimensions and vehicle load planning.
+
+Customers give dimensions as free text ("40 x 30 x 20", "40x30x20 cm",
+"0.4 x 0.3 x 0.2 m"); `dimension_fields` parses them into the parcel's
+length_cm/width_cm/height_cm when it's booked. Text that doesn't parse
+leaves them null, and such a parcel counts as taking no room, only weight.
+
+A driver's vehicle takes at most Driver.max_load_kg (DRIVER_MAX_LOAD_KG when
+unset) and Driver.cargo_volume_m3 (DRIVER_MAX_VOLUME_M3 when unset, None for
+no limit). The registry (tracking/registry.py) keeps the weight and volume
+of each driver's open jobs, and assigning a parcel that wouldn't fit what's
+left is refused.
+
+`plan()` packs the parcels waiting for a driver into the vehicles of the
+drivers on duty, best fit decreasing: parcels go in order of chargeable
+weight (the larger of the actual weight and the volumetric weight, volume
+over VOLUMETRIC_DIVISOR), each into the vehicle it fits that has the least
+room left. Volumetric weights are computed for all the parcels at once and
+each placement checks every vehicle at once with NumPy, so a run over
+thousands of parcels takes milliseconds. Capacity is the only criterion;
+the plan is a proposal for controllers, who assign the jobs.
+"""
+import math
+import re
+
+import numpy as np
+from django.conf import settings
+
+from . import sharding
+from .models import Parcel
+
+DIMENSION_FIELDS = ('length_cm', 'width_cm', 'height_cm')
+UNITS_CM = {'mm': 0.1, 'cm': 1.0, 'm': 100.0, 'in': 2.54}
+_NUMBER = r'(\d+(?:[.,]\d+)?)\s*(mm|cm|m|in)?'
+_DIMENSIONS = re.compile(rf'^\s*{_NUMBER}\s*[x×*]\s*{_NUMBER}\s*[x×*]\s*{_NUMBER}\s*$', re.IGNORECASE)
+
+# Waiting for a driver to be assigned
+PENDING_STATUS = 'order_placed'
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def parse_dimensions(text):
+    """(length, width, height) in cm, or None. A unit after the last number applies to all three."""
+    match = _DIMENSIONS.match(text or '')
+    if match is None:
+        return None
+    numbers = [float(value.replace(',', '.')) for value in match.group(1, 3, 5)]
+    units = [unit.lower() if unit else None for unit in match.group(2, 4, 6)]
+    default = units[2] or 'cm'
+    sizes = tuple(round(number * UNITS_CM[unit or default], 2) for number, unit in zip(numbers, units))
+    return sizes if all(size > 0 for size in sizes) else None
+
+
+def dimension_fields(text):
+    """Dimension fields for a parcel, from its free-text dimensions."""
+    sizes = parse_dimensions(text)
+    return dict(zip(DIMENSION_FIELDS, sizes or (None, None, None)))
+
+
+def chargeable_weights(weights, volumes_m3):
+    """max(actual, volumetric) weight per parcel; unknown (NaN) volumes count as none."""
+    volumetric = np.nan_to_num(volumes_m3) * 1e6 / _setting('VOLUMETRIC_DIVISOR', 5000)
+    return np.maximum(weights, volumetric)
+
+
+def _vehicle_limits(state):
+    max_load = state.max_load_kg if state.max_load_kg is not None else _setting('DRIVER_MAX_LOAD_KG', 500)
+    max_volume = state.max_volume_m3 if state.max_volume_m3 is not None else _setting('DRIVER_MAX_VOLUME_M3', None)
+    return max_load, max_volume
+
+
+def remaining_capacity(state):
+    """(kg, m3) left in a driver's vehicle; m3 is inf without a volume limit."""
+    max_load, max_volume = _vehicle_limits(state)
+    volume = math.inf if max_volume is None else max_volume - state.assigned_volume
+    return max_load - state.assigned_weight, volume
+
+
+def fits(state, weight, volume):
+    remaining_weight, remaining_volume = remaining_capacity(state)
+    return weight <= remaining_weight and (volume or 0.0) <= remaining_volume
+
+
+def max_parcels():
+    """Most waiting parcels a plan considers."""
+    return _setting('LOAD_PLAN_MAX_PARCELS', 5000)
+
+
+def pending_parcels(limit):
+    """(ids, weights, volumes in m3, NaN when unknown) of the oldest `limit` parcels waiting for a driver."""
+    rows = []
+    for alias in sharding.shards():
+        rows.extend(Parcel.objects.using(alias).filter(status=PENDING_STATUS).order_by('booked_at', 'id')
+                    .values_list('booked_at', 'id', 'weight', *DIMENSION_FIELDS)[:limit])
+    if len(sharding.shards()) > 1:
+        rows = sorted(rows)[:limit]
+    table = np.array([row[1:] for row in rows], dtype=float).reshape(-1, 5)
+    ids = table[:, 0].astype(np.int64)
+    volumes = table[:, 2] * table[:, 3] * table[:, 4] / 1e6
+    return ids, table[:, 1], volumes
+
+
+def pack(weights, volumes_m3, capacity_kg, capacity_m3, slots):
+    """
+    Best fit decreasing over parcels (weights, volumes) and vehicles (capacity
+    left in kg, m3 and jobs). Returns the vehicle index per parcel, -1 for
+    parcels that fit nowhere.
+    """
+    volumes_m3 = np.nan_to_num(volumes_m3)
+    chargeable = chargeable_weights(weights, volumes_m3)
+    capacity_kg = np.array(capacity_kg, dtype=float)
+    capacity_m3 = np.array(capacity_m3, dtype=float)
+    slots = np.array(slots, dtype=np.int64)
+    divisor_m3 = _setting('VOLUMETRIC_DIVISOR', 5000) / 1e6
+    placed = np.full(len(weights), -1, dtype=np.int64)
+    for parcel in np.argsort(-chargeable, kind='stable'):
+        room = (capacity_kg >= weights[parcel]) & (capacity_m3 >= volumes_m3[parcel]) & (slots > 0)
+        if not room.any():
+            continue
+        # Room left in chargeable kg: the tighter of weight and volume
+        left = np.minimum(capacity_kg, capacity_m3 / divisor_m3)
+        vehicle = int(np.argmin(np.where(room, left, np.inf)))
+        placed[parcel] = vehicle
+        capacity_kg[vehicle] -= weights[parcel]
+        capacity_m3[vehicle] -= volumes_m3[parcel]
+        slots[vehicle] -= 1
+    return placed
+
+
+def plan(states, limit=None):
+    """
+    Loads for the drivers in `states` (DriverStates, see tracking/registry.py)
+    that are on duty, from the parcels waiting for a driver, oldest first;
+    at most `limit` of them, capped at LOAD_PLAN_MAX_PARCELS.
+    """
+    limit = min(limit or max_parcels(), max_parcels())
+    ids, weights, volumes = pending_parcels(limit)
+    states = [state for state in states if state.on_duty]
+    capacity = [remaining_capacity(state) for state in states]
+    max_jobs = _setting('DRIVER_MAX_OPEN_JOBS', 20)
+    placed = pack(weights, volumes, [kg for kg, _ in capacity], [m3 for _, m3 in capacity],
+                  [max_jobs - state.open_jobs for state in states])
+    chargeable = chargeable_weights(weights, volumes)
+    loads = []
+    for index, state in enumerate(states):
+        mine = placed == index
+        if not mine.any():
+            continue
+        loads.append({
+            'driver_id': state.driver_id,
+            'name': state.name,
+            'parcel_ids': ids[mine].tolist(),
+            'weight': round(float(weights[mine].sum()), 3),
+            'volume_m3': round(float(np.nansum(volumes[mine])), 4),
+            'chargeable_weight': round(float(chargeable[mine].sum()), 3),
+            'weight_left': round(capacity[index][0] - float(weights[mine].sum()), 3),
+            'volume_left_m3': (None if math.isinf(capacity[index][1])
+                               else round(capacity[index][1] - float(np.nansum(volumes[mine])), 4)),
+        })
+    return {'loads': loads, 'unplaced': ids[placed < 0].tolist()}
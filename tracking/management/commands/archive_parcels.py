@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from tracking.archive import archivable_parcels, archive_closed_parcels
+
+
+class Command(BaseCommand):
+    help = "Move delivered/cancelled parcels closed more than N days ago into the archive"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=90,
+                            help="Archive parcels closed more than this many days ago")
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--max-batches', type=int, default=None)
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Only report how many parcels would be archived")
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            count = archivable_parcels(options['days']).everywhere().count()
+            self.stdout.write(f"{count} parcels would be archived")
+            return
+
+        archived = archive_closed_parcels(
+            options['days'],
+            batch_size=options['batch_size'],
+            max_batches=options['max_batches'],
+        )
+        self.stdout.write(self.style.SUCCESS(f"Archived {archived} parcels"))
@@ -0,0 +1,144 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from tracking.benchmark import (
+    CONTENTION_STRATEGIES, SCENARIOS, Dataset, Replay, compare, contention, report, run_endpoints, uncovered,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the tracking API in-process against the current (generated) database: "
+        "per-endpoint latency, throughput and queries per request, a replayed traffic mix, or "
+        "optimistic versus locking updates of contended rows. "
+        "Writes to the database, so use a scratch copy."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('mode', nargs='?', choices=['endpoints', 'replay', 'contention'], default='endpoints')
+        parser.add_argument('--endpoint', action='append', dest='endpoints',
+                            help="URL name to benchmark; repeat for several (default: all)")
+        parser.add_argument('--skip', action='append', default=[], help="URL name to leave out")
+        parser.add_argument('--requests', type=int, default=50, help="Requests per endpoint")
+        parser.add_argument('--warmup', type=int, default=5, help="Unrecorded requests per endpoint first")
+        parser.add_argument('--concurrency', type=int, default=1, help="Client threads")
+        parser.add_argument('--seed', type=int, default=0)
+
+        replay = parser.add_argument_group('replay')
+        replay.add_argument('--duration', type=float, default=60, help="Seconds of traffic")
+        replay.add_argument('--drivers', type=int, default=100, help="Drivers sending location pings")
+        replay.add_argument('--ping-interval', type=float, default=10)
+        replay.add_argument('--trackers', type=int, default=200, help="Visitors polling public tracking")
+        replay.add_argument('--poll-interval', type=float, default=30)
+        replay.add_argument('--dashboards', type=int, default=5, help="Controllers reloading their dashboard")
+        replay.add_argument('--dashboard-interval', type=float, default=15)
+        replay.add_argument('--dispatch-size', type=int, default=20, help="Driver assignments per dispatch burst")
+        replay.add_argument('--dispatch-interval', type=float, default=30)
+
+        writes = parser.add_argument_group('contention')
+        writes.add_argument('--strategy', action='append', dest='strategies', choices=sorted(CONTENTION_STRATEGIES),
+                            help="Update strategy to measure; repeat for several (default: all)")
+        writes.add_argument('--rows', type=int, default=10, help="Hot jobs the writers share")
+        writes.add_argument('--writers', type=int, default=8, help="Concurrent writer threads")
+        writes.add_argument('--operations', type=int, default=500, help="Updates per strategy")
+        writes.add_argument('--hold-ms', type=float, default=2.0,
+                            help="Work between reading a row and writing it back")
+
+        parser.add_argument('--output', help="Write the results to this JSON file")
+        parser.add_argument('--compare', dest='baseline', help="JSON results of an earlier run to compare against")
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help="Relative latency increase reported as a regression")
+
+    def handle(self, *args, **options):
+        if not getattr(settings, 'METRICS_ENABLED', True):
+            self.stderr.write("METRICS_ENABLED is off; queries per request will not be reported")
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+
+        try:
+            dataset = Dataset(seed=options['seed'])
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        if options['mode'] == 'endpoints':
+            result = self._endpoints(dataset, options)
+        elif options['mode'] == 'replay':
+            result = self._replay(dataset, options)
+        else:
+            result = self._contention(dataset, options)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(result, f, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+
+        if baseline is not None:
+            regressions = compare(baseline, result, threshold=options['threshold'])
+            if regressions:
+                for regression in regressions:
+                    self.stdout.write(self.style.ERROR(f"REGRESSION {regression}"))
+                raise CommandError(f"{len(regressions)} regressions against {options['baseline']}")
+            self.stdout.write(self.style.SUCCESS(f"No regressions against {options['baseline']}"))
+
+    def _header(self):
+        self.stdout.write(f"{'endpoint':<24} {'reqs':>6} {'errors':>6} {'req/s':>8} {'p50 ms':>8} "
+                          f"{'p95 ms':>8} {'p99 ms':>8} {'queries':>8}")
+
+    def _row(self, name, result):
+        queries = result['queries_per_request']
+        self.stdout.write(
+            f"{name:<24} {result['requests']:>6} {result['errors']:>6} {result['rps']:>8.1f} "
+            f"{result['p50_ms']:>8.1f} {result['p95_ms']:>8.1f} {result['p99_ms']:>8.1f} "
+            f"{'-' if queries is None else queries:>8}"
+        )
+
+    def _endpoints(self, dataset, options):
+        names = options['endpoints'] or sorted(SCENARIOS)
+        unknown = [name for name in names if name not in SCENARIOS]
+        if unknown:
+            raise CommandError(f"No benchmark scenario for: {', '.join(unknown)}")
+        names = [name for name in names if name not in options['skip']]
+        missing = uncovered()
+        if missing:
+            self.stderr.write(f"URLs without a benchmark scenario: {', '.join(missing)}")
+
+        self._header()
+        results = run_endpoints(dataset, names, requests=options['requests'],
+                                concurrency=options['concurrency'], warmup=options['warmup'], log=self._row)
+        keys = ('endpoints', 'requests', 'warmup', 'concurrency', 'seed')
+        return report('endpoints', {key: options[key] for key in keys}, results)
+
+    def _replay(self, dataset, options):
+        keys = ('duration', 'concurrency', 'drivers', 'ping_interval', 'trackers', 'poll_interval',
+                'dashboards', 'dashboard_interval', 'dispatch_interval', 'dispatch_size')
+        replay = Replay(dataset, **{key: options[key] for key in keys})
+        self.stdout.write(f"Replaying {len(replay.actors)} clients for {options['duration']}s "
+                          f"on {options['concurrency']} threads")
+        results, lag = replay.run()
+        self._header()
+        for name, result in results.items():
+            self._row(name, result)
+        self.stdout.write(f"Schedule lag: p50 {lag['lag_p50_ms']}ms, p95 {lag['lag_p95_ms']}ms, "
+                          f"max {lag['lag_max_ms']}ms")
+        return report('replay', {key: options[key] for key in keys + ('seed',)}, results, lag=lag)
+
+    def _contention(self, dataset, options):
+        strategies = options['strategies'] or sorted(CONTENTION_STRATEGIES)
+        self.stdout.write(f"{options['writers']} writers updating {options['rows']} jobs, "
+                          f"{options['hold_ms']}ms between read and write")
+        self._header()
+        results = {}
+        for strategy in strategies:
+            results[strategy] = contention(dataset, strategy, rows=options['rows'], concurrency=options['writers'],
+                                           operations=options['operations'], hold_ms=options['hold_ms'])
+            self._row(strategy, results[strategy])
+            self.stdout.write(f"{'':<24} retries: {results[strategy]['retries']}")
+        if {'optimistic', 'locking'} <= results.keys() and results['locking']['rps']:
+            self.stdout.write(f"Optimistic throughput: {results['optimistic']['rps'] / results['locking']['rps']:.2f}x "
+                              f"locking")
+        keys = ('strategies', 'rows', 'writers', 'operations', 'hold_ms', 'seed')
+        return report('contention', {key: options[key] for key in keys}, results)
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from tracking.heatmap import rebuild, refresh
+
+
+class Command(BaseCommand):
+    help = "Add driver pings and parcel addresses recorded since the last run to the heatmap tiles"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--rebuild', action='store_true',
+                            help="Drop the tiles and count every point again")
+
+    def handle(self, *args, **options):
+        build = rebuild if options['rebuild'] else refresh
+        added = build(options['batch_size'])
+        summary = ', '.join(f"{count} {layer}" for layer, count in added.items())
+        self.stdout.write(self.style.SUCCESS(f"Counted {summary}"))
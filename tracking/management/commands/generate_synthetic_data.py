@@ -0,0 +1,67 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from tracking.synthetic import SyntheticDataGenerator
+
+
+def _center(value):
+    try:
+        lat, lng = (float(part) for part in value.split(','))
+    except ValueError:
+        raise CommandError("--center must look like 40.7128,-74.0060")
+    return lat, lng
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate deterministic synthetic customers, drivers, parcels and their "
+        "history for load testing (the same options always produce the same data)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customers', type=int, default=1000)
+        parser.add_argument('--drivers', type=int, default=100)
+        parser.add_argument('--parcels', type=int, default=10000)
+        parser.add_argument('--events-per-parcel', type=int, default=2,
+                            help="Hub scans recorded between departure and delivery")
+        parser.add_argument('--days', type=int, default=90, help="Days of history to spread parcels over")
+        parser.add_argument('--center', type=_center, default=(40.7128, -74.0060),
+                            help="lat,lng the addresses and GPS traces are spread around")
+        parser.add_argument('--radius-km', type=float, default=30)
+        parser.add_argument('--pings-per-job', type=int, default=20,
+                            help="Driver GPS pings recorded per completed job")
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--chunk-size', type=int, default=5000,
+                            help="Parcels written per transaction")
+        parser.add_argument('--prefix', default='synth', help="Username prefix of the generated users")
+        parser.add_argument('--until', type=date.fromisoformat, default=None,
+                            help="Last day of history, YYYY-MM-DD (default today); fix it for identical runs")
+
+    def handle(self, *args, **options):
+        if min(options['customers'], options['drivers'], options['chunk_size']) < 1:
+            raise CommandError("--customers, --drivers and --chunk-size must be at least 1")
+
+        generator = SyntheticDataGenerator(
+            customers=options['customers'],
+            drivers=options['drivers'],
+            parcels=options['parcels'],
+            events_per_parcel=options['events_per_parcel'],
+            days=options['days'],
+            center=options['center'],
+            radius_km=options['radius_km'],
+            pings_per_job=options['pings_per_job'],
+            seed=options['seed'],
+            chunk_size=options['chunk_size'],
+            prefix=options['prefix'],
+            until=options['until'],
+            log=self.stdout.write,
+        )
+        try:
+            counts = generator.run()
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        for name, count in counts.items():
+            self.stdout.write(f"{name}: {count}")
+        self.stdout.write(self.style.SUCCESS("Synthetic data generated"))
@@ -0,0 +1,33 @@
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+
+from tracking.geo import backfill_coordinates, load_gazetteer
+
+
+class Command(BaseCommand):
+    help = ("Load address coordinates from a CSV file (address, latitude, longitude) into the geocode "
+            "cache, then fill in the coordinates of open parcels")
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', help="CSV file; leave out to only fill in parcels")
+        parser.add_argument('--no-header', action='store_true', help="The file has no header row")
+        parser.add_argument('--geocode', action='store_true',
+                            help="Ask GEOCODER for parcel addresses still missing from the cache")
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if options['path']:
+            try:
+                with open(options['path'], newline='') as f:
+                    rows = csv.reader(f)
+                    if not options['no_header']:
+                        next(rows, None)
+                    count = load_gazetteer(((row[0], row[1], row[2]) for row in rows if row),
+                                           batch_size=options['batch_size'])
+            except (OSError, IndexError, ValueError) as exc:
+                raise CommandError(f"Could not load {options['path']}: {exc}")
+            self.stdout.write(f"Loaded {count} addresses")
+
+        changed = backfill_coordinates(batch_size=options['batch_size'], use_geocoder=options['geocode'])
+        self.stdout.write(self.style.SUCCESS(f"Located {changed} parcels"))
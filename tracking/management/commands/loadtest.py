@@ -0,0 +1,102 @@
+import http.client
+import itertools
+import threading
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(int(len(sorted_values) * fraction), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-test a running server at increasing concurrency levels, e.g. to "
+        "compare the ASGI and WSGI deployments (see gunicorn.conf.py)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('base_url', help="e.g. http://localhost:8000")
+        parser.add_argument('--path', action='append', dest='paths',
+                            help="Path to request; repeat to round-robin several (default /api/notifications/)")
+        parser.add_argument('--header', action='append', dest='headers', default=[],
+                            help="Extra request header, e.g. 'Authorization: Bearer <token>'")
+        parser.add_argument('--concurrency', default='1,8,32,128',
+                            help="Comma-separated numbers of concurrent clients")
+        parser.add_argument('--requests', type=int, default=1000,
+                            help="Requests per concurrency level")
+        parser.add_argument('--timeout', type=float, default=30)
+
+    def handle(self, *args, **options):
+        url = urlsplit(options['base_url'])
+        if url.scheme not in ('http', 'https') or not url.hostname:
+            raise CommandError("base_url must look like http://host:port")
+        headers = {}
+        for header in options['headers']:
+            name, _, value = header.partition(':')
+            headers[name.strip()] = value.strip()
+        paths = options['paths'] or ['/api/notifications/']
+        levels = [int(level) for level in options['concurrency'].split(',')]
+
+        self.stdout.write(f"{'clients':>8} {'reqs':>7} {'errors':>7} {'req/s':>9} "
+                          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+        for concurrency in levels:
+            latencies, errors, elapsed = self._run_level(
+                url, paths, headers, concurrency, options['requests'], options['timeout'])
+            latencies.sort()
+            done = len(latencies) + errors
+            self.stdout.write(
+                f"{concurrency:>8} {done:>7} {errors:>7} {done / elapsed:>9.1f} "
+                f"{_percentile(latencies, 0.50) * 1000:>8.1f} "
+                f"{_percentile(latencies, 0.95) * 1000:>8.1f} "
+                f"{_percentile(latencies, 0.99) * 1000:>8.1f} "
+                f"{(latencies[-1] if latencies else 0) * 1000:>8.1f}"
+            )
+
+    def _run_level(self, url, paths, headers, concurrency, total, timeout):
+        connection_class = http.client.HTTPSConnection if url.scheme == 'https' else http.client.HTTPConnection
+        counter = itertools.count()
+        lock = threading.Lock()
+        latencies = []
+        errors = 0
+
+        def client():
+            nonlocal errors
+            # One keep-alive connection per simulated client
+            connection = connection_class(url.hostname, url.port, timeout=timeout)
+            local_latencies, local_errors = [], 0
+            while True:
+                n = next(counter)
+                if n >= total:
+                    break
+                start = time.perf_counter()
+                try:
+                    connection.request('GET', paths[n % len(paths)], headers=headers)
+                    response = connection.getresponse()
+                    response.read()
+                    ok = response.status < 400
+                except (OSError, http.client.HTTPException):
+                    connection.close()
+                    connection = connection_class(url.hostname, url.port, timeout=timeout)
+                    ok = False
+                if ok:
+                    local_latencies.append(time.perf_counter() - start)
+                else:
+                    local_errors += 1
+            connection.close()
+            with lock:
+                latencies.extend(local_latencies)
+                errors += local_errors
+
+        threads = [threading.Thread(target=client) for _ in range(concurrency)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return latencies, errors, time.perf_counter() - started
@@ -0,0 +1,20 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+from tracking.models import Driver, User
+from tracking.sharding import copy_rows, shards
+
+
+class Command(BaseCommand):
+    help = "Migrate the shard databases (SHARD_DATABASES other than default) and copy users and drivers to them"
+
+    def handle(self, *args, **options):
+        others = shards()[1:]
+        if not others:
+            self.stdout.write("No shard databases are configured")
+            return
+        for alias in others:
+            call_command('migrate', database=alias, interactive=False, verbosity=options['verbosity'])
+            users = copy_rows(User.objects.all(), alias)
+            drivers = copy_rows(Driver.objects.all(), alias)
+            self.stdout.write(self.style.SUCCESS(f"{alias}: migrated, copied {users} users and {drivers} drivers"))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from tracking.media import process_staged
+from tracking.models import StagedMedia
+from tracking.sharding import shards
+
+
+class Command(BaseCommand):
+    help = "Process proof-of-delivery uploads still waiting in staging"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retry-failed', action='store_true',
+                            help="Also retry uploads that failed before")
+
+    def handle(self, *args, **options):
+        if options['retry_failed']:
+            for alias in shards():
+                StagedMedia.objects.using(alias).filter(status='failed').update(status='pending', error='')
+
+        processed = failed = retry = 0
+        for staged_id in StagedMedia.objects.filter(status='pending').values_list('pk', flat=True).everywhere():
+            try:
+                asset = process_staged(staged_id)
+            except Exception as exc:
+                # Left pending for the next run
+                self.stderr.write(f"Upload {staged_id}: {exc}")
+                retry += 1
+                continue
+            if asset is None:
+                failed += 1
+            else:
+                processed += 1
+        self.stdout.write(self.style.SUCCESS(
+            f"Processed {processed} uploads, {failed} failed, {retry} left to retry"))
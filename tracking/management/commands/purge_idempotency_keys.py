@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from tracking.idempotency import purge_expired
+
+
+class Command(BaseCommand):
+    help = "Delete idempotency keys older than IDEMPOTENCY_KEY_TTL (retries after that run the request again)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ttl', type=int, default=None, help="Age in seconds (default: IDEMPOTENCY_KEY_TTL)")
+
+    def handle(self, *args, **options):
+        count = purge_expired(options['ttl'])
+        self.stdout.write(self.style.SUCCESS(f"Purged {count} idempotency keys"))
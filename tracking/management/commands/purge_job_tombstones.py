@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from tracking.sync import purge_tombstones
+
+
+class Command(BaseCommand):
+    help = "Delete job tombstones older than SYNC_TOMBSTONE_DAYS (drivers syncing from before then get a full list)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None)
+
+    def handle(self, *args, **options):
+        count = purge_tombstones(options['days'])
+        self.stdout.write(self.style.SUCCESS(f"Purged {count} job tombstones"))
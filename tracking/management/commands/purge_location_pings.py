@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from tracking.pings import purge
+
+
+class Command(BaseCommand):
+    help = "Delete driver location pings older than LOCATION_PING_RETENTION_DAYS that the heatmap has counted"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None)
+
+    def handle(self, *args, **options):
+        count = purge(options['days'])
+        self.stdout.write(self.style.SUCCESS(f"Purged {count} location pings"))
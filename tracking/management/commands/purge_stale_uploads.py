@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from tracking.uploads import purge_stale
+
+
+class Command(BaseCommand):
+    help = "Delete unfinalized chunked uploads that stopped receiving chunks"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=24)
+
+    def handle(self, *args, **options):
+        count = purge_stale(options['hours'])
+        self.stdout.write(self.style.SUCCESS(f"Purged {count} stale uploads"))
@@ -0,0 +1,61 @@
+from itertools import groupby
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from tracking import sharding
+from tracking.models import Parcel, ParcelEvent
+from tracking.transitions import project
+
+
+class Command(BaseCommand):
+    help = "Rebuild Parcel.status, can_customer_track and closed_at from the ParcelEvent stream"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--parcel', dest='tracking_number',
+                            help="Only replay the parcel with this tracking number")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Report how many parcels differ without writing")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        events = ParcelEvent.objects.order_by('parcel_id', 'id')
+        if options['tracking_number']:
+            events = events.filter(parcel__tracking_number=options['tracking_number'])
+
+        replayed = changed = 0
+        # A parcel's events are on its shard, so each shard is replayed on its own
+        for alias in sharding.shards():
+            rows = (events.using(alias).values_list('parcel_id', 'event_type', 'timestamp', 'data')
+                    .iterator(chunk_size=batch_size))
+            pending = {}
+            for parcel_id, group in groupby(rows, key=lambda row: row[0]):
+                pending[parcel_id] = project(row[1:] for row in group)
+                if len(pending) >= batch_size:
+                    changed += self._flush(alias, pending, options['dry_run'])
+                    replayed += len(pending)
+                    pending = {}
+            if pending:
+                changed += self._flush(alias, pending, options['dry_run'])
+                replayed += len(pending)
+
+        verb = 'would change' if options['dry_run'] else 'changed'
+        self.stdout.write(self.style.SUCCESS(
+            f"Replayed {replayed} parcels, {verb} {changed}"))
+
+    def _flush(self, alias, projections, dry_run):
+        fields = ['status', 'can_customer_track', 'closed_at']
+        current = Parcel.objects.using(alias).filter(pk__in=projections).values('pk', *fields)
+        now = timezone.now()
+        stale = [
+            Parcel(pk=row['pk'], updated_at=now, version=F('version') + 1, **projections[row['pk']])
+            for row in current
+            if any(row[name] != projections[row['pk']][name] for name in fields)
+        ]
+        if stale and not dry_run:
+            with transaction.atomic(using=alias):
+                Parcel.objects.using(alias).bulk_update(stale, fields + ['updated_at', 'version'])
+        return len(stale)
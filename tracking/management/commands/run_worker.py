@@ -0,0 +1,35 @@
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from tracking.taskqueue import Worker
+
+
+class Command(BaseCommand):
+    help = "Run deferred tasks (tracking/taskqueue.py) until interrupted"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=getattr(settings, 'TASK_WORKER_THREADS', 4))
+        parser.add_argument('--batch-size', type=int, default=getattr(settings, 'TASK_BATCH_SIZE', 10))
+        parser.add_argument('--visibility-timeout', type=int,
+                            default=getattr(settings, 'TASK_VISIBILITY_TIMEOUT', 300),
+                            help="Seconds before a claimed task may be picked up by another worker")
+        parser.add_argument('--poll-interval', type=float, default=getattr(settings, 'TASK_POLL_INTERVAL', 1.0))
+        parser.add_argument('--once', action='store_true',
+                            help="Exit once no tasks are due instead of waiting for more")
+
+    def handle(self, *args, **options):
+        worker = Worker(
+            threads=options['threads'],
+            batch_size=options['batch_size'],
+            visibility_timeout=options['visibility_timeout'],
+            poll_interval=options['poll_interval'],
+        )
+        # Finish the tasks in hand on SIGTERM/SIGINT instead of abandoning them
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda *_: worker.stop())
+
+        self.stdout.write(f"Worker {worker.id} started with {options['threads']} threads")
+        worker.run(once=options['once'])
+        self.stdout.write(self.style.SUCCESS(f"Worker {worker.id} stopped"))
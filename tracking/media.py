@@ -0,0 +1,126 @@
+"""
+Proof-of-delivery image processing.
+
+Drivers' uploads are written as-is to a staging area (StagedMedia) inside the
+request. A deferred task (tracking/taskqueue.py) then turns each one into a
+compressed original plus a thumbnail, stored content-addressed under
+proof/<hash>.jpg so the same photo uploaded twice is only kept once, and
+points the TrackingEvent at them.
+
+An upload that is gone or isn't an image is marked failed. Any other error,
+e.g. from storage, fails the task, so the queue retries it later.
+"""
+import hashlib
+import io
+import logging
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from .cache import invalidate, parcel_tag
+from .models import MediaAsset, StagedMedia, TrackingEvent
+from .sync import touch_parcel
+from .taskqueue import defer, task
+
+logger = logging.getLogger(__name__)
+
+# Failures a retry won't fix
+PERMANENT_ERRORS = (FileNotFoundError, UnidentifiedImageError, Image.DecompressionBombError, ValueError)
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def stage_upload(tracking_event, field, uploaded_file):
+    """Write the raw upload to staging and queue it for processing."""
+    staged = StagedMedia(tracking_event=tracking_event, field=field)
+    staged.file.save(uploaded_file.name, uploaded_file, save=False)
+    staged.save()
+    defer(process_staged, staged.pk)
+    return staged
+
+
+def stage_file(tracking_event, field, name):
+    """Queue a file that is already in storage, e.g. a finalized chunked upload."""
+    staged = StagedMedia.objects.create(tracking_event=tracking_event, field=field, file=name)
+    defer(process_staged, staged.pk)
+    return staged
+
+
+def _encode(image, max_size, quality):
+    image = image.copy()
+    image.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=quality, optimize=True, progressive=True)
+    return image.size, buffer.getvalue()
+
+
+def _flatten(image):
+    image = ImageOps.exif_transpose(image)
+    if image.mode in ('RGBA', 'LA', 'P'):
+        # Signatures are usually transparent PNGs; put them on white
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def store_asset(raw):
+    """Return the MediaAsset for these raw bytes, creating it if needed."""
+    digest = hashlib.sha256(raw).hexdigest()
+    asset = MediaAsset.objects.filter(sha256=digest).first()
+    if asset is not None:
+        return asset
+
+    image = _flatten(Image.open(io.BytesIO(raw)))
+    (width, height), original = _encode(
+        image, _setting('PROOF_IMAGE_MAX_SIZE', 1600), _setting('PROOF_IMAGE_QUALITY', 82))
+    _, thumbnail = _encode(image, _setting('PROOF_THUMBNAIL_SIZE', 320), 75)
+
+    base = f"proof/{digest[:2]}/{digest}"
+    names = {}
+    for suffix, content in (('', original), ('_thumb', thumbnail)):
+        name = f"{base}{suffix}.jpg"
+        if not default_storage.exists(name):
+            name = default_storage.save(name, ContentFile(content))
+        names[suffix] = name
+
+    try:
+        with transaction.atomic():
+            return MediaAsset.objects.create(
+                sha256=digest, original=names[''], thumbnail=names['_thumb'],
+                width=width, height=height, size=len(original))
+    except IntegrityError:
+        # Another worker processed the same bytes first
+        return MediaAsset.objects.get(sha256=digest)
+
+
+@task()
+def process_staged(staged_id):
+    staged = StagedMedia.objects.filter(pk=staged_id, status='pending').first()
+    if staged is None:
+        return None
+    try:
+        with staged.file.open('rb') as f:
+            asset = store_asset(f.read())
+    except PERMANENT_ERRORS as exc:
+        logger.exception("Processing staged media %s failed", staged.pk)
+        StagedMedia.objects.filter(pk=staged.pk).update(
+            status='failed', error=str(exc), processed_at=timezone.now())
+        return None
+
+    TrackingEvent.objects.filter(pk=staged.tracking_event_id).update(**{
+        staged.field: asset.original.name,
+        f'{staged.field}_thumbnail': asset.thumbnail.name,
+    })
+    StagedMedia.objects.filter(pk=staged.pk).update(status='done', processed_at=timezone.now())
+    touch_parcel(staged.tracking_event.parcel_id)
+    invalidate(parcel_tag(staged.tracking_event.parcel_id))
+    staged.file.delete(save=False)
+    return asset
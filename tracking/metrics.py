@@ -0,0 +1,268 @@
+"""
+Per-request performance metrics.
+
+MetricsMiddleware records, per view: latency, SQL query count and time,
+serializer time and response size, as Prometheus histograms served at
+/metrics. SQL is measured by an execute wrapper installed on every database
+connection when it is opened (see Django's connection.execute_wrapper), which
+attributes each query to the request running in the current context, so
+queries from async views' worker threads are counted too. Requests slower
+than METRICS_SLOW_REQUEST_MS are logged with their slowest statements.
+
+The registry is per process; with several server workers each one reports
+its own series.
+"""
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# Statements kept per request for the slow-request log
+SLOW_LOG_STATEMENTS = 10
+
+_current = ContextVar('request_stats', default=None)
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    def __init__(self, name, help_text, labels):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(self.labels, label_values)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        # Counts are stored per bucket and made cumulative when rendered
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def totals(self):
+        """Return {label values: (sum, count)} for every series."""
+        with self._lock:
+            return {label_values: (total, count) for label_values, (_, total, count) in self._series.items()}
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for label_values, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                    cumulative += bucket_count
+                    labels = _format_labels(self.labels, label_values, f'le="{bound}"')
+                    lines.append(f'{self.name}_bucket{labels} {cumulative}')
+                labels = _format_labels(self.labels, label_values)
+                lines.append(f'{self.name}_sum{labels} {total}')
+                lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+requests_total = registry.register(Counter(
+    'http_requests_total', "Requests by view, method and status.", ('view', 'method', 'status')))
+request_duration = registry.register(Histogram(
+    'http_request_duration_seconds', "Request latency.", ('view', 'method'), LATENCY_BUCKETS))
+request_queries = registry.register(Histogram(
+    'http_request_sql_queries', "SQL queries per request.", ('view', 'method'), QUERY_COUNT_BUCKETS))
+request_sql_duration = registry.register(Histogram(
+    'http_request_sql_duration_seconds', "Time spent in SQL per request.", ('view', 'method'), LATENCY_BUCKETS))
+request_serializer_duration = registry.register(Histogram(
+    'http_request_serializer_duration_seconds', "Time spent serializing per request.",
+    ('view', 'method'), LATENCY_BUCKETS))
+response_size = registry.register(Histogram(
+    'http_response_size_bytes', "Response body size.", ('view', 'method'), SIZE_BUCKETS))
+
+
+class RequestStats:
+    __slots__ = ('queries', 'sql_time', 'serializer_time', 'serializer_depth', 'statements')
+
+    def __init__(self):
+        self.queries = 0
+        self.sql_time = 0.0
+        self.serializer_time = 0.0
+        self.serializer_depth = 0
+        self.statements = []
+
+    def record_sql(self, sql, duration):
+        self.queries += 1
+        self.sql_time += duration
+        statements = self.statements
+        if len(statements) < SLOW_LOG_STATEMENTS:
+            statements.append((duration, sql))
+        elif duration > statements[-1][0]:
+            statements[-1] = (duration, sql)
+        else:
+            return
+        statements.sort(key=lambda item: item[0], reverse=True)
+
+
+def _record_sql(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.record_sql(sql, time.perf_counter() - start)
+
+
+@receiver(connection_created)
+def _install_sql_wrapper(sender, connection, **kwargs):
+    if _record_sql not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_sql)
+
+
+@contextmanager
+def serializer_timer():
+    """Time serializer work; nested serializers count once, at the outermost level."""
+    stats = _current.get()
+    if stats is None:
+        yield
+        return
+    stats.serializer_depth += 1
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.serializer_depth -= 1
+        if not stats.serializer_depth:
+            stats.serializer_time += time.perf_counter() - start
+
+
+class TimedSerializerMixin:
+    def to_representation(self, instance):
+        with serializer_timer():
+            return super().to_representation(instance)
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = _setting('METRICS_ENABLED', True)
+        self.slow_threshold = _setting('METRICS_SLOW_REQUEST_MS', 500) / 1000
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not self.enabled:
+            return self.get_response(request)
+        stats = RequestStats()
+        token = _current.set(stats)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self._record(request, response, stats, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        if not self.enabled:
+            return await self.get_response(request)
+        stats = RequestStats()
+        token = _current.set(stats)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self._record(request, response, stats, time.perf_counter() - start)
+        return response
+
+    def _record(self, request, response, stats, duration):
+        match = request.resolver_match
+        view = match.view_name if match else '<unmatched>'
+        if view == 'metrics':
+            return
+        method = request.method
+        requests_total.inc(view, method, response.status_code)
+        request_duration.observe(duration, view, method)
+        request_queries.observe(stats.queries, view, method)
+        request_sql_duration.observe(stats.sql_time, view, method)
+        request_serializer_duration.observe(stats.serializer_time, view, method)
+        if not response.streaming:
+            response_size.observe(len(response.content), view, method)
+
+        if duration >= self.slow_threshold:
+            statements = '\n'.join(f'  {elapsed * 1000:.1f}ms {sql}' for elapsed, sql in stats.statements)
+            logger.warning(
+                "Slow request %s %s (%s): %.0fms, %d queries in %.0fms, serializers %.0fms\n%s",
+                method, request.path, view, duration * 1000, stats.queries,
+                stats.sql_time * 1000, stats.serializer_time * 1000, statements,
+            )
@@ -0,0 +1,65 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:27
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+
+def seed_baselines(apps, schema_editor):
+    """
+    Give every existing parcel a baseline event holding its status and
+    tracking flag, so replaying its stream doesn't reset it.
+    """
+    Parcel = apps.get_model('tracking', 'Parcel')
+    ParcelEvent = apps.get_model('tracking', 'ParcelEvent')
+    alias = schema_editor.connection.alias
+    parcels = (Parcel.objects.using(alias).order_by('pk')
+               .only('pk', 'status', 'can_customer_track', 'booked_at'))
+    last_id = 0
+    while True:
+        batch = list(parcels.filter(pk__gt=last_id)[:BATCH_SIZE])
+        if not batch:
+            return
+        last_id = batch[-1].pk
+        ParcelEvent.objects.using(alias).bulk_create(
+            ParcelEvent(
+                parcel_id=parcel.pk,
+                event_type='baseline',
+                from_status='',
+                to_status=parcel.status,
+                data={'status': parcel.status, 'can_customer_track': parcel.can_customer_track},
+                timestamp=parcel.booked_at,
+            )
+            for parcel in batch
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracking', '0003_aboutsection'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ParcelEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_type', models.CharField(choices=[('booked', 'Booked'), ('pickup_assigned', 'Pickup Assigned'), ('collected', 'Collected'), ('departed', 'Departed'), ('delivery_assigned', 'Delivery Assigned'), ('out_for_delivery', 'Scanned for Delivery'), ('delivered', 'Delivered'), ('delivery_failed', 'Delivery Failed'), ('cancelled', 'Cancelled'), ('baseline', 'Baseline')], max_length=20)),
+                ('from_status', models.CharField(blank=True, max_length=20)),
+                ('to_status', models.CharField(max_length=20)),
+                ('data', models.JSONField(blank=True, default=dict)),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+                ('parcel', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='status_events', to='tracking.parcel')),
+            ],
+            options={
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['parcel', 'id'], name='tracking_pa_parcel__e19ef6_idx')],
+            },
+        ),
+        migrations.RunPython(seed_baselines, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:29
+
+import django.core.serializers.json
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracking', '0004_parcelevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedParcel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tracking_number', models.CharField(max_length=50, unique=True)),
+                ('original_id', models.BigIntegerField(db_index=True)),
+                ('status', models.CharField(choices=[('order_placed', 'Order Placed'), ('awaiting_pickup', 'Awaiting Pickup'), ('collected', 'Collected'), ('in_transit', 'In Transit'), ('out_for_delivery', 'Out for Delivery'), ('delivered', 'Delivered'), ('failed_delivery', 'Failed Delivery'), ('cancelled', 'Cancelled')], max_length=20)),
+                ('can_customer_track', models.BooleanField(default=False)),
+                ('booked_at', models.DateTimeField()),
+                ('closed_at', models.DateTimeField(blank=True, null=True)),
+                ('archived_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('detail', models.JSONField(default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('tracking', models.JSONField(default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('jobs', models.JSONField(default=list, encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('status_events', models.JSONField(default=list, encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('media', models.JSONField(default=list)),
+            ],
+            options={
+                'ordering': ['-closed_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='tracking_number',
+            field=models.CharField(blank=True, max_length=50),
+        ),
+        migrations.AddField(
+            model_name='parcel',
+            name='closed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='notification',
+            name='parcel',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='tracking.parcel'),
+        ),
+        migrations.AddIndex(
+            model_name='parcel',
+            index=models.Index(fields=['status', 'closed_at'], name='tracking_pa_status_24804b_idx'),
+        ),
+        migrations.AddField(
+            model_name='archivedparcel',
+            name='customer',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_parcels', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
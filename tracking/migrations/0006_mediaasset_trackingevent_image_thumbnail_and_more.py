@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:30
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracking', '0005_archivedparcel_parcel_closed_at_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaAsset',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64, unique=True)),
+                ('original', models.ImageField(upload_to='proof/')),
+                ('thumbnail', models.ImageField(upload_to='proof/')),
+                ('width', models.PositiveIntegerField()),
+                ('height', models.PositiveIntegerField()),
+                ('size', models.PositiveIntegerField(help_text='Compressed size in bytes')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='trackingevent',
+            name='image_thumbnail',
+            field=models.ImageField(blank=True, null=True, upload_to='proof/'),
+        ),
+        migrations.AddField(
+            model_name='trackingevent',
+            name='signature_thumbnail',
+            field=models.ImageField(blank=True, null=True, upload_to='proof/'),
+        ),
+        migrations.CreateModel(
+            name='StagedMedia',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('field', models.CharField(choices=[('image', 'Delivery Image'), ('signature', 'Signature')], max_length=20)),
+                ('file', models.FileField(upload_to='staging/proof/')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+                ('tracking_event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='staged_media', to='tracking.trackingevent')),
+            ],
+        ),
+    ]
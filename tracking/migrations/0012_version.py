@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracking', '0011_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='parcel',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,99 @@
+"""
+Full-text index over parcels (see tracking/search.py).
+
+SQLite: an FTS5 table keyed by parcel id, kept current by triggers on
+tracking_parcel. The trigger for customer username changes is added after
+migrating, by tracking.search, since SQLite can't rebuild tracking_parcel in
+a later migration while a trigger on another table refers to it.
+PostgreSQL: a GIN index on a weighted tsvector of the parcel's own text
+columns. Other backends, and SQLite builds without FTS5, get nothing and
+search falls back to LIKE.
+"""
+from django.db import migrations
+
+SQLITE_COLUMNS = 'tracking_number, customer, recipient_name, pickup_address, delivery_address, description'
+
+SQLITE_ROW = '''new.tracking_number, (SELECT username FROM tracking_user WHERE id = new.customer_id),
+    new.recipient_name, new.pickup_address, new.delivery_address, new.description'''
+
+SQLITE_CHANGED = ' OR '.join(
+    f'old.{column} IS NOT new.{column}'
+    for column in ('tracking_number', 'customer_id', 'recipient_name', 'pickup_address',
+                   'delivery_address', 'description'))
+
+SQLITE_CREATE = [
+    f"""CREATE VIRTUAL TABLE tracking_parcel_search USING fts5(
+        {SQLITE_COLUMNS}, tokenize = 'unicode61 remove_diacritics 2')""",
+    f"""CREATE TRIGGER tracking_parcel_search_insert AFTER INSERT ON tracking_parcel BEGIN
+        INSERT INTO tracking_parcel_search(rowid, {SQLITE_COLUMNS}) VALUES (new.id, {SQLITE_ROW});
+    END""",
+    # Status changes rewrite every column, so only reindex when the text changed
+    f"""CREATE TRIGGER tracking_parcel_search_update AFTER UPDATE ON tracking_parcel
+    WHEN {SQLITE_CHANGED} BEGIN
+        DELETE FROM tracking_parcel_search WHERE rowid = old.id;
+        INSERT INTO tracking_parcel_search(rowid, {SQLITE_COLUMNS}) VALUES (new.id, {SQLITE_ROW});
+    END""",
+    """CREATE TRIGGER tracking_parcel_search_delete AFTER DELETE ON tracking_parcel BEGIN
+        DELETE FROM tracking_parcel_search WHERE rowid = old.id;
+    END""",
+    f"""INSERT INTO tracking_parcel_search(rowid, {SQLITE_COLUMNS})
+    SELECT p.id, p.tracking_number, u.username, p.recipient_name, p.pickup_address, p.delivery_address, p.description
+    FROM tracking_parcel p JOIN tracking_user u ON u.id = p.customer_id""",
+]
+
+SQLITE_DROP = [
+    'DROP TRIGGER IF EXISTS tracking_parcel_search_customer',
+    'DROP TRIGGER IF EXISTS tracking_parcel_search_delete',
+    'DROP TRIGGER IF EXISTS tracking_parcel_search_update',
+    'DROP TRIGGER IF EXISTS tracking_parcel_search_insert',
+    'DROP TABLE IF EXISTS tracking_parcel_search',
+]
+
+# Must match tracking.search.POSTGRES_VECTOR for the index to be used
+POSTGRES_VECTOR = (
+    "setweight(to_tsvector('simple', coalesce(tracking_number, '')), 'A')"
+    " || setweight(to_tsvector('simple', coalesce(recipient_name, '')), 'B')"
+    " || setweight(to_tsvector('simple', coalesce(pickup_address, '') || ' ' || coalesce(delivery_address, '')"
+    " || ' ' || coalesce(description, '')), 'C')"
+)
+
+
+def _fts5_available(connection):
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA compile_options')
+        return any(option == 'ENABLE_FTS5' for option, in cursor.fetchall())
+
+
+def create_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite' and _fts5_available(connection):
+        statements = SQLITE_CREATE
+    elif connection.vendor == 'postgresql':
+        statements = [f'CREATE INDEX tracking_parcel_search ON tracking_parcel USING GIN (({POSTGRES_VECTOR}))']
+    else:
+        return
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def drop_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        statements = SQLITE_DROP
+    elif connection.vendor == 'postgresql':
+        statements = ['DROP INDEX IF EXISTS tracking_parcel_search']
+    else:
+        return
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracking', '0013_geofence'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
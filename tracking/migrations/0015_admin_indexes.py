@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracking', '0014_parcel_search'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='archivedparcel',
+            index=models.Index(fields=['closed_at'], name='tracking_ar_closed__4015dd_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(fields=['assigned_at'], name='tracking_jo_assigne_f482e4_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['created_at'], name='tracking_no_created_749bd8_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='parcel',
+            index=models.Index(fields=['booked_at'], name='tracking_pa_booked__ce8098_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='trackingevent',
+            index=models.Index(fields=['timestamp'], name='tracking_tr_timesta_475936_idx'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:02
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracking', '0016_shard_sequence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HeatmapCursor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('last_id', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='HeatmapTile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('layer', models.CharField(choices=[('drivers', 'Driver positions'), ('pickups', 'Pickup addresses'), ('deliveries', 'Delivery addresses')], max_length=20)),
+                ('zoom', models.PositiveSmallIntegerField()),
+                ('x', models.PositiveIntegerField()),
+                ('y', models.PositiveIntegerField()),
+                ('quadkey', models.CharField(max_length=32)),
+                ('counts', models.BinaryField()),
+                ('total', models.PositiveBigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['layer', 'zoom'], name='tracking_he_layer_184f6c_idx')],
+                'constraints': [models.UniqueConstraint(fields=('layer', 'quadkey'), name='unique_heatmap_tile')],
+            },
+        ),
+    ]
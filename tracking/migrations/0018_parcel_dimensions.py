@@ -0,0 +1,79 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:14
+
+import re
+
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+# A copy of tracking.loading's parser as it was when this migration was
+# written, so later changes to it don't change what the backfill does.
+DIMENSION_FIELDS = ('length_cm', 'width_cm', 'height_cm')
+UNITS_CM = {'mm': 0.1, 'cm': 1.0, 'm': 100.0, 'in': 2.54}
+_NUMBER = r'(\d+(?:[.,]\d+)?)\s*(mm|cm|m|in)?'
+_DIMENSIONS = re.compile(rf'^\s*{_NUMBER}\s*[x×*]\s*{_NUMBER}\s*[x×*]\s*{_NUMBER}\s*$', re.IGNORECASE)
+
+
+def parse_dimensions(text):
+    match = _DIMENSIONS.match(text or '')
+    if match is None:
+        return None
+    numbers = [float(value.replace(',', '.')) for value in match.group(1, 3, 5)]
+    units = [unit.lower() if unit else None for unit in match.group(2, 4, 6)]
+    default = units[2] or 'cm'
+    sizes = tuple(round(number * UNITS_CM[unit or default], 2) for number, unit in zip(numbers, units))
+    return sizes if all(size > 0 for size in sizes) else None
+
+
+def backfill_dimensions(apps, schema_editor):
+    Parcel = apps.get_model('tracking', 'Parcel')
+    parcels = Parcel.objects.using(schema_editor.connection.alias)
+    last_id = 0
+    while True:
+        batch = list(parcels.filter(pk__gt=last_id).order_by('pk').only('pk', 'dimensions')[:BATCH_SIZE])
+        if not batch:
+            return
+        last_id = batch[-1].pk
+        parsed = []
+        for parcel in batch:
+            sizes = parse_dimensions(parcel.dimensions)
+            if sizes is not None:
+                parcel.length_cm, parcel.width_cm, parcel.height_cm = sizes
+                parsed.append(parcel)
+        parcels.bulk_update(parsed, DIMENSION_FIELDS)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracking', '0017_heatmap'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='driver',
+            name='cargo_volume_m3',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='driver',
+            name='max_load_kg',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='parcel',
+            name='height_cm',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='parcel',
+            name='length_cm',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='parcel',
+            name='width_cm',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_dimensions, migrations.RunPython.noop),
+    ]
@@ -1,8 +1,11 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser
+from django.core.serializers.json import DjangoJSONEncoder
 from django.utils import timezone
 import uuid
 from django.contrib.auth import get_user_model
+
+from . import sharding
 # User = get_user_model()  # ❌ This should NOT be at the top of models.py
 
 
@@ -23,6 +26,9 @@ class User(AbstractUser):
 class Driver(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True)
     vehicle_details = models.TextField(blank=True)
+    # Vehicle capacity (tracking/loading.py); unset means the DRIVER_MAX_* defaults
+    max_load_kg = models.FloatField(null=True, blank=True)
+    cargo_volume_m3 = models.FloatField(null=True, blank=True)
     current_latitude = models.FloatField(null=True, blank=True)
     current_longitude = models.FloatField(null=True, blank=True)
     is_available = models.BooleanField(default=True)
@@ -31,7 +37,72 @@ class Driver(models.Model):
         return f"Driver: {self.user.username}"
 
 
-class Parcel(models.Model):
+class LocationPing(models.Model):
+    """One GPS position reported by a driver's app; together they form the driver's trace."""
+    driver = models.ForeignKey(Driver, on_delete=models.CASCADE, related_name='location_pings')
+    latitude = models.FloatField()
+    longitude = models.FloatField()
+    recorded_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        # A driver's trace; age, for purge_location_pings
+        indexes = [models.Index(fields=['driver', 'recorded_at']), models.Index(fields=['recorded_at'])]
+
+    def __str__(self):
+        return f"{self.driver_id} at ({self.latitude}, {self.longitude}) {self.recorded_at}"
+
+
+class VersionedModel(models.Model):
+    """Row with a version counter for optimistic concurrency (tracking/concurrency.py).
+    Every save bumps it, so concurrent guarded updates of the row fail
+    instead of overwriting this one."""
+    version = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            self.version += 1
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'version'}
+        super().save(*args, **kwargs)
+
+
+class ShardedModel(models.Model):
+    """Row stored on its parcel's shard (tracking/sharding.py). `shard_parent`
+    names the id field of the row it follows; None for Parcel itself, which
+    is placed by tracking number. With several shards, ids are allocated so
+    that the id alone tells the shard."""
+    sharded = True
+    shard_parent = None
+
+    objects = sharding.ShardedManager()
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            if self.pk is None and sharding.enabled():
+                kwargs['using'] = kwargs.get('using') or sharding.shard_of(self)
+                self.pk = sharding.allocate_ids(type(self), kwargs['using'])[0]
+            # A new row is inserted, even with its id already allocated,
+            # rather than tried as an UPDATE first
+            kwargs.setdefault('force_insert', True)
+        super().save(*args, **kwargs)
+
+
+class ShardSequence(models.Model):
+    """Id counter of a sharded table, kept on each shard (tracking/sharding.py)."""
+    name = models.CharField(max_length=100, unique=True)
+    value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name}: {self.value}"
+
+
+class Parcel(VersionedModel, ShardedModel):
     STATUS_CHOICES = (
         ('order_placed', 'Order Placed'),
         ('awaiting_pickup', 'Awaiting Pickup'),
@@ -52,6 +123,10 @@ class Parcel(models.Model):
     description = models.TextField()
     weight = models.FloatField(help_text="Weight in kg")
     dimensions = models.CharField(max_length=100, help_text="L x W x H in cm")
+    # Parsed from `dimensions` (tracking/loading.py); null when it didn't parse
+    length_cm = models.FloatField(null=True, blank=True)
+    width_cm = models.FloatField(null=True, blank=True)
+    height_cm = models.FloatField(null=True, blank=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='order_placed')
     current_driver = models.ForeignKey(Driver, on_delete=models.SET_NULL, null=True, blank=True)
     booked_at = models.DateTimeField(default=timezone.now)
@@ -61,17 +136,40 @@ class Parcel(models.Model):
     # ✅ New fields
     can_customer_track = models.BooleanField(default=False)
     sequence_number = models.PositiveIntegerField(null=True, blank=True)
+    closed_at = models.DateTimeField(null=True, blank=True)
+    # Bumped whenever the parcel or its tracking events change (see tracking/sync.py)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    # From the geocode cache (tracking/geo.py); null until the address is known
+    pickup_latitude = models.FloatField(null=True, blank=True)
+    pickup_longitude = models.FloatField(null=True, blank=True)
+    delivery_latitude = models.FloatField(null=True, blank=True)
+    delivery_longitude = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'closed_at']),
+            # Admin date hierarchies (admin.py)
+            models.Index(fields=['booked_at']),
+        ]
 
     def __str__(self):
         return f"Parcel {self.tracking_number} - {self.status}"
 
+    @property
+    def volume_m3(self):
+        if None in (self.length_cm, self.width_cm, self.height_cm):
+            return None
+        return self.length_cm * self.width_cm * self.height_cm / 1e6
+
     def save(self, *args, **kwargs):
         if not self.tracking_number:
             self.tracking_number = str(uuid.uuid4())[:8].upper()
         super().save(*args, **kwargs)
 
 
-class TrackingEvent(models.Model):
+class TrackingEvent(ShardedModel):
+    shard_parent = 'parcel_id'
+
     parcel = models.ForeignKey(Parcel, on_delete=models.CASCADE, related_name='tracking_events')
     timestamp = models.DateTimeField(default=timezone.now)
     location = models.CharField(max_length=200, blank=True)
@@ -79,20 +177,63 @@ class TrackingEvent(models.Model):
     notes = models.TextField(blank=True)
     image = models.ImageField(upload_to='tracking_images/', null=True, blank=True)
     signature = models.ImageField(upload_to='signatures/', null=True, blank=True)
+    image_thumbnail = models.ImageField(upload_to='proof/', null=True, blank=True)
+    signature_thumbnail = models.ImageField(upload_to='proof/', null=True, blank=True)
     created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
 
     class Meta:
         ordering = ['-timestamp']
+        indexes = [models.Index(fields=['timestamp'])]
 
     def __str__(self):
         return f"{self.parcel.tracking_number} - {self.status_update} at {self.timestamp}"
 
 
-class Job(models.Model):
+class ParcelEvent(ShardedModel):
+    """Append-only typed status change. Parcel.status and can_customer_track
+    are a projection of these rows (see tracking/transitions.py)."""
+    shard_parent = 'parcel_id'
+
+    EVENT_TYPES = (
+        ('booked', 'Booked'),
+        ('pickup_assigned', 'Pickup Assigned'),
+        ('collected', 'Collected'),
+        ('departed', 'Departed'),
+        ('delivery_assigned', 'Delivery Assigned'),
+        ('out_for_delivery', 'Scanned for Delivery'),
+        ('delivered', 'Delivered'),
+        ('delivery_failed', 'Delivery Failed'),
+        ('cancelled', 'Cancelled'),
+        ('baseline', 'Baseline'),
+    )
+
+    parcel = models.ForeignKey(Parcel, on_delete=models.CASCADE, related_name='status_events')
+    event_type = models.CharField(max_length=20, choices=EVENT_TYPES)
+    from_status = models.CharField(max_length=20, blank=True)
+    to_status = models.CharField(max_length=20)
+    data = models.JSONField(default=dict, blank=True)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    timestamp = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [models.Index(fields=['parcel', 'id'])]
+
+    def __str__(self):
+        return f"{self.parcel_id}: {self.event_type} ({self.from_status or '-'} -> {self.to_status})"
+
+    def save(self, *args, **kwargs):
+        if self.pk is not None:
+            raise ValueError("ParcelEvent rows are append-only")
+        super().save(*args, **kwargs)
+
+
+class Job(VersionedModel, ShardedModel):
     JOB_TYPES = (
         ('pickup', 'Pickup'),
         ('delivery', 'Delivery'),
     )
+    shard_parent = 'parcel_id'
 
     JOB_STATUS = (
         ('assigned', 'Assigned'),
@@ -102,6 +243,12 @@ class Job(models.Model):
         ('failed', 'Failed'),
     )
 
+    GEOFENCE_STATUS = (
+        ('', 'Not near'),
+        ('arriving', 'Arriving'),
+        ('arrived', 'Arrived'),
+    )
+
     parcel = models.ForeignKey(Parcel, on_delete=models.CASCADE, related_name='jobs')
     driver = models.ForeignKey(Driver, on_delete=models.CASCADE, related_name='jobs')
     job_type = models.CharField(max_length=20, choices=JOB_TYPES)
@@ -114,21 +261,119 @@ class Job(models.Model):
     # ✅ New fields
     estimated_arrival_time = models.DateTimeField(null=True, blank=True)
     location_access_enabled = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+    # How close the driver has come to the job's stop (tracking/geofence.py)
+    geofence_status = models.CharField(max_length=10, choices=GEOFENCE_STATUS, blank=True, default='')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['driver', 'updated_at']),
+            models.Index(fields=['driver', 'status']),
+            models.Index(fields=['assigned_at']),
+        ]
 
     def __str__(self):
         return f"{self.job_type} job for {self.parcel.tracking_number} - {self.status}"
 
 
-class Notification(models.Model):
+class JobTombstone(models.Model):
+    """Marks a deleted job so drivers syncing with ?since= can drop it."""
+    job_id = models.BigIntegerField()
+    driver_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [models.Index(fields=['driver_id', 'deleted_at'])]
+
+    def __str__(self):
+        return f"Job {self.job_id} deleted at {self.deleted_at}"
+
+
+class GeocodedAddress(models.Model):
+    """Known coordinates of a free-text address, keyed by its normalized form
+    (see tracking/geo.py). Filled from a gazetteer file or a geocoder."""
+    key = models.CharField(max_length=64, unique=True)
+    address = models.TextField()
+    latitude = models.FloatField()
+    longitude = models.FloatField()
+    source = models.CharField(max_length=20, default='gazetteer')
+    created_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.address} ({self.latitude}, {self.longitude})"
+
+
+class HeatmapTile(models.Model):
+    """Point counts per cell of one map tile of a heatmap layer (see tracking/heatmap.py)."""
+    LAYERS = [
+        ('drivers', 'Driver positions'),
+        ('pickups', 'Pickup addresses'),
+        ('deliveries', 'Delivery addresses'),
+    ]
+
+    layer = models.CharField(max_length=20, choices=LAYERS)
+    zoom = models.PositiveSmallIntegerField()
+    x = models.PositiveIntegerField()
+    y = models.PositiveIntegerField()
+    quadkey = models.CharField(max_length=32)
+    # Row-major little-endian uint32 counts, HEATMAP_TILE_BINS squared of them
+    counts = models.BinaryField()
+    total = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['layer', 'quadkey'], name='unique_heatmap_tile')]
+        indexes = [models.Index(fields=['layer', 'zoom'])]
+
+    def __str__(self):
+        return f"{self.layer} {self.zoom}/{self.x}/{self.y}: {self.total}"
+
+
+class HeatmapCursor(models.Model):
+    """Id of the last row of a source already counted into the heatmap tiles."""
+    name = models.CharField(max_length=100, unique=True)
+    last_id = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name}: {self.last_id}"
+
+
+class IdempotencyKey(models.Model):
+    """Response to a write request sent with an Idempotency-Key header, replayed
+    to retries of the same request (see tracking/idempotency.py)."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64, help_text="Hash of the method, path and payload")
+    # Null while the first request is still running
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    response = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['user', 'key'], name='unique_idempotency_key')]
+
+    def __str__(self):
+        return f"{self.key} ({self.status_code or 'in progress'})"
+
+
+class Notification(ShardedModel):
+    # Notifications without a parcel stay on the first shard
+    shard_parent = 'parcel_id'
+
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notifications')
     title = models.CharField(max_length=200)
     message = models.TextField()
     is_read = models.BooleanField(default=False)
     created_at = models.DateTimeField(default=timezone.now)
-    parcel = models.ForeignKey(Parcel, on_delete=models.CASCADE, null=True, blank=True)
+    # Archived parcels leave their notifications behind with the tracking number
+    parcel = models.ForeignKey(Parcel, on_delete=models.SET_NULL, null=True, blank=True)
+    tracking_number = models.CharField(max_length=50, blank=True)
+    # Key of the notify task that wrote it (tracking/notifications.py)
+    task_key = models.CharField(max_length=32, null=True, blank=True, unique=True)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [models.Index(fields=['created_at'])]
 
     def __str__(self):
         return f"Notification for {self.user.username}: {self.title}"
@@ -137,6 +382,128 @@ class Notification(models.Model):
 
 
 
+class MediaAsset(models.Model):
+    """Processed proof-of-delivery image, stored under its content hash so
+    identical uploads share one file."""
+    sha256 = models.CharField(max_length=64, unique=True)
+    original = models.ImageField(upload_to='proof/')
+    thumbnail = models.ImageField(upload_to='proof/')
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+    size = models.PositiveIntegerField(help_text="Compressed size in bytes")
+    created_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return self.sha256
+
+
+class StagedMedia(ShardedModel):
+    """Raw upload waiting for the media worker (tracking/media.py)."""
+    shard_parent = 'tracking_event_id'
+
+    FIELDS = (
+        ('image', 'Delivery Image'),
+        ('signature', 'Signature'),
+    )
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    )
+
+    tracking_event = models.ForeignKey(TrackingEvent, on_delete=models.CASCADE, related_name='staged_media')
+    field = models.CharField(max_length=20, choices=FIELDS)
+    file = models.FileField(upload_to='staging/proof/')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.field} for event {self.tracking_event_id} ({self.status})"
+
+
+class UploadSession(models.Model):
+    """Resumable chunked upload (see tracking/uploads.py)."""
+    STATUS_CHOICES = (
+        ('open', 'Open'),
+        ('finalized', 'Finalized'),
+        ('consumed', 'Consumed'),
+    )
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='upload_sessions')
+    filename = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField(help_text="Total size in bytes")
+    received = models.PositiveBigIntegerField(default=0)
+    sha256 = models.CharField(max_length=64, blank=True)
+    file = models.FileField(upload_to='staging/uploads/')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='open')
+    created_at = models.DateTimeField(default=timezone.now)
+    # Bumped by every chunk; stale uploads are purged by this, not their age
+    last_activity = models.DateTimeField(default=timezone.now)
+    finalized_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Upload {self.id} ({self.received}/{self.size})"
+
+
+class Task(models.Model):
+    """Deferred function call run by `manage.py run_worker` (tracking/taskqueue.py).
+    Rows are deleted once they succeed; dead ones are kept for inspection."""
+    STATUS_CHOICES = (
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('dead', 'Dead'),
+    )
+
+    name = models.CharField(max_length=200)
+    args = models.JSONField(default=list, encoder=DjangoJSONEncoder)
+    kwargs = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['run_at', 'id']
+        indexes = [models.Index(fields=['status', 'run_at'])]
+
+    def __str__(self):
+        return f"{self.name} ({self.status}, attempt {self.attempts}/{self.max_attempts})"
+
+
+class ArchivedParcel(models.Model):
+    """Closed parcel moved out of the hot tables by tracking/archive.py, with
+    its jobs and events kept as serialized snapshots and the storage names
+    of its proof images."""
+    tracking_number = models.CharField(max_length=50, unique=True)
+    original_id = models.BigIntegerField(db_index=True)
+    customer = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_parcels')
+    status = models.CharField(max_length=20, choices=Parcel.STATUS_CHOICES)
+    can_customer_track = models.BooleanField(default=False)
+    booked_at = models.DateTimeField()
+    closed_at = models.DateTimeField(null=True, blank=True)
+    archived_at = models.DateTimeField(default=timezone.now)
+
+    detail = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+    tracking = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+    jobs = models.JSONField(default=list, encoder=DjangoJSONEncoder)
+    status_events = models.JSONField(default=list, encoder=DjangoJSONEncoder)
+    media = models.JSONField(default=list)
+
+    class Meta:
+        ordering = ['-closed_at']
+        indexes = [models.Index(fields=['closed_at'])]
+
+    def __str__(self):
+        return f"Archived parcel {self.tracking_number} - {self.status}"
+
+
 class AboutSection(models.Model):
     heading = models.CharField(max_length=200)
     sub_heading = models.CharField(max_length=100)
@@ -0,0 +1,20 @@
+"""Customer and driver notifications, written by the task worker so requests don't wait on them."""
+from . import sharding
+from .models import Notification, Parcel
+from .taskqueue import task
+
+
+@task(keyed=True)
+def notify(user_id, title, message, parcel_id=None, task_key=None):
+    tracking_number = ''
+    if parcel_id is not None:
+        # Kept on the notification once the parcel is archived
+        tracking_number = Parcel.objects.filter(pk=parcel_id).values_list('tracking_number', flat=True).first() or ''
+    fields = {'user_id': user_id, 'title': title, 'message': message, 'parcel_id': parcel_id,
+              'tracking_number': tracking_number}
+    notifications = Notification.objects.using(sharding.shard_of(Notification(parcel_id=parcel_id)))
+    if task_key is None:
+        notifications.create(**fields)
+    else:
+        # A retried or repeated run finds the notification of its first run
+        notifications.get_or_create(task_key=task_key, defaults=fields)
@@ -0,0 +1,65 @@
+"""
+Pagination counts for large tables.
+
+Django's Paginator runs an exact COUNT(*) for every page, which on a table
+of millions of rows costs more than the page itself. EstimatedCountPaginator
+stops counting at ADMIN_EXACT_COUNT_LIMIT rows: a filtered list reports at
+most that many (its pages past the limit aren't offered), and an unfiltered
+list above it reports the database's own estimate of the table size instead
+(pg_class.reltuples on PostgreSQL, sqlite_stat1 or the id range on SQLite).
+Smaller results are counted exactly as before.
+"""
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Max, Min
+from django.utils.functional import cached_property
+
+from . import sharding
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def estimated_rows(model, using='default'):
+    """A cheap estimate of the number of rows in `model`'s table, or None."""
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [table])
+            row = cursor.fetchone()
+            # -1 until the table is first analyzed
+            return row[0] if row and row[0] >= 0 else None
+        if connection.vendor == 'sqlite':
+            if 'sqlite_stat1' in connection.introspection.table_names(cursor):
+                # Written by ANALYZE; the first number of `stat` is the row count
+                cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1', [table])
+                row = cursor.fetchone()
+                if row:
+                    return int(row[0].split()[0])
+            # Ids are mostly dense; min/max are index lookups
+            bounds = model._default_manager.using(using).aggregate(low=Min('pk'), high=Max('pk'))
+            if bounds['low'] is None:
+                return 0
+            if isinstance(bounds['low'], int):
+                # A shard's ids step by the number of shards
+                step = len(sharding.shards()) if sharding.enabled() and sharding.is_sharded(model) else 1
+                return (bounds['high'] - bounds['low']) // step + 1
+    return None
+
+
+class EstimatedCountPaginator(Paginator):
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not hasattr(queryset, 'query'):
+            return super().count
+        limit = _setting('ADMIN_EXACT_COUNT_LIMIT', 100000)
+        if not queryset.query.where:
+            estimate = estimated_rows(queryset.model, queryset.db)
+            if estimate is not None and estimate > limit:
+                return estimate
+        # Count no further than the limit
+        return min(queryset.order_by()[:limit + 1].count(), limit)
@@ -0,0 +1,37 @@
+"""
+Driver location pings.
+
+update_location stores every position a driver's app reports as a
+LocationPing, and together they form the driver's trace. Nothing else
+deletes them, so `purge()` (`manage.py purge_location_pings`, e.g. daily
+from cron) drops those older than LOCATION_PING_RETENTION_DAYS. Once the
+heatmap (tracking/heatmap.py) has counted pings, only the ones it has
+counted are dropped, so purge after `build_heatmaps`. A rebuilt heatmap can
+only count the pings still kept.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import HeatmapCursor, LocationPing
+
+BATCH_SIZE = 5000
+# The HeatmapCursor over the pings
+HEATMAP_CURSOR = 'pings'
+
+
+def purge(days=None, batch_size=BATCH_SIZE):
+    """Delete location pings older than `days` and already heatmapped; returns the number deleted."""
+    days = getattr(settings, 'LOCATION_PING_RETENTION_DAYS', 30) if days is None else days
+    old = LocationPing.objects.filter(recorded_at__lt=timezone.now() - timedelta(days=days))
+    counted = HeatmapCursor.objects.filter(name=HEATMAP_CURSOR).values_list('last_id', flat=True).first()
+    if counted is not None:
+        old = old.filter(pk__lte=counted)
+    deleted = 0
+    while True:
+        # Short transactions, so pings keep coming in meanwhile
+        ids = list(old.values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += LocationPing.objects.filter(pk__in=ids).delete()[0]
@@ -0,0 +1,276 @@
+"""
+In-process registry of driver availability and workload.
+
+Every worker process keeps one compact DriverState per driver: position,
+whether they're on duty (Driver.is_available, set by controllers), their
+vehicle's capacity, the number of open jobs and the total weight and volume
+of the parcels on them. A job is open until it's done: a pickup until the
+parcel is scanned, a delivery until it's completed or failed. A driver is
+available when on duty with fewer than DRIVER_MAX_OPEN_JOBS open jobs and
+room left in the vehicle (tracking/loading.py).
+
+The registry is built with one aggregate query (one per shard) when a
+server process starts (`start()`, from wsgi.py and asgi.py) and then kept
+current by the code paths that change it, once their transaction commits:
+job creation and deletion (signals), pickup scans and completed deliveries
+(views and tracking/batch.py) and location pings. Changes made by other
+processes, or by admin edits of a job's status, are picked up by a full
+rebuild every DRIVER_REGISTRY_REFRESH_INTERVAL seconds on a background
+thread, so AllDriversView and dispatch read workload without aggregating Job
+rows and no request waits for a rebuild. Processes that don't call `start()`
+(management commands, tests) build it on first use and rebuild it on reads
+once it's older than the interval.
+"""
+import logging
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, connections, transaction
+from django.db.models import Count, F, FloatField, Q, Sum, Value
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import loading, sharding
+from .geo import distance_m
+from .models import Driver, Job
+
+logger = logging.getLogger(__name__)
+
+OPEN_STATUSES = {
+    'pickup': ('assigned', 'accepted'),
+    'delivery': ('assigned', 'accepted', 'en_route'),
+}
+
+
+def open_jobs(prefix=''):
+    """Q for open jobs, on Job or (with prefix 'jobs__') on Driver."""
+    return (Q(**{f'{prefix}job_type': 'pickup', f'{prefix}status__in': OPEN_STATUSES['pickup']})
+            | Q(**{f'{prefix}job_type': 'delivery', f'{prefix}status__in': OPEN_STATUSES['delivery']}))
+
+
+def parcel_volume(prefix=''):
+    """Volume in m3 of the parcel at `prefix`; null when its dimensions are unknown."""
+    return (F(f'{prefix}length_cm') * F(f'{prefix}width_cm') * F(f'{prefix}height_cm')) / 1e6
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class DriverState:
+    __slots__ = ('driver_id', 'name', 'on_duty', 'latitude', 'longitude', 'open_jobs', 'assigned_weight',
+                 'assigned_volume', 'max_load_kg', 'max_volume_m3')
+
+    def __init__(self, driver_id, name, on_duty, latitude, longitude, open_jobs=0, assigned_weight=0.0,
+                 assigned_volume=0.0, max_load_kg=None, max_volume_m3=None):
+        self.driver_id = driver_id
+        self.name = name
+        self.on_duty = on_duty
+        self.latitude = latitude
+        self.longitude = longitude
+        self.open_jobs = open_jobs
+        self.assigned_weight = assigned_weight
+        self.assigned_volume = assigned_volume
+        self.max_load_kg = max_load_kg
+        self.max_volume_m3 = max_volume_m3
+
+    @property
+    def available(self):
+        return self.has_capacity(0)
+
+    def has_capacity(self, weight, volume=0.0):
+        return (self.on_duty
+                and self.open_jobs < _setting('DRIVER_MAX_OPEN_JOBS', 20)
+                and loading.fits(self, weight, volume))
+
+    def as_dict(self):
+        return {
+            'driver_id': self.driver_id,
+            'name': self.name,
+            'available': self.available,
+            'on_duty': self.on_duty,
+            'latitude': self.latitude,
+            'longitude': self.longitude,
+            'open_jobs': self.open_jobs,
+            'assigned_weight': round(self.assigned_weight, 3),
+            'assigned_volume': round(self.assigned_volume, 4),
+        }
+
+
+def _states(drivers):
+    open_filter = open_jobs('jobs__')
+    drivers = drivers.select_related('user').annotate(
+        open_jobs=Count('jobs', filter=open_filter),
+        assigned_weight=Coalesce(Sum('jobs__parcel__weight', filter=open_filter), Value(0.0),
+                                 output_field=FloatField()),
+        assigned_volume=Coalesce(Sum(parcel_volume('jobs__parcel__'), filter=open_filter), Value(0.0),
+                                 output_field=FloatField()),
+    )
+    states = [
+        DriverState(
+            driver.pk, driver.user.get_full_name() or driver.user.username, driver.is_available,
+            driver.current_latitude, driver.current_longitude, driver.open_jobs, driver.assigned_weight,
+            driver.assigned_volume, driver.max_load_kg, driver.cargo_volume_m3,
+        )
+        for driver in drivers
+    ]
+    # The annotations only count the jobs on `default`; add the other shards'
+    others = sharding.shards()[1:]
+    if others and states:
+        by_id = {state.driver_id: state for state in states}
+        for alias in others:
+            jobs = Job.objects.using(alias).filter(open_jobs())
+            if len(by_id) == 1:
+                jobs = jobs.filter(driver_id__in=by_id)
+            workload = jobs.values('driver_id').annotate(
+                count=Count('id'), weight=Sum('parcel__weight'), volume=Sum(parcel_volume('parcel__')))
+            for row in workload:
+                state = by_id.get(row['driver_id'])
+                if state is None:
+                    continue
+                state.open_jobs += row['count']
+                state.assigned_weight += row['weight'] or 0.0
+                state.assigned_volume += row['volume'] or 0.0
+    return iter(states)
+
+
+class DriverRegistry:
+    def __init__(self):
+        self._states = None
+        self._built_at = 0.0
+        self._lock = threading.Lock()
+        self._refresher = None
+
+    def build(self):
+        states = {state.driver_id: state for state in _states(Driver.objects.all())}
+        with self._lock:
+            self._states = states
+            self._built_at = time.monotonic()
+
+    def start(self):
+        """Build now and keep rebuilding in the background; once per server process."""
+        if self._refresher is not None:
+            return
+        try:
+            self.build()
+        except DatabaseError:
+            # E.g. before the first migrate; reads will build it
+            logger.exception("Could not build the driver registry")
+        finally:
+            connections.close_all()
+        self._refresher = threading.Thread(target=self._refresh, name='driver-registry', daemon=True)
+        self._refresher.start()
+
+    def _refresh(self):
+        while True:
+            time.sleep(_setting('DRIVER_REGISTRY_REFRESH_INTERVAL', 30))
+            try:
+                self.build()
+            except DatabaseError:
+                logger.exception("Could not rebuild the driver registry")
+            finally:
+                connections.close_all()
+
+    def _current(self):
+        interval = _setting('DRIVER_REGISTRY_REFRESH_INTERVAL', 30)
+        if self._states is None or (self._refresher is None and time.monotonic() - self._built_at >= interval):
+            self.build()
+        return self._states
+
+    def get(self, driver_id):
+        return self._current().get(driver_id)
+
+    def all(self):
+        states = self._current()
+        with self._lock:
+            return list(states.values())
+
+    def with_capacity(self, weight=0.0, latitude=None, longitude=None, limit=None, volume=0.0):
+        """Available drivers who can take `weight` more kg and `volume` more m3, nearest (or least loaded) first."""
+        states = [state for state in self.all() if state.has_capacity(weight, volume)]
+        if latitude is not None and longitude is not None:
+            def key(state):
+                if state.latitude is None or state.longitude is None:
+                    return math.inf, state.open_jobs
+                return distance_m(latitude, longitude, state.latitude, state.longitude), state.open_jobs
+        else:
+            def key(state):
+                return state.open_jobs, state.assigned_weight
+        states.sort(key=key)
+        return states[:limit] if limit else states
+
+    # Updates; these are no-ops until the registry is built
+
+    def _update(self, driver_id, change):
+        with self._lock:
+            state = self._states.get(driver_id) if self._states is not None else None
+            if state is not None:
+                change(state)
+
+    def job_opened(self, driver_id, weight, volume=0.0):
+        def change(state):
+            state.open_jobs += 1
+            state.assigned_weight += weight
+            state.assigned_volume += volume
+        self._update(driver_id, change)
+
+    def job_closed(self, driver_id, weight, volume=0.0):
+        def change(state):
+            state.open_jobs = max(state.open_jobs - 1, 0)
+            state.assigned_weight = max(state.assigned_weight - weight, 0.0)
+            state.assigned_volume = max(state.assigned_volume - volume, 0.0)
+        self._update(driver_id, change)
+
+    def moved(self, driver_id, latitude, longitude):
+        def change(state):
+            state.latitude, state.longitude = latitude, longitude
+        self._update(driver_id, change)
+
+    def reload(self, driver_id):
+        """Re-read one driver (after a profile change or a job deletion)."""
+        if self._states is None:
+            return
+        state = next(_states(Driver.objects.filter(pk=driver_id)), None)
+        with self._lock:
+            if self._states is None:
+                return
+            if state is None:
+                self._states.pop(driver_id, None)
+            else:
+                self._states[driver_id] = state
+
+    def reset(self):
+        with self._lock:
+            self._states = None
+
+
+drivers = DriverRegistry()
+
+
+def job_closed(job):
+    """Record, once the transaction commits, that `job` is no longer open."""
+    driver_id, weight, volume = job.driver_id, job.parcel.weight, job.parcel.volume_m3 or 0.0
+    transaction.on_commit(lambda: drivers.job_closed(driver_id, weight, volume), using=job._state.db)
+
+
+@receiver(post_save, sender=Job)
+def _job_saved(sender, instance, created, **kwargs):
+    if created and instance.status in OPEN_STATUSES.get(instance.job_type, ()):
+        driver_id, weight, volume = instance.driver_id, instance.parcel.weight, instance.parcel.volume_m3 or 0.0
+        transaction.on_commit(lambda: drivers.job_opened(driver_id, weight, volume), using=instance._state.db)
+
+
+@receiver(post_delete, sender=Job)
+def _job_deleted(sender, instance, **kwargs):
+    driver_id = instance.driver_id
+    transaction.on_commit(lambda: drivers.reload(driver_id), using=instance._state.db)
+
+
+@receiver(post_save, sender=Driver)
+@receiver(post_delete, sender=Driver)
+def _driver_changed(sender, instance, **kwargs):
+    driver_id = instance.pk
+    transaction.on_commit(lambda: drivers.reload(driver_id))
@@ -0,0 +1,88 @@
+"""
+Shard and read-replica routing.
+
+ShardRouter sends parcels and the rows that follow them to their shard, see
+tracking/sharding.py; it does nothing with a single database.
+
+Views opt in with ReplicaReadMixin; while one of them is running, reads of
+tracking models go to the `replica` alias when it is configured. Users,
+sessions and everything outside this app stay on the primary so
+authentication never depends on replication lag.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+from . import sharding
+
+REPLICA_ALIAS = 'replica'
+
+_use_replica = ContextVar('use_replica', default=False)
+
+
+@contextmanager
+def read_from_replica():
+    token = _use_replica.set(True)
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+
+class ReplicaReadMixin:
+    """Route this view's reads of tracking models to the replica."""
+
+    def dispatch(self, request, *args, **kwargs):
+        with read_from_replica():
+            return super().dispatch(request, *args, **kwargs)
+
+
+class ShardRouter:
+    def _route(self, model, instance):
+        if not sharding.enabled():
+            return None
+        if sharding.is_sharded(model):
+            if instance is not None and sharding.is_sharded(type(instance)):
+                # The row itself, or the row it was reached from
+                return sharding.shard_of(instance)
+            return sharding.active_shard()
+        if model._meta.label in sharding.MIRRORED and instance is not None:
+            # Copies on the other shards only serve joins and constraints
+            return DEFAULT_DB_ALIAS
+        return None
+
+    def db_for_read(self, model, **hints):
+        return self._route(model, hints.get('instance'))
+
+    def db_for_write(self, model, **hints):
+        return self._route(model, hints.get('instance'))
+
+    def allow_relation(self, obj1, obj2, **hints):
+        aliases = sharding.shards()
+        if len(aliases) > 1 and obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+
+class ReplicaRouter:
+    def _routable(self, model):
+        meta = model._meta
+        return meta.app_label == 'tracking' and meta.label != settings.AUTH_USER_MODEL
+
+    def db_for_read(self, model, **hints):
+        if _use_replica.get() and REPLICA_ALIAS in settings.DATABASES and self._routable(model):
+            return REPLICA_ALIAS
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if {obj1._state.db, obj2._state.db} <= {'default', REPLICA_ALIAS}:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica gets its schema from the primary
+        if db == REPLICA_ALIAS:
+            return False
+        return None
@@ -0,0 +1,216 @@
+"""
+Full-text search over parcels.
+
+The index (migration 0014) covers the tracking number, customer username,
+recipient name, both addresses and the description. On SQLite it's an FTS5
+table filled by triggers, so every write path, bulk ones included, keeps it
+current without application code; on PostgreSQL it's a GIN index on a
+weighted tsvector of the parcel's columns (customer usernames aren't part of
+it there). Anywhere else search falls back to LIKE over the same fields.
+
+Every word of the query must match, each as a prefix ("12 mai" finds
+"12 Main St"); words with punctuation inside, like a tracking number, match
+as a phrase. Ranked searches return the best SEARCH_MAX_RESULTS matches, the
+tracking number weighing most and the addresses and description least. With
+several shards (tracking/sharding.py) each shard's index is searched and the
+matches merged on their scores.
+
+SQLite alters a table by building a new one and renaming it into place,
+which drops the old table's triggers, and the rename fails while a trigger on
+tracking_user refers to tracking_parcel. So around every `migrate` the
+username trigger is set aside, and afterwards any missing trigger is put back
+and, if the parcel ones were lost, the index is rebuilt.
+"""
+import heapq
+import re
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.db.models.signals import post_migrate, pre_migrate
+from django.dispatch import receiver
+
+from . import sharding
+
+SQLITE_TABLE = 'tracking_parcel_search'
+# bm25 weights, in the table's column order: tracking_number, customer,
+# recipient_name, pickup_address, delivery_address, description
+SQLITE_WEIGHTS = (10.0, 5.0, 5.0, 1.0, 1.0, 1.0)
+
+# As created by migration 0014
+SQLITE_COLUMNS = 'tracking_number, customer, recipient_name, pickup_address, delivery_address, description'
+_SQLITE_ROW = ('''new.tracking_number, (SELECT username FROM tracking_user WHERE id = new.customer_id),
+    new.recipient_name, new.pickup_address, new.delivery_address, new.description''')
+_SQLITE_CHANGED = ' OR '.join(
+    f'old.{column} IS NOT new.{column}'
+    for column in ('tracking_number', 'customer_id', 'recipient_name', 'pickup_address',
+                   'delivery_address', 'description'))
+CUSTOMER_TRIGGER = 'tracking_parcel_search_customer'
+SQLITE_TRIGGERS = {
+    'tracking_parcel_search_insert': f"""CREATE TRIGGER tracking_parcel_search_insert AFTER INSERT ON tracking_parcel BEGIN
+        INSERT INTO {SQLITE_TABLE}(rowid, {SQLITE_COLUMNS}) VALUES (new.id, {_SQLITE_ROW});
+    END""",
+    'tracking_parcel_search_update': f"""CREATE TRIGGER tracking_parcel_search_update AFTER UPDATE ON tracking_parcel
+    WHEN {_SQLITE_CHANGED} BEGIN
+        DELETE FROM {SQLITE_TABLE} WHERE rowid = old.id;
+        INSERT INTO {SQLITE_TABLE}(rowid, {SQLITE_COLUMNS}) VALUES (new.id, {_SQLITE_ROW});
+    END""",
+    'tracking_parcel_search_delete': f"""CREATE TRIGGER tracking_parcel_search_delete AFTER DELETE ON tracking_parcel BEGIN
+        DELETE FROM {SQLITE_TABLE} WHERE rowid = old.id;
+    END""",
+    CUSTOMER_TRIGGER: f"""CREATE TRIGGER {CUSTOMER_TRIGGER} AFTER UPDATE OF username ON tracking_user
+    WHEN old.username IS NOT new.username BEGIN
+        UPDATE {SQLITE_TABLE} SET customer = new.username
+        WHERE rowid IN (SELECT id FROM tracking_parcel WHERE customer_id = new.id);
+    END""",
+}
+SQLITE_FILL = f"""INSERT INTO {SQLITE_TABLE}(rowid, {SQLITE_COLUMNS})
+    SELECT p.id, p.tracking_number, u.username, p.recipient_name, p.pickup_address, p.delivery_address, p.description
+    FROM tracking_parcel p JOIN tracking_user u ON u.id = p.customer_id"""
+
+POSTGRES_VECTOR = (
+    "setweight(to_tsvector('simple', coalesce(tracking_number, '')), 'A')"
+    " || setweight(to_tsvector('simple', coalesce(recipient_name, '')), 'B')"
+    " || setweight(to_tsvector('simple', coalesce(pickup_address, '') || ' ' || coalesce(delivery_address, '')"
+    " || ' ' || coalesce(description, '')), 'C')"
+)
+
+FALLBACK_FIELDS = ('tracking_number', 'customer__username', 'recipient_name', 'pickup_address',
+                   'delivery_address', 'description')
+
+_backends = {}
+
+
+def terms(text):
+    """The query's words, each a list of the tokens it's made of."""
+    return [tokens for tokens in (re.findall(r'\w+', word) for word in text.split()) if tokens]
+
+
+def _sqlite_query(words):
+    return ' '.join('"{}"*'.format(' '.join(tokens)) for tokens in words)
+
+
+def _postgres_query(words):
+    return ' & '.join('({}:*)'.format(' <-> '.join(tokens)) for tokens in words)
+
+
+def backend(alias):
+    """'sqlite', 'postgresql' or None (no index) for the database `alias`."""
+    if alias not in _backends:
+        connection = connections[alias]
+        found = None
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                if SQLITE_TABLE in connection.introspection.table_names(cursor):
+                    found = 'sqlite'
+        elif connection.vendor == 'postgresql':
+            found = 'postgresql'
+        _backends[alias] = found
+    return _backends[alias]
+
+
+def _ranked(alias, kind, words, limit):
+    """(score, -id) of the best matches on `alias`, best (lowest) first."""
+    if kind == 'sqlite':
+        weights = ', '.join(str(weight) for weight in SQLITE_WEIGHTS)
+        sql = (f'SELECT bm25({SQLITE_TABLE}, {weights}), rowid FROM {SQLITE_TABLE} '
+               f'WHERE {SQLITE_TABLE} MATCH %s ORDER BY 1 LIMIT %s')
+        params = [_sqlite_query(words), limit]
+    else:
+        sql = (f"SELECT -ts_rank({POSTGRES_VECTOR}, to_tsquery('simple', %s)), id FROM tracking_parcel "
+               f"WHERE {POSTGRES_VECTOR} @@ to_tsquery('simple', %s) ORDER BY 1, id DESC LIMIT %s")
+        params = [_postgres_query(words), _postgres_query(words), limit]
+    with connections[alias].cursor() as cursor:
+        cursor.execute(sql, params)
+        return [(score, -pk) for score, pk in cursor.fetchall()]
+
+
+def _matching(kind, words):
+    """A subquery of the ids of every matching parcel."""
+    if kind == 'sqlite':
+        return RawSQL(f'SELECT rowid FROM {SQLITE_TABLE} WHERE {SQLITE_TABLE} MATCH %s', [_sqlite_query(words)])
+    return RawSQL(f"SELECT id FROM tracking_parcel WHERE {POSTGRES_VECTOR} @@ to_tsquery('simple', %s)",
+                  [_postgres_query(words)])
+
+
+def _in_order(queryset, kind, ids):
+    """`queryset` ordered by the position of each row's id in `ids`."""
+    # One expression rather than a CASE with a branch per id, which costs
+    # more to build than the search itself
+    column = f'{queryset.model._meta.db_table}.id'
+    if kind == 'sqlite':
+        position = RawSQL(f"instr(%s, ',' || {column} || ',')", [',{},'.format(','.join(map(str, ids)))])
+    else:
+        position = RawSQL(f'array_position(%s::bigint[], {column})', [ids])
+    # Annotated, so rows from several shards can be merged on it
+    return queryset.filter(pk__in=ids).annotate(search_position=position).order_by('search_position')
+
+
+def _fallback(queryset, words):
+    for tokens in words:
+        word = ' '.join(tokens)
+        match = Q()
+        for field in FALLBACK_FIELDS:
+            match |= Q(**{f'{field}__icontains': word})
+        queryset = queryset.filter(match)
+    return queryset
+
+
+def search(queryset, text, ranked=True):
+    """
+    Parcels of `queryset` matching `text`. Ranked: the best matches, best
+    first. Unranked: every match, in the queryset's own order (for the admin).
+    """
+    words = terms(text)
+    if not words:
+        return queryset.none()
+    aliases = sharding.shards() if sharding.enabled() and queryset._db is None else (queryset.db,)
+    kinds = {backend(alias) for alias in aliases}
+    kind = kinds.pop() if len(kinds) == 1 else None
+    if kind is None:
+        return _fallback(queryset, words).everywhere()
+    if not ranked:
+        return queryset.filter(pk__in=_matching(kind, words)).everywhere()
+    limit = getattr(settings, 'SEARCH_MAX_RESULTS', 200)
+    best = heapq.nsmallest(limit, (match for alias in aliases for match in _ranked(alias, kind, words, limit)))
+    ids = [-negated_id for _, negated_id in best]
+    return _in_order(queryset, kind, ids).everywhere() if ids else queryset.none()
+
+
+# Keeping the SQLite triggers through migrations
+
+def _has_sqlite_index(connection):
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        return SQLITE_TABLE in connection.introspection.table_names(cursor)
+
+
+@receiver(pre_migrate)
+def _set_triggers_aside(sender, using, **kwargs):
+    connection = connections[using]
+    if sender.label == 'tracking' and _has_sqlite_index(connection):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TRIGGER IF EXISTS {CUSTOMER_TRIGGER}')
+
+
+@receiver(post_migrate)
+def _restore_triggers(sender, using, **kwargs):
+    if sender.label != 'tracking':
+        return
+    # The index may have been created (or removed) by these migrations
+    _backends.pop(using, None)
+    connection = connections[using]
+    if not _has_sqlite_index(connection):
+        return
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'")
+        existing = {name for name, in cursor.fetchall()}
+        missing = [name for name in SQLITE_TRIGGERS if name not in existing]
+        for name in missing:
+            cursor.execute(SQLITE_TRIGGERS[name])
+        if set(missing) - {CUSTOMER_TRIGGER}:
+            # tracking_parcel was rebuilt; writes since then went unindexed
+            cursor.execute(f'DELETE FROM {SQLITE_TABLE}')
+            cursor.execute(SQLITE_FILL)
@@ -1,6 +1,9 @@
+from django.conf import settings
 from rest_framework import serializers
 from django.contrib.auth import authenticate
-from .models import User, Driver, Parcel, TrackingEvent, Job, Notification
+from . import heatmap
+from .metrics import TimedSerializerMixin
+from .models import User, Driver, HeatmapTile, Parcel, TrackingEvent, Job, Notification, UploadSession
 
 
 
@@ -47,23 +50,43 @@ class LoginSerializer(serializers.Serializer):
         return data
 
 
-class DriverSerializer(serializers.ModelSerializer):
+class DriverSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
 
     class Meta:
         model = Driver
-        fields = ('user', 'vehicle_details', 'current_latitude', 'current_longitude', 'is_available')
+        fields = ('user', 'vehicle_details', 'max_load_kg', 'cargo_volume_m3', 'current_latitude', 'current_longitude',
+                  'is_available')
 
 
 class TrackingEventSerializer(serializers.ModelSerializer):
     created_by_name = serializers.CharField(source='created_by.username', read_only=True)
+    # Proof images are served as thumbnails; the compressed originals are
+    # available under *_original
+    image = serializers.SerializerMethodField()
+    signature = serializers.SerializerMethodField()
+    image_original = serializers.ImageField(source='image', read_only=True)
+    signature_original = serializers.ImageField(source='signature', read_only=True)
 
     class Meta:
         model = TrackingEvent
-        fields = ('id', 'timestamp', 'location', 'status_update', 'notes', 'image', 'signature', 'created_by_name')
+        fields = ('id', 'timestamp', 'location', 'status_update', 'notes', 'image', 'signature',
+                  'image_original', 'signature_original', 'created_by_name')
 
+    def _file_url(self, file):
+        if not file:
+            return None
+        request = self.context.get('request')
+        return request.build_absolute_uri(file.url) if request else file.url
 
-class ParcelSerializer(serializers.ModelSerializer):
+    def get_image(self, obj):
+        return self._file_url(obj.image_thumbnail or obj.image)
+
+    def get_signature(self, obj):
+        return self._file_url(obj.signature_thumbnail or obj.signature)
+
+
+class ParcelSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     tracking_events = TrackingEventSerializer(many=True, read_only=True)
     customer_name = serializers.CharField(source='customer.username', read_only=True)
     driver_name = serializers.CharField(source='current_driver.user.username', read_only=True)
@@ -73,9 +96,9 @@ class ParcelSerializer(serializers.ModelSerializer):
         model = Parcel
         fields = ('id', 'tracking_number', 'customer', 'customer_name', 'pickup_address',
                  'delivery_address', 'recipient_name', 'recipient_phone', 'description',
-                 'weight', 'dimensions', 'status', 'current_driver', 'driver_name',
+                 'weight', 'dimensions', 'length_cm', 'width_cm', 'height_cm', 'status', 'current_driver', 'driver_name',
                  'booked_at', 'expected_delivery_date', 'delivery_instructions', 'tracking_events', 'can_customer_track')
-        read_only_fields = ('tracking_number', 'booked_at')
+        read_only_fields = ('tracking_number', 'booked_at', 'length_cm', 'width_cm', 'height_cm')
 
 
 class ParcelBookingSerializer(serializers.ModelSerializer):
@@ -89,7 +112,7 @@ class ParcelBookingSerializer(serializers.ModelSerializer):
         return super().create(validated_data)
 
 
-class JobSerializer(serializers.ModelSerializer):
+class JobSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     parcel = ParcelSerializer(read_only=True)
     driver_name = serializers.CharField(source='driver.user.username', read_only=True)
 
@@ -99,10 +122,10 @@ class JobSerializer(serializers.ModelSerializer):
                  'assigned_at', 'accepted_at', 'completed_at', 'notes')
 
 
-class NotificationSerializer(serializers.ModelSerializer):
+class NotificationSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Notification
-        fields = ('id', 'title', 'message', 'is_read', 'created_at', 'parcel')
+        fields = ('id', 'title', 'message', 'is_read', 'created_at', 'parcel', 'tracking_number')
 
 
 # class ParcelTrackingSerializer(serializers.ModelSerializer):
@@ -113,7 +136,7 @@ class NotificationSerializer(serializers.ModelSerializer):
 #         fields = ('tracking_number', 'status', 'pickup_address', 'delivery_address', 
 #                  'recipient_name', 'booked_at', 'expected_delivery_date', 'tracking_events')
 
-class ParcelTrackingSerializer(serializers.ModelSerializer):
+class ParcelTrackingSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     tracking_events = TrackingEventSerializer(many=True, read_only=True)
     driver_latitude = serializers.FloatField(source='current_driver.current_latitude', read_only=True)
     driver_longitude = serializers.FloatField(source='current_driver.current_longitude', read_only=True)
@@ -144,4 +167,59 @@ class DeliveryCompletionSerializer(serializers.Serializer):
     notes = serializers.CharField(required=False, allow_blank=True)
     delivery_image = serializers.ImageField(required=False)
     signature = serializers.ImageField(required=False)
+    # Finalized chunked uploads can be referenced instead of sending files inline
+    delivery_image_upload_id = serializers.UUIDField(required=False)
+    signature_upload_id = serializers.UUIDField(required=False)
+
+
+class DriverActionSerializer(serializers.Serializer):
+    action = serializers.ChoiceField(choices=('accept', 'scan', 'complete'))
+    job_id = serializers.IntegerField()
+    # When the driver performed the action; defaults to when it arrives
+    timestamp = serializers.DateTimeField(required=False)
+    notes = serializers.CharField(required=False, allow_blank=True)
+    delivery_image_upload_id = serializers.UUIDField(required=False)
+    signature_upload_id = serializers.UUIDField(required=False)
+
+
+class DriverBatchSerializer(serializers.Serializer):
+    actions = DriverActionSerializer(many=True, allow_empty=False)
+
+    def validate_actions(self, actions):
+        limit = getattr(settings, 'DRIVER_BATCH_MAX_ACTIONS', 200)
+        if len(actions) > limit:
+            raise serializers.ValidationError(f'At most {limit} actions per batch')
+        return actions
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    upload_id = serializers.UUIDField(source='id', read_only=True)
+    offset = serializers.IntegerField(source='received', read_only=True)
+
+    class Meta:
+        model = UploadSession
+        fields = ('upload_id', 'filename', 'size', 'sha256', 'offset', 'status')
+        read_only_fields = ('status',)
+        extra_kwargs = {'sha256': {'required': False}}
+
+
+
+class HeatmapCoverageSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = HeatmapTile
+        fields = ('layer', 'zoom', 'x', 'y', 'quadkey', 'total', 'updated_at')
+
+
+class HeatmapTileSerializer(HeatmapCoverageSerializer):
+    # Rows of cell counts, north to south, each west to east; null for an empty tile
+    counts = serializers.SerializerMethodField()
+    max = serializers.SerializerMethodField()
+
+    class Meta(HeatmapCoverageSerializer.Meta):
+        fields = HeatmapCoverageSerializer.Meta.fields + ('max', 'counts')
+
+    def get_counts(self, obj):
+        return heatmap.cells(obj).tolist() if obj.total else None
 
+    def get_max(self, obj):
+        return int(heatmap.cells(obj).max()) if obj.total else 0
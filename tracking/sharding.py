@@ -0,0 +1,427 @@
+"""
+Parcels spread over several databases.
+
+SHARD_DATABASES lists the shards, `default` first (see
+parcel_tracking_system/database.py). A parcel is stored on the shard its
+tracking number hashes to, and its jobs, tracking events, status events,
+notifications and staged media go with it (models.ShardedModel), so
+everything that happens to one parcel is one transaction on one database
+and the shards' writer locks are taken independently. Users and drivers live
+on `default` and are copied to every other shard on save, so foreign keys and
+joins work there too; those copies are for that only (location pings don't
+reach them), reads of users and drivers go to `default`.
+
+With several shards, ids are allocated per shard from ShardSequence so that
+`id % shards` is the shard's position in the list: a row is found from its
+id alone, and a child row's shard from its parent id. Routing
+(tracking.routers.ShardRouter) follows from that:
+
+- rows read through another row (`job.parcel`, `parcel.tracking_events`)
+  and new rows go to that row's shard;
+- `filter()` on an id, a parent id or a tracking number goes to that shard,
+  so single-parcel lookups, get_object_or_404 included, need no changes;
+- `everywhere()` runs a list query on every shard and merges the rows on
+  the query's ordering (ScatterGather), for list views and paginators;
+- `atomic(alias)` opens a transaction on `default` and the shard, and
+  sends queries that can't be routed otherwise (bulk_update(), update() on
+  a filter) to the shard; `routed(alias)` does only the latter, for
+  maintenance loops over `shards()`.
+
+The Django admin lists one shard at a time, picked with its shard filter
+(tracking/admin.py).
+
+With only `default` configured all of this is a no-op. The shard list can't
+change once parcels are stored: rows aren't moved between shards.
+"""
+import hashlib
+import heapq
+import itertools
+from collections.abc import Collection
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, models, transaction
+from django.db.models import F, Max
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+# Rows copied from `default` to every shard
+MIRRORED = ('tracking.User', 'tracking.Driver')
+
+_active = ContextVar('active_shard', default=None)
+
+
+def shards():
+    return tuple(getattr(settings, 'SHARD_DATABASES', None) or (DEFAULT_DB_ALIAS,))
+
+
+def enabled():
+    return len(shards()) > 1
+
+
+def is_sharded(model):
+    return getattr(model, 'sharded', False)
+
+
+def shard_for_key(tracking_number):
+    aliases = shards()
+    if len(aliases) == 1:
+        return aliases[0]
+    digest = hashlib.blake2b(str(tracking_number).encode(), digest_size=8).digest()
+    return aliases[int.from_bytes(digest, 'big') % len(aliases)]
+
+
+def shard_for_id(pk):
+    aliases = shards()
+    return aliases[int(pk) % len(aliases)]
+
+
+def shard_of(instance):
+    """The shard `instance` (a sharded row) is, or will be, stored on."""
+    aliases = shards()
+    if len(aliases) == 1:
+        return aliases[0]
+    if not instance._state.adding and instance._state.db in aliases:
+        return instance._state.db
+    if instance.pk is not None:
+        return shard_for_id(instance.pk)
+    if instance.shard_parent is None:
+        return shard_for_key(instance.tracking_number)
+    parent_id = getattr(instance, instance.shard_parent)
+    return aliases[0] if parent_id is None else shard_for_id(parent_id)
+
+
+def active_shard():
+    return _active.get()
+
+
+@contextmanager
+def routed(alias):
+    """Send queries with nothing else to route them by to `alias`."""
+    token = _active.set(alias)
+    try:
+        yield
+    finally:
+        _active.reset(token)
+
+
+@contextmanager
+def atomic(alias):
+    """A transaction on `default` and on the shard `alias`, routed to it."""
+    with transaction.atomic(), routed(alias):
+        if alias == DEFAULT_DB_ALIAS:
+            yield
+        else:
+            with transaction.atomic(using=alias):
+                yield
+
+
+def by_shard(items, key):
+    """{alias: [item, ...]} with `key(item)` an id, in order of first appearance."""
+    groups = {}
+    for item in items:
+        groups.setdefault(shard_for_id(key(item)), []).append(item)
+    return groups
+
+
+def allocate_ids(model, alias, count=1):
+    """`count` new ids for `model` rows stored on `alias`."""
+    from .models import ShardSequence
+
+    aliases = shards()
+    position, size = aliases.index(alias), len(aliases)
+    name = model._meta.db_table
+    counters = ShardSequence.objects.using(alias).filter(name=name)
+    with transaction.atomic(using=alias):
+        if not counters.update(value=F('value') + count):
+            # First allocation: start above whatever the table holds
+            highest = model._base_manager.using(alias).aggregate(highest=Max('pk'))['highest'] or 0
+            try:
+                with transaction.atomic(using=alias):
+                    ShardSequence.objects.using(alias).create(name=name, value=highest // size + count)
+            except IntegrityError:
+                counters.update(value=F('value') + count)
+        value = counters.values_list('value', flat=True).get()
+    return [n * size + position for n in range(value - count + 1, value + 1)]
+
+
+# Querysets
+
+def _id_shard(value):
+    if isinstance(value, models.Model):
+        return shard_of(value) if is_sharded(type(value)) else None
+    try:
+        return shard_for_id(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class ShardedQuerySet(models.QuerySet):
+    def _lookup_shard(self, lookups):
+        """The one shard `lookups` (filter keyword arguments) confine rows to, or None."""
+        parent = self.model.shard_parent
+        # Fields holding an id that tells the shard
+        ids = {'pk', 'id'}
+        if parent is not None:
+            ids.update((parent, parent.removesuffix('_id')))
+        found = set()
+        for lookup, value in lookups.items():
+            name = lookup.removesuffix('__exact')
+            if name in ids:
+                if value is not None:
+                    found.add(_id_shard(value))
+            elif name.endswith('__in') and name.removesuffix('__in') in ids:
+                if not isinstance(value, Collection) or isinstance(value, str) or not value:
+                    return None
+                found.update(_id_shard(item) for item in value)
+            elif parent is None and name == 'tracking_number':
+                found.add(shard_for_key(value))
+        return found.pop() if len(found) == 1 else None
+
+    def filter(self, *args, **kwargs):
+        queryset = super().filter(*args, **kwargs)
+        if self._db is None and enabled():
+            alias = self._lookup_shard(kwargs)
+            if alias is not None:
+                queryset = queryset.using(alias)
+        return queryset
+
+    def create(self, **kwargs):
+        if self._db is not None or not enabled():
+            return super().create(**kwargs)
+        # self.db only knows the active shard; the new row knows its own
+        obj = self.model(**kwargs)
+        self._for_write = True
+        obj.save(force_insert=True, using=shard_of(obj))
+        return obj
+
+    def for_key(self, tracking_number):
+        return self.using(shard_for_key(tracking_number)) if enabled() else self.all()
+
+    def for_id(self, pk):
+        return self.using(shard_for_id(pk)) if enabled() else self.all()
+
+    def everywhere(self):
+        """This queryset over every shard (a ScatterGather), or itself with one shard."""
+        if self._db is not None or not enabled():
+            return self.all()
+        return ScatterGather(self)
+
+    def bulk_create(self, objs, *args, **kwargs):
+        if not enabled():
+            return super().bulk_create(objs, *args, **kwargs)
+        objs = list(objs)
+        groups = {self._db: objs} if self._db is not None else {}
+        if not groups:
+            for obj in objs:
+                groups.setdefault(shard_of(obj), []).append(obj)
+        for alias, part in groups.items():
+            new = [obj for obj in part if obj.pk is None]
+            for obj, pk in zip(new, allocate_ids(self.model, alias, len(new)) if new else ()):
+                obj.pk = pk
+            models.QuerySet.bulk_create(self.using(alias), part, *args, **kwargs)
+        return objs
+
+
+ShardedManager = models.Manager.from_queryset(ShardedQuerySet)
+
+
+class _Descending:
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+
+def _sort_key(model, ordering):
+    """Sort key for model rows matching the SQL `ordering`; nulls sort first."""
+    fields = []
+    for item in ordering:
+        if isinstance(item, str):
+            if item == '?':
+                raise TypeError("Random ordering can't be merged across shards")
+            descending, name = item.startswith('-'), item.lstrip('-')
+        else:
+            descending = getattr(item, 'descending', False)
+            name = getattr(getattr(item, 'expression', item), 'name', None)
+            if name is None:
+                raise TypeError(f"Can't merge rows across shards on {item!r}")
+        if name == 'pk':
+            name = model._meta.pk.name
+        try:
+            attname = model._meta.get_field(name).attname
+        except FieldDoesNotExist:
+            # An annotation
+            attname = name
+        fields.append((attname, descending))
+
+    def key(row):
+        values = []
+        for attname, descending in fields:
+            value = getattr(row, attname)
+            value = (value is not None, value)
+            values.append(_Descending(value) if descending else value)
+        return values
+    return key
+
+
+class ScatterGather:
+    """
+    A queryset run on every shard with its rows merged, in place of a
+    queryset for list views and paginators: it chains filters, counts,
+    slices (lazily), and iterates with `for` or `async for`. Merging follows
+    the queryset's ordering, which must be on fields or annotations of the
+    model's own rows; unordered, the shards' rows follow one another.
+    """
+
+    def __init__(self, queryset, low=0, high=None):
+        self.queryset = queryset
+        self.model = queryset.model
+        self._low = low
+        self._high = high
+        self._result_cache = None
+
+    def __repr__(self):
+        return f'<ScatterGather {self.queryset.query}>'
+
+    def _clone(self, queryset):
+        if self._low or self._high is not None:
+            raise TypeError('Cannot change a query once a slice has been taken.')
+        return ScatterGather(queryset)
+
+    def all(self):
+        return self._clone(self.queryset.all())
+
+    def filter(self, *args, **kwargs):
+        return self._clone(self.queryset.filter(*args, **kwargs))
+
+    def exclude(self, *args, **kwargs):
+        return self._clone(self.queryset.exclude(*args, **kwargs))
+
+    def order_by(self, *fields):
+        return self._clone(self.queryset.order_by(*fields))
+
+    def select_related(self, *fields):
+        return self._clone(self.queryset.select_related(*fields))
+
+    def prefetch_related(self, *lookups):
+        return self._clone(self.queryset.prefetch_related(*lookups))
+
+    def none(self):
+        return self.queryset.none()
+
+    def _parts(self):
+        return [self.queryset.using(alias) for alias in shards()]
+
+    def _ordering(self):
+        query = self.queryset.query
+        if query.order_by:
+            return list(query.order_by)
+        if query.default_ordering:
+            return list(self.model._meta.ordering)
+        return []
+
+    @property
+    def ordered(self):
+        return bool(self._ordering())
+
+    def _fetch(self):
+        if self._result_cache is None:
+            high = self._high
+            parts = [part if high is None else part[:high] for part in self._parts()]
+            ordering = self._ordering()
+            if ordering:
+                rows = heapq.merge(*parts, key=_sort_key(self.model, ordering))
+            else:
+                rows = itertools.chain(*parts)
+            self._result_cache = list(itertools.islice(rows, self._low, high))
+        return self._result_cache
+
+    def count(self):
+        if self._low or self._high is not None:
+            return len(self._fetch())
+        return sum(part.count() for part in self._parts())
+
+    async def acount(self):
+        return await sync_to_async(self.count)()
+
+    def exists(self):
+        return any(part.exists() for part in self._parts())
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            if index.step is not None or (index.start or 0) < 0 or (index.stop or 0) < 0:
+                raise ValueError('Only forward slices without a step are supported.')
+            if self._low or self._high is not None:
+                return self._fetch()[index]
+            return ScatterGather(self.queryset, index.start or 0, index.stop)
+        return list(self[index:index + 1])[0]
+
+    def __len__(self):
+        return len(self._fetch())
+
+    def __bool__(self):
+        return bool(self._fetch())
+
+    def __iter__(self):
+        return iter(self._fetch())
+
+    def __aiter__(self):
+        async def rows():
+            for row in await sync_to_async(self._fetch)():
+                yield row
+        return rows()
+
+
+# Users and drivers on every shard
+
+def _mirrored(sender, using):
+    return using == DEFAULT_DB_ALIAS and sender._meta.label in MIRRORED and enabled()
+
+
+def copy_row(instance, alias):
+    """Write `instance`'s current values to its copy on `alias`."""
+    model = type(instance)
+    values = {field.attname: getattr(instance, field.attname)
+              for field in model._meta.concrete_fields if not field.primary_key}
+    if not model._base_manager.using(alias).filter(pk=instance.pk).update(**values):
+        # bulk_create sends no post_save, which would copy it again
+        model._base_manager.using(alias).bulk_create([model(pk=instance.pk, **values)])
+
+
+def copy_rows(queryset, alias, batch_size=1000):
+    """Copy the rows of `queryset` (of a mirrored model) to `alias`, for rows
+    written without signals; returns how many."""
+    model = queryset.model
+    fields = [field.attname for field in model._meta.concrete_fields if not field.primary_key]
+    rows = queryset.using(DEFAULT_DB_ALIAS).order_by('pk').iterator(chunk_size=batch_size)
+    copied = 0
+    while batch := list(itertools.islice(rows, batch_size)):
+        model._base_manager.using(alias).bulk_create(
+            batch, update_conflicts=True, unique_fields=[model._meta.pk.name], update_fields=fields)
+        copied += len(batch)
+    return copied
+
+
+@receiver(post_save)
+def _copy_saved(sender, instance, using, **kwargs):
+    if _mirrored(sender, using):
+        for alias in shards()[1:]:
+            copy_row(instance, alias)
+
+
+@receiver(post_delete)
+def _delete_copies(sender, instance, using, **kwargs):
+    if _mirrored(sender, using):
+        for alias in shards()[1:]:
+            # Cascades to the parcels and jobs on that shard
+            sender._base_manager.using(alias).filter(pk=instance.pk).delete()
@@ -0,0 +1,99 @@
+"""
+Delta sync of a driver's jobs.
+
+`GET /api/jobs/my_jobs/?since=<cursor>` returns only the jobs that changed
+after the cursor, where a job counts as changed when its own row or its
+parcel's changed (Job.updated_at / Parcel.updated_at; the parcel's is also
+bumped for new tracking events and processed proof images), plus the ids
+of jobs deleted since then from JobTombstone. `since=0` returns every job.
+Each response carries the cursor for the next call.
+
+Cursors lag the clock by SYNC_CURSOR_OVERLAP seconds, so rows written by a
+transaction that committed after the previous response are still picked
+up; clients must treat results as upserts, as a job may be sent twice.
+Tombstones are kept for SYNC_TOMBSTONE_DAYS; an older cursor gets a full
+list with `reset` set, and the client should drop its copy first.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Job, JobTombstone, Parcel, TrackingEvent
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def encode_cursor(moment):
+    return str(int(moment.timestamp() * 1_000_000))
+
+
+def decode_cursor(cursor):
+    """Return the datetime a cursor stands for, or None for a full sync ('0')."""
+    try:
+        micros = int(cursor)
+    except (TypeError, ValueError):
+        raise InvalidCursor(f"Invalid cursor: {cursor!r}")
+    if micros < 0:
+        raise InvalidCursor(f"Invalid cursor: {cursor!r}")
+    if micros == 0:
+        return None
+    return datetime.fromtimestamp(micros / 1_000_000, tz=dt_timezone.utc)
+
+
+def next_cursor(now=None):
+    now = now or timezone.now()
+    return encode_cursor(now - timedelta(seconds=_setting('SYNC_CURSOR_OVERLAP', 10)))
+
+
+def job_changes(jobs, driver_id, since, now=None):
+    """
+    Narrow the `jobs` queryset (one driver's jobs) to those changed after
+    `since` and return (jobs, deleted job ids, reset).
+    """
+    now = now or timezone.now()
+    if since is not None and since < now - timedelta(days=_setting('SYNC_TOMBSTONE_DAYS', 30)):
+        since = None
+        reset = True
+    else:
+        reset = False
+    if since is None:
+        return jobs, [], reset
+
+    changed = jobs.filter(Q(updated_at__gt=since) | Q(parcel__updated_at__gt=since))
+    deleted = list(
+        JobTombstone.objects.filter(driver_id=driver_id, deleted_at__gt=since)
+        .values_list('job_id', flat=True).distinct()
+    )
+    return changed, deleted, reset
+
+
+def touch_parcel(parcel_id):
+    """Mark a parcel changed after an update() that bypassed auto_now."""
+    Parcel.objects.filter(pk=parcel_id).update(updated_at=timezone.now())
+
+
+def purge_tombstones(days=None):
+    days = _setting('SYNC_TOMBSTONE_DAYS', 30) if days is None else days
+    deleted, _ = JobTombstone.objects.filter(deleted_at__lt=timezone.now() - timedelta(days=days)).delete()
+    return deleted
+
+
+@receiver(post_save, sender=TrackingEvent)
+def _touch_tracked_parcel(sender, instance, **kwargs):
+    # Jobs embed their parcel's tracking history
+    touch_parcel(instance.parcel_id)
+
+
+@receiver(post_delete, sender=Job)
+def _record_tombstone(sender, instance, **kwargs):
+    JobTombstone.objects.create(job_id=instance.pk, driver_id=instance.driver_id)
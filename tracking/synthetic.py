@@ -0,0 +1,328 @@
+"""
+Deterministic synthetic data for load and performance testing.
+
+Builds customers, drivers and parcels at different points of their
+lifecycle, with the jobs, status events, tracking events, notifications and
+driver GPS pings a real parcel would leave behind. Every value comes from one
+seeded random generator and timestamps are relative to a fixed end date, so
+the same parameters always produce the same rows. Rows are written with
+bulk_create in chunks, one transaction per chunk of parcels.
+"""
+import math
+import random
+import uuid
+from datetime import datetime, time as dt_time, timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.utils import timezone
+
+from . import loading, sharding
+from .models import (
+    Driver, Job, LocationPing, Notification, Parcel, ParcelEvent, TrackingEvent, User,
+)
+
+STREETS = ('Main St', 'Oak Ave', 'Pine St', 'Maple Dr', 'Elm St', 'Cedar Ln', 'Park Rd',
+           'Lake View', 'Hill St', 'River Rd', 'Station Rd', 'Church St', 'Mill Ln', 'High St')
+CITIES = ('Springfield', 'Riverton', 'Fairview', 'Greenville', 'Kingston', 'Salem',
+          'Franklin', 'Madison', 'Clinton', 'Georgetown')
+FIRST_NAMES = ('James', 'Mary', 'John', 'Patricia', 'Robert', 'Jennifer', 'Michael', 'Linda',
+               'David', 'Elizabeth', 'Aisha', 'Wei', 'Carlos', 'Fatima', 'Ivan', 'Priya')
+LAST_NAMES = ('Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller', 'Davis',
+              'Khan', 'Chen', 'Lopez', 'Singh', 'Novak', 'Okafor', 'Silva', 'Ahmed')
+CONTENTS = ('Electronics', 'Books and Documents', 'Clothing', 'Spare parts', 'Cosmetics',
+            'Toys', 'Kitchenware', 'Medical supplies', 'Shoes', 'Groceries')
+# Model, payload (kg) and cargo volume (m3)
+VEHICLES = (
+    ('Ford Transit', 1000, 11.0), ('Mercedes Sprinter', 1200, 14.0), ('Renault Master', 1300, 13.0),
+    ('Toyota Hiace', 1000, 9.0), ('Honda Civic', 300, 0.4),
+)
+
+# How far through the lifecycle parcels get, by age. Older parcels are
+# mostly finished, recent ones are still moving.
+FINAL_STAGES = (
+    ('delivered', 0.86), ('delivery_failed', 0.04), ('cancelled', 0.04),
+    ('out_for_delivery', 0.02), ('departed', 0.02), ('collected', 0.01), ('pickup_assigned', 0.01),
+)
+LIFECYCLE = ('booked', 'pickup_assigned', 'collected', 'departed', 'delivery_assigned',
+             'out_for_delivery', 'delivered')
+STATUS_AFTER = {
+    'booked': 'order_placed', 'pickup_assigned': 'awaiting_pickup', 'collected': 'collected',
+    'departed': 'in_transit', 'delivery_assigned': 'out_for_delivery',
+    'out_for_delivery': 'out_for_delivery', 'delivered': 'delivered',
+    'delivery_failed': 'failed_delivery', 'cancelled': 'cancelled',
+}
+TRACKING_TEXT = {
+    'booked': ('Order placed', 'Parcel booking confirmed'),
+    'pickup_assigned': ('Assigned to driver for pickup', 'Driver assigned for pickup'),
+    'collected': ('Collected from sender', 'Parcel scanned by driver'),
+    'departed': ('In transit', 'Departed origin facility'),
+    'delivery_assigned': ('Assigned to driver for delivery', 'Driver assigned for delivery'),
+    'out_for_delivery': ('Out for delivery', 'Parcel scanned by driver'),
+    'delivered': ('Delivered successfully', 'Package delivered'),
+    'delivery_failed': ('Delivery attempt failed', 'Recipient not available'),
+    'cancelled': ('Cancelled', 'Cancelled at customer request'),
+}
+CUSTOMER_NOTIFICATIONS = {
+    'booked': 'Parcel Booked Successfully',
+    'collected': 'Parcel Status Update',
+    'out_for_delivery': 'Parcel Status Update',
+    'delivered': 'Parcel Delivered',
+    'delivery_failed': 'Delivery Attempt Failed',
+}
+
+
+class SyntheticDataGenerator:
+    def __init__(self, customers=1000, drivers=100, parcels=10000, events_per_parcel=2,
+                 days=90, center=(40.7128, -74.0060), radius_km=30, pings_per_job=20,
+                 seed=42, chunk_size=5000, prefix='synth', until=None, password='password123',
+                 log=None):
+        self.customers = customers
+        self.drivers = drivers
+        self.parcels = parcels
+        self.events_per_parcel = events_per_parcel
+        self.days = days
+        self.center = center
+        self.radius_km = radius_km
+        self.pings_per_job = pings_per_job
+        self.chunk_size = chunk_size
+        self.prefix = prefix
+        self.password = password
+        self.rng = random.Random(seed)
+        until = until or timezone.localdate()
+        self.until = timezone.make_aware(datetime.combine(until, dt_time.min))
+        self.log = log or (lambda message: None)
+        self.counts = {}
+
+    # Helpers
+
+    def _count(self, name, rows):
+        self.counts[name] = self.counts.get(name, 0) + len(rows)
+
+    def _point(self):
+        """Uniformly random point within radius_km of the center."""
+        distance = self.radius_km * math.sqrt(self.rng.random())
+        bearing = self.rng.uniform(0, 2 * math.pi)
+        lat = self.center[0] + (distance / 111.32) * math.cos(bearing)
+        lng = self.center[1] + (distance / (111.32 * math.cos(math.radians(self.center[0])))) * math.sin(bearing)
+        return round(lat, 6), round(lng, 6)
+
+    def _address(self):
+        rng = self.rng
+        return f"{rng.randint(1, 9999)} {rng.choice(STREETS)}, {rng.choice(CITIES)}, {rng.randint(10000, 99999)}"
+
+    def _name(self):
+        return self.rng.choice(FIRST_NAMES), self.rng.choice(LAST_NAMES)
+
+    def _phone(self):
+        return f"+1{self.rng.randint(2000000000, 9999999999)}"
+
+    def _tracking_number(self):
+        return str(uuid.UUID(int=self.rng.getrandbits(128), version=4))
+
+    def _bulk(self, model, rows):
+        created = model.objects.bulk_create(rows, batch_size=self.chunk_size)
+        self._count(model._meta.model_name, rows)
+        return created
+
+    # Users
+
+    def _users(self, kind, count):
+        password = make_password(self.password)  # hashed once, shared by every synthetic user
+        users = []
+        for i in range(count):
+            first, last = self._name()
+            username = f'{self.prefix}_{kind}{i}'
+            users.append(User(
+                username=username, email=f'{username}@example.com', password=password,
+                first_name=first, last_name=last, user_type=kind, phone_number=self._phone(),
+                address=self._address() if kind == 'customer' else '',
+                date_joined=self.until - timedelta(days=self.days + self.rng.randint(0, 365)),
+            ))
+        return self._bulk(User, users)
+
+    def _create_people(self):
+        customers = self._users('customer', self.customers)
+        driver_users = self._users('driver', self.drivers)
+        drivers = []
+        for user in driver_users:
+            lat, lng = self._point()
+            vehicle, max_load_kg, cargo_volume_m3 = self.rng.choice(VEHICLES)
+            drivers.append(Driver(
+                user=user,
+                vehicle_details=f"{vehicle}, License: {self.rng.randint(100, 999)}-{self.rng.randint(1000, 9999)}",
+                max_load_kg=max_load_kg, cargo_volume_m3=cargo_volume_m3,
+                current_latitude=lat, current_longitude=lng,
+            ))
+        self._bulk(Driver, drivers)
+        self.log(f"Created {len(customers)} customers and {len(drivers)} drivers")
+        return [user.pk for user in customers], [user.pk for user in driver_users]
+
+    # Parcels
+
+    def _final_stage(self, age_days):
+        if age_days < 1:
+            # Parcels booked today are spread over the early stages
+            return self.rng.choice(LIFECYCLE[:-1])
+        roll = self.rng.random()
+        for stage, share in FINAL_STAGES:
+            roll -= share
+            if roll < 0:
+                return stage
+        return 'delivered'
+
+    def _steps(self, final):
+        if final in ('cancelled', 'delivery_failed'):
+            stop = self.rng.choice(('booked', 'pickup_assigned', 'collected')) if final == 'cancelled' else 'out_for_delivery'
+            return list(LIFECYCLE[:LIFECYCLE.index(stop) + 1]) + [final]
+        return list(LIFECYCLE[:LIFECYCLE.index(final) + 1])
+
+    def _trace(self, driver_id, start, end, started_at, finished_at):
+        """GPS pings along a jittered straight line between two points."""
+        pings = []
+        count = self.pings_per_job
+        span = (finished_at - started_at).total_seconds()
+        for i in range(count):
+            t = i / max(count - 1, 1)
+            pings.append(LocationPing(
+                driver_id=driver_id,
+                latitude=round(start[0] + (end[0] - start[0]) * t + self.rng.gauss(0, 0.0003), 6),
+                longitude=round(start[1] + (end[1] - start[1]) * t + self.rng.gauss(0, 0.0003), 6),
+                recorded_at=started_at + timedelta(seconds=span * t),
+            ))
+        return pings
+
+    def _create_parcel_chunk(self, count, customer_ids, driver_ids):
+        rng = self.rng
+        plans = []
+        parcels = []
+        for _ in range(count):
+            booked_at = self.until - timedelta(seconds=rng.uniform(0, self.days * 86400))
+            age_days = (self.until - booked_at).total_seconds() / 86400
+            steps = self._steps(self._final_stage(age_days))
+
+            # Spread the steps over at most the parcel's age (and ~3 days)
+            budget = min((self.until - booked_at).total_seconds(), 3 * 86400)
+            offsets = sorted(rng.uniform(0, budget) for _ in steps[1:])
+            times = [booked_at] + [booked_at + timedelta(seconds=offset) for offset in offsets]
+
+            final_status = STATUS_AFTER[steps[-1]]
+            driver_id = rng.choice(driver_ids) if len(steps) > 1 and driver_ids else None
+            closed_at = times[-1] if final_status in ('delivered', 'cancelled') else None
+            parcels.append(Parcel(
+                tracking_number=self._tracking_number(),
+                customer_id=rng.choice(customer_ids),
+                pickup_address=self._address(),
+                delivery_address=self._address(),
+                recipient_name=' '.join(self._name()),
+                recipient_phone=self._phone(),
+                description=rng.choice(CONTENTS),
+                weight=round(rng.lognormvariate(0.5, 0.8), 2),
+                dimensions=f"{rng.randint(10, 80)} x {rng.randint(10, 60)} x {rng.randint(2, 50)}",
+                status=final_status,
+                current_driver_id=driver_id if final_status not in ('order_placed', 'cancelled') else None,
+                booked_at=booked_at,
+                expected_delivery_date=booked_at + timedelta(days=rng.randint(1, 5)),
+                can_customer_track='delivery_assigned' in steps,
+                closed_at=closed_at,
+            ))
+            origin, destination = self._point(), self._point()
+            parcel = parcels[-1]
+            parcel.length_cm, parcel.width_cm, parcel.height_cm = loading.parse_dimensions(parcel.dimensions)
+            parcel.pickup_latitude, parcel.pickup_longitude = origin
+            parcel.delivery_latitude, parcel.delivery_longitude = destination
+            plans.append((steps, times, driver_id, origin, destination))
+
+        parcels = self._bulk(Parcel, parcels)
+
+        events, tracking, jobs, notifications, pings = [], [], [], [], []
+        for parcel, (steps, times, driver_id, origin, destination) in zip(parcels, plans):
+            previous = ''
+            pickup_job = delivery_job = None
+            for step, at in zip(steps, times):
+                target = STATUS_AFTER[step]
+                events.append(ParcelEvent(
+                    parcel_id=parcel.pk, event_type=step, from_status=previous, to_status=target,
+                    data={'driver_id': driver_id} if step.endswith('_assigned') else {},
+                    created_by_id=driver_id if step in ('collected', 'out_for_delivery', 'delivered') else None,
+                    timestamp=at,
+                ))
+                previous = target
+
+                status_update, notes = TRACKING_TEXT[step]
+                tracking.append(TrackingEvent(
+                    parcel_id=parcel.pk, timestamp=at, status_update=status_update, notes=notes,
+                    location=parcel.pickup_address if step in ('booked', 'collected') else '',
+                    created_by_id=driver_id if step != 'booked' else parcel.customer_id,
+                ))
+                if step == 'departed':
+                    # Hub scans between leaving the origin and delivery
+                    for hop in range(self.events_per_parcel):
+                        tracking.append(TrackingEvent(
+                            parcel_id=parcel.pk, timestamp=at + timedelta(minutes=30 * (hop + 1)),
+                            status_update='Arrived at sorting facility',
+                            location=f"{self.rng.choice(CITIES)} Distribution Center",
+                        ))
+
+                if step in CUSTOMER_NOTIFICATIONS:
+                    notifications.append(Notification(
+                        user_id=parcel.customer_id, parcel_id=parcel.pk,
+                        tracking_number=parcel.tracking_number, created_at=at,
+                        title=CUSTOMER_NOTIFICATIONS[step],
+                        message=f"Your parcel {parcel.tracking_number}: {status_update.lower()}",
+                        is_read=at < self.until - timedelta(days=2),
+                    ))
+
+                if step in ('pickup_assigned', 'delivery_assigned'):
+                    job = Job(
+                        parcel_id=parcel.pk, driver_id=driver_id,
+                        job_type='pickup' if step == 'pickup_assigned' else 'delivery',
+                        status='assigned', assigned_at=at,
+                    )
+                    jobs.append(job)
+                    notifications.append(Notification(
+                        user_id=driver_id, parcel_id=parcel.pk,
+                        tracking_number=parcel.tracking_number, created_at=at,
+                        title=f"New {job.job_type.title()} Job Assigned",
+                        message=f"You have been assigned a {job.job_type} job for parcel {parcel.tracking_number}",
+                        is_read=at < self.until - timedelta(days=1),
+                    ))
+                    if job.job_type == 'pickup':
+                        pickup_job = job
+                    else:
+                        delivery_job = job
+                elif step == 'collected' and pickup_job:
+                    pickup_job.status, pickup_job.accepted_at, pickup_job.completed_at = 'completed', at, at
+                    pings.extend(self._trace(driver_id, self._point(), origin, pickup_job.assigned_at, at))
+                elif step == 'out_for_delivery' and delivery_job:
+                    delivery_job.status, delivery_job.accepted_at = 'en_route', at
+                elif step in ('delivered', 'delivery_failed') and delivery_job:
+                    delivery_job.status = 'completed' if step == 'delivered' else 'failed'
+                    delivery_job.completed_at = at
+                    pings.extend(self._trace(driver_id, origin, destination, delivery_job.accepted_at or at, at))
+
+        self._bulk(ParcelEvent, events)
+        self._bulk(TrackingEvent, tracking)
+        self._bulk(Job, jobs)
+        self._bulk(Notification, notifications)
+        self._bulk(LocationPing, pings)
+
+    def run(self):
+        if User.objects.filter(username__startswith=f'{self.prefix}_').exists():
+            raise ValueError(f"Synthetic users with prefix '{self.prefix}' already exist")
+
+        with transaction.atomic():
+            customer_ids, driver_ids = self._create_people()
+        # bulk_create sends no signals, so copy the people to the other shards here
+        for alias in sharding.shards()[1:]:
+            sharding.copy_rows(User.objects.filter(pk__in=customer_ids + driver_ids), alias)
+            sharding.copy_rows(Driver.objects.filter(pk__in=driver_ids), alias)
+
+        created = 0
+        while created < self.parcels:
+            count = min(self.chunk_size, self.parcels - created)
+            with transaction.atomic():
+                self._create_parcel_chunk(count, customer_ids, driver_ids)
+            created += count
+            self.log(f"Created {created}/{self.parcels} parcels")
+        return self.counts
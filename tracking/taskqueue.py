@@ -0,0 +1,203 @@
+"""
+Database-backed task queue.
+
+`defer(func, *args, **kwargs)` stores a Task row in the caller's transaction,
+so work is queued if and only if the request's changes commit, and no broker
+is needed. `manage.py run_worker` claims due tasks in batches and runs them
+on a thread pool:
+
+- a claimed task is hidden from other workers until its visibility timeout
+  passes, so tasks of a worker that died are picked up again after that;
+- a failing task is retried with exponential backoff and marked dead, with
+  its last traceback, after max_attempts.
+
+Tasks run at least once and must be idempotent. A task that can't be made
+so by its arguments alone is declared `@task(keyed=True)`: `defer` then
+adds a unique `task_key` argument, fixed when the task is queued, which
+every run of it gets and which it can record to skip a repeat. With
+TASKS_EAGER set,
+deferred tasks run in-process right after the transaction commits instead
+(development without a worker).
+"""
+import logging
+import os
+import socket
+import threading
+import traceback
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Task
+
+logger = logging.getLogger(__name__)
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def task(max_attempts=None, keyed=False):
+    """Mark a module-level function as deferrable."""
+    def decorator(func):
+        func.task_name = f'{func.__module__}.{func.__qualname__}'
+        func.task_max_attempts = max_attempts
+        func.task_keyed = keyed
+        return func
+    return decorator
+
+
+def _with_key(func, kwargs):
+    if func.task_keyed and 'task_key' not in kwargs:
+        return {**kwargs, 'task_key': uuid.uuid4().hex}
+    return kwargs
+
+
+def defer(func, *args, **kwargs):
+    """Queue `func(*args, **kwargs)`; arguments must be JSON serializable."""
+    if not hasattr(func, 'task_name'):
+        raise TypeError(f"{func!r} is not a @task")
+    kwargs = _with_key(func, kwargs)
+    if _setting('TASKS_EAGER', False):
+        transaction.on_commit(lambda: func(*args, **kwargs), robust=True)
+        return None
+    return Task.objects.create(
+        name=func.task_name,
+        args=list(args),
+        kwargs=kwargs,
+        max_attempts=func.task_max_attempts or _setting('TASK_MAX_ATTEMPTS', 5),
+    )
+
+
+def defer_many(func, calls):
+    """Queue `func` once per (args, kwargs) pair in `calls` with one INSERT."""
+    if not hasattr(func, 'task_name'):
+        raise TypeError(f"{func!r} is not a @task")
+    calls = [(args, _with_key(func, kwargs)) for args, kwargs in calls]
+    if _setting('TASKS_EAGER', False):
+        for args, kwargs in calls:
+            transaction.on_commit(lambda args=args, kwargs=kwargs: func(*args, **kwargs), robust=True)
+        return []
+    max_attempts = func.task_max_attempts or _setting('TASK_MAX_ATTEMPTS', 5)
+    return Task.objects.bulk_create([
+        Task(name=func.task_name, args=list(args), kwargs=kwargs, max_attempts=max_attempts)
+        for args, kwargs in calls
+    ])
+
+
+def _resolve(name):
+    func = import_string(name)
+    if getattr(func, 'task_name', None) != name:
+        raise ImportError(f"{name} is not a registered task")
+    return func
+
+
+def claim(worker_id, limit, visibility_timeout):
+    """Lock up to `limit` due tasks for `worker_id` and return them."""
+    now = timezone.now()
+    locked_until = now + timedelta(seconds=visibility_timeout)
+    expired = Q(status='running', locked_until__lt=now)
+
+    with transaction.atomic():
+        # A task whose last attempt timed out will not be retried again
+        Task.objects.filter(expired, attempts__gte=F('max_attempts')).update(
+            status='dead', locked_by='', locked_until=None,
+            last_error='Visibility timeout expired on the last attempt')
+
+        due = Q(status='queued', run_at__lte=now) | expired
+        candidates = Task.objects.filter(due).order_by('run_at', 'id')
+        if connection.features.has_select_for_update_skip_locked:
+            candidates = candidates.select_for_update(skip_locked=True)
+        ids = list(candidates.values_list('pk', flat=True)[:limit])
+        if not ids:
+            return []
+        Task.objects.filter(due, pk__in=ids).update(
+            status='running', locked_by=worker_id, locked_until=locked_until,
+            attempts=F('attempts') + 1)
+
+    return list(Task.objects.filter(pk__in=ids, locked_by=worker_id, locked_until=locked_until))
+
+
+def execute(task, worker_id):
+    """Run a claimed task and record the outcome. Returns True on success."""
+    # Only touch the row while we still hold it; after the visibility timeout
+    # another worker may have claimed it
+    held = Task.objects.filter(pk=task.pk, locked_by=worker_id, locked_until=task.locked_until)
+    try:
+        _resolve(task.name)(*task.args, **task.kwargs)
+    except Exception:
+        logger.exception("Task %s (%s) failed on attempt %s", task.pk, task.name, task.attempts)
+        error = traceback.format_exc()
+        if task.attempts >= task.max_attempts:
+            held.update(status='dead', last_error=error, locked_by='', locked_until=None)
+        else:
+            backoff = _setting('TASK_RETRY_BACKOFF', 10) * 2 ** (task.attempts - 1)
+            held.update(status='queued', last_error=error, locked_by='', locked_until=None,
+                        run_at=timezone.now() + timedelta(seconds=backoff))
+        return False
+    held.delete()
+    return True
+
+
+def drain(worker_id='inline', batch_size=100):
+    """Run every due task in the current thread; returns (succeeded, failed)."""
+    succeeded = failed = 0
+    while True:
+        tasks = claim(worker_id, batch_size, _setting('TASK_VISIBILITY_TIMEOUT', 300))
+        if not tasks:
+            return succeeded, failed
+        for claimed in tasks:
+            if execute(claimed, worker_id):
+                succeeded += 1
+            else:
+                failed += 1
+
+
+class Worker:
+    def __init__(self, threads=4, batch_size=10, visibility_timeout=300, poll_interval=1.0):
+        self.id = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self.threads = threads
+        self.batch_size = batch_size
+        self.visibility_timeout = visibility_timeout
+        self.poll_interval = poll_interval
+        self._stopping = threading.Event()
+
+    def stop(self):
+        """Stop claiming new tasks; running ones are allowed to finish."""
+        self._stopping.set()
+
+    def _execute(self, claimed):
+        close_old_connections()
+        try:
+            return execute(claimed, self.id)
+        finally:
+            close_old_connections()
+
+    def run(self, once=False):
+        """Process tasks until stop() is called (or, with once, until the queue is empty)."""
+        running = set()
+        with ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='task') as pool:
+            while not self._stopping.is_set():
+                for future in [future for future in running if future.done()]:
+                    running.discard(future)
+                    if future.exception() is not None:
+                        logger.error("Task thread crashed", exc_info=future.exception())
+
+                free = self.threads - len(running)
+                # Don't claim more than we can start now, or the extra tasks
+                # would sit out part of their visibility timeout
+                claimed = claim(self.id, min(free, self.batch_size), self.visibility_timeout) if free else []
+                running.update(pool.submit(self._execute, task) for task in claimed)
+
+                if once and not claimed and not running:
+                    break
+                if running and (not claimed or len(running) >= self.threads):
+                    wait(running, timeout=self.poll_interval, return_when=FIRST_COMPLETED)
+                elif not claimed:
+                    self._stopping.wait(self.poll_interval)
@@ -1,3 +1,1473 @@
-from django.test import TestCase
+import io
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from datetime import date, timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache as shared_cache
+from django.contrib.sessions.models import Session
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.sql import emit_post_migrate_signal, emit_pre_migrate_signal
+from django.db import DatabaseError, connection, router
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.parsers import JSONParser
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.test import APIClient, APIRequestFactory
+
+from . import geo, heatmap, idempotency, loading, media, pings, search, sharding, sync, taskqueue, uploads, views
+from .archive import archive_closed_parcels
+from .authentication import issue_token, user_cache
+from .bloom import BloomFilter, tracking_numbers
+from .cache import LocalCache, TieredCache, cache, driver_tag, parcel_tag, stops_tag
+from .concurrency import StaleObject, versioned_update
+from .models import (
+    AboutSection, ArchivedParcel, Driver, IdempotencyKey, Job, JobTombstone, LocationPing, MediaAsset, Notification,
+    Parcel, ParcelEvent, StagedMedia, Task, TrackingEvent, UploadSession, User,
+)
+from .notifications import notify
+from .paginator import EstimatedCountPaginator
+from .registry import drivers
+from .routers import REPLICA_ALIAS, ReplicaRouter, read_from_replica
+from .synthetic import SyntheticDataGenerator
+from .throttling import PublicTrackingThrottle, SlidingWindowThrottle
+from .transitions import BASELINE, InvalidTransition, apply_event, next_status, project
+
+MEDIA_ROOT = tempfile.mkdtemp()
+# Hashing the fixtures' passwords properly would take most of the run
+FAST_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+FAILING = []
+
+
+@taskqueue.task(max_attempts=3)
+def _flaky(name):
+    FAILING.append(name)
+    if name == 'bad':
+        raise ValueError('boom')
+
+
+def _parcel_data(**overrides):
+    data = {
+        'pickup_address': '1 Pickup St', 'delivery_address': '2 Delivery Ave', 'recipient_name': 'Alice Jones',
+        'recipient_phone': '+10000000000', 'description': f'box {uuid.uuid4().hex[:8]}', 'weight': 1.5,
+        'dimensions': '10 x 20 x 30',
+    }
+    data.update(overrides)
+    return data
+
+
+def _png(width=40, height=30, color='green'):
+    image = io.BytesIO()
+    Image.new('RGB', (width, height), color).save(image, 'PNG')
+    return image.getvalue()
+
+
+@override_settings(SHARD_DATABASES=('default',), MEDIA_ROOT=MEDIA_ROOT, PASSWORD_HASHERS=FAST_HASHERS)
+class TrackingTestCase(TestCase):
+    """A customer, a controller and a driver, each with an API client."""
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        # Process-wide state that would leak from one test to the next
+        drivers.reset()
+        shared_cache.clear()
+        cache.local.clear()
+        user_cache.clear()
+        tracking_numbers.reset()
+        SlidingWindowThrottle._windows.clear()
+        idempotency._local.clear()
+        self.customer = User.objects.create_user('customer', password='pw', user_type='customer')
+        self.controller = User.objects.create_user('controller', password='pw', user_type='controller')
+        self.driver_user = User.objects.create_user('driver', password='pw', user_type='driver')
+        self.driver = Driver.objects.create(user=self.driver_user, is_available=True)
+        self.customer_client = self.client_for(self.customer)
+        self.controller_client = self.client_for(self.controller)
+        self.driver_client = self.client_for(self.driver_user)
+
+    @staticmethod
+    def client_for(user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def book(self, **overrides):
+        data = _parcel_data(**overrides)
+        response = self.customer_client.post('/api/parcels/book/', data, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        return Parcel.objects.filter(description=data['description']).everywhere()[0]
+
+    def assign(self, parcel, job_type, driver=None):
+        response = self.controller_client.post(
+            f'/api/parcels/{parcel.pk}/assign_driver/',
+            {'driver_id': (driver or self.driver_user).pk, 'job_type': job_type}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()['job_id']
+
+    def deliver(self, parcel=None):
+        """Book (unless given) and deliver a parcel through the driver API; returns it with both job ids."""
+        parcel = parcel or self.book()
+        pickup = self.assign(parcel, 'pickup')
+        self.assertEqual(self.driver_client.post(f'/api/jobs/{pickup}/accept/').status_code, 200)
+        self.assertEqual(self.driver_client.post(f'/api/jobs/{pickup}/scan_parcel/').status_code, 200)
+        delivery = self.assign(parcel, 'delivery')
+        self.assertEqual(self.driver_client.post(f'/api/jobs/{delivery}/accept/').status_code, 200)
+        self.assertEqual(self.driver_client.post(f'/api/jobs/{delivery}/scan_parcel/').status_code, 200)
+        response = self.driver_client.post(f'/api/jobs/{delivery}/complete_delivery/', {'notes': 'Left at the door'})
+        self.assertEqual(response.status_code, 200, response.content)
+        taskqueue.drain()
+        parcel.refresh_from_db()
+        return parcel, pickup, delivery
+
+    def ping(self, latitude, longitude, client=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = (client or self.driver_client).post(
+                '/api/driver/update_location/', {'latitude': latitude, 'longitude': longitude}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+
+    def upload_image(self):
+        raw = _png()
+        response = self.driver_client.post('/api/uploads/', {'filename': 'proof.png', 'size': len(raw)}, format='json')
+        upload_id = response.json()['upload_id']
+        self.driver_client.put(f'/api/uploads/{upload_id}/', raw, content_type='application/octet-stream',
+                               HTTP_CONTENT_RANGE=f'bytes 0-{len(raw) - 1}/{len(raw)}')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.driver_client.post(f'/api/uploads/{upload_id}/finalize/')
+        self.assertEqual(response.status_code, 200, response.content)
+        return upload_id
+
+
+class TransitionTests(TrackingTestCase):
+    def test_transition_table(self):
+        self.assertEqual(next_status('', 'booked'), 'order_placed')
+        self.assertEqual(next_status('awaiting_pickup', 'collected'), 'collected')
+        self.assertEqual(next_status('failed_delivery', 'delivery_assigned'), 'out_for_delivery')
+        for status, event_type in (('order_placed', 'collected'), ('delivered', 'cancelled'), ('', 'unknown')):
+            with self.assertRaises(InvalidTransition):
+                next_status(status, event_type)
+
+    def test_delivery_writes_the_event_stream(self):
+        parcel, pickup, _ = self.deliver()
+        self.assertEqual(parcel.status, 'delivered')
+        self.assertTrue(parcel.can_customer_track)
+        self.assertIsNotNone(parcel.closed_at)
+        self.assertEqual(
+            list(parcel.status_events.order_by('id').values_list('event_type', flat=True)),
+            ['booked', 'pickup_assigned', 'collected', 'delivery_assigned', 'out_for_delivery', 'delivered'])
+        response = self.driver_client.post(f'/api/jobs/{pickup}/scan_parcel/')
+        self.assertEqual(response.status_code, 409)
+
+    def test_project(self):
+        now = timezone.now()
+        events = [('booked', now, {}), ('pickup_assigned', now, {}), ('collected', now, {}),
+                  ('delivery_assigned', now, {}), ('delivered', now, {})]
+        self.assertEqual(project(events), {'status': 'delivered', 'can_customer_track': True, 'closed_at': now})
+        self.assertEqual(project(events[:3])['can_customer_track'], False)
+
+    def test_project_starts_from_the_baseline(self):
+        booked_at = timezone.now() - timedelta(days=3)
+        events = [
+            (BASELINE, booked_at, {'status': 'collected', 'can_customer_track': False}),
+            ('delivery_assigned', booked_at + timedelta(days=1), {}),
+        ]
+        self.assertEqual(project(events[:1]), {'status': 'collected', 'can_customer_track': False, 'closed_at': None})
+        self.assertEqual(project(events)['status'], 'out_for_delivery')
+        self.assertTrue(project(events)['can_customer_track'])
+
+    def test_replay_repairs_the_projection(self):
+        parcel, _, _ = self.deliver()
+        Parcel.objects.filter(pk=parcel.pk).update(status='order_placed', can_customer_track=False)
+        out = io.StringIO()
+        call_command('replay_parcel_events', '--dry-run', stdout=out)
+        self.assertIn('would change 1', out.getvalue())
+        call_command('replay_parcel_events', stdout=out)
+        parcel.refresh_from_db()
+        self.assertEqual((parcel.status, parcel.can_customer_track), ('delivered', True))
+
+    def test_replay_keeps_legacy_parcels(self):
+        # Migration 0004 starts the stream of parcels booked before it with a baseline
+        parcel = self.book()
+        ParcelEvent.objects.filter(parcel=parcel).delete()
+        Parcel.objects.filter(pk=parcel.pk).update(status='in_transit')
+        ParcelEvent.objects.create(parcel=parcel, event_type=BASELINE, from_status='', to_status='in_transit',
+                                   data={'status': 'in_transit', 'can_customer_track': False})
+        parcel.refresh_from_db()
+        apply_event(parcel, 'delivery_assigned')
+        out = io.StringIO()
+        call_command('replay_parcel_events', '--dry-run', stdout=out)
+        self.assertIn('would change 0', out.getvalue())
+
+
+class ParcelAdminTests(TrackingTestCase):
+    def setUp(self):
+        super().setUp()
+        admin = User.objects.create_superuser('admin', password='pw', user_type='controller')
+        self.client.force_login(admin)
+
+    def add(self, status):
+        data = _parcel_data(customer=self.customer.pk, status=status)
+        return self.client.post('/admin/tracking/parcel/add/', data), data['description']
+
+    def test_adding_a_parcel_books_it(self):
+        response, description = self.add('order_placed')
+        self.assertEqual(response.status_code, 302)
+        parcel = Parcel.objects.get(description=description)
+        self.assertEqual(list(parcel.status_events.values_list('event_type', 'to_status')),
+                         [('booked', 'order_placed')])
+
+    def test_new_parcels_start_as_placed_orders(self):
+        response, description = self.add('delivered')
+        self.assertContains(response, 'New parcels start as')
+        self.assertFalse(Parcel.objects.filter(description=description).exists())
+
+    def test_status_changes_are_events(self):
+        parcel = self.book()
+        data = _parcel_data(customer=self.customer.pk, status='cancelled', description=parcel.description)
+        response = self.client.post(f'/admin/tracking/parcel/{parcel.pk}/change/', data)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(parcel.status_events.last().event_type, 'cancelled')
+        response = self.client.post(f'/admin/tracking/parcel/{parcel.pk}/change/', dict(data, status='order_placed'))
+        self.assertContains(response, 'cannot move from')
+
+
+class ArchiveTests(TrackingTestCase):
+    def test_round_trip(self):
+        parcel, _, _ = self.deliver()
+        live = self.book()
+        notifications = Notification.objects.filter(parcel=parcel).count()
+        self.assertTrue(notifications)
+        event = TrackingEvent.objects.filter(parcel=parcel).first()
+        TrackingEvent.objects.filter(pk=event.pk).update(image='proof/door.jpg')
+        staged = default_storage.save('staging/raw.png', ContentFile(b'raw'))
+        StagedMedia.objects.create(tracking_event=event, field='signature', file=staged, status='failed')
+        Parcel.objects.filter(pk=parcel.pk).update(closed_at=timezone.now() - timedelta(days=100))
+
+        out = io.StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('archive_parcels', '--days', '30', stdout=out)
+        self.assertIn('Archived 1', out.getvalue())
+        self.assertFalse(Parcel.objects.filter(pk=parcel.pk).exists())
+        self.assertFalse(Job.objects.filter(parcel_id=parcel.pk).exists())
+        self.assertFalse(default_storage.exists(staged))
+        archived = ArchivedParcel.objects.get()
+        self.assertEqual((archived.tracking_number, archived.status), (parcel.tracking_number, 'delivered'))
+        self.assertEqual(len(archived.jobs), 2)
+        self.assertEqual(archived.media, ['proof/door.jpg'])
+
+        # Notifications stay, with the tracking number
+        kept = Notification.objects.filter(parcel=None, tracking_number=parcel.tracking_number)
+        self.assertEqual(kept.count(), notifications)
+        note = kept.filter(user=self.customer).first()
+        self.assertEqual(self.customer_client.post(f'/api/notifications/{note.pk}/mark_read/').status_code, 200)
+
+        # Read back from the snapshot
+        response = self.client.get(f'/api/public/track/{parcel.tracking_number}/')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.json()['status'], 'delivered')
+        self.assertEqual(self.customer_client.get(f'/api/parcels/{parcel.tracking_number}/').status_code, 200)
+        results = self.customer_client.get('/api/parcels/my_parcels/').json()['results']
+        self.assertEqual([row['tracking_number'] for row in results], [live.tracking_number, parcel.tracking_number])
+
+    def test_open_parcels_stay(self):
+        parcel = self.book()
+        Parcel.objects.filter(pk=parcel.pk).update(booked_at=timezone.now() - timedelta(days=100))
+        self.assertEqual(archive_closed_parcels(30), 0)
+        self.assertTrue(Parcel.objects.filter(pk=parcel.pk).exists())
+
+
+class MediaTests(TrackingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.event = TrackingEvent.objects.create(parcel=self.book(), status_update='Delivered')
+
+    def stage(self, field, raw, name='proof.png'):
+        staged = media.stage_upload(self.event, field, SimpleUploadedFile(name, raw))
+        taskqueue.drain()
+        return staged
+
+    def test_delivery_photo_is_compressed_with_a_thumbnail(self):
+        staged = self.stage('image', _png(2000, 1000))
+        staged.refresh_from_db()
+        self.assertEqual(staged.status, 'done')
+        self.assertFalse(default_storage.exists(staged.file.name))
+        self.event.refresh_from_db()
+        asset = MediaAsset.objects.get()
+        self.assertEqual((self.event.image.name, self.event.image_thumbnail.name),
+                         (asset.original.name, asset.thumbnail.name))
+        self.assertEqual((asset.width, asset.height), (1600, 800))
+        with default_storage.open(asset.thumbnail.name) as f:
+            self.assertEqual(Image.open(f).size, (320, 160))
+
+    def test_identical_uploads_share_one_file(self):
+        raw = _png()
+        self.stage('image', raw)
+        self.stage('signature', raw, name='signature.png')
+        self.assertEqual(MediaAsset.objects.count(), 1)
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.image.name, self.event.signature.name)
+
+    def test_bytes_that_are_not_an_image_fail(self):
+        with self.assertLogs('tracking.media', 'ERROR'):
+            staged = self.stage('image', b'not an image')
+        staged.refresh_from_db()
+        self.assertEqual(staged.status, 'failed')
+        self.assertFalse(MediaAsset.objects.exists())
+
+    @override_settings(TASK_RETRY_BACKOFF=0)
+    def test_transient_errors_are_retried(self):
+        with mock.patch('tracking.media.store_asset', side_effect=OSError('storage down')), \
+                self.assertLogs('tracking.taskqueue', 'ERROR'):
+            staged = self.stage('image', _png())
+        staged.refresh_from_db()
+        self.assertEqual(staged.status, 'pending')
+        self.assertEqual(Task.objects.get().status, 'dead')
+
+        out, err = io.StringIO(), io.StringIO()
+        with mock.patch('tracking.media.store_asset', side_effect=OSError('storage down')):
+            call_command('process_staged_media', stdout=out, stderr=err)
+        self.assertIn('1 left to retry', out.getvalue())
+        self.assertIn('storage down', err.getvalue())
+        call_command('process_staged_media', stdout=out)
+        self.assertIn('Processed 1 uploads, 0 failed', out.getvalue())
+        staged.refresh_from_db()
+        self.assertEqual(staged.status, 'done')
+
+
+class UploadTests(TrackingTestCase):
+    def start(self, raw, **extra):
+        response = self.driver_client.post('/api/uploads/', dict(filename='proof.png', size=len(raw), **extra),
+                                           format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        return f"/api/uploads/{response.json()['upload_id']}/"
+
+    def put(self, url, raw, start, end):
+        return self.driver_client.put(url, raw[start:end + 1], content_type='application/octet-stream',
+                                      HTTP_CONTENT_RANGE=f'bytes {start}-{end}/{len(raw)}')
+
+    def test_resumes_from_the_reported_offset(self):
+        raw = _png()
+        url = self.start(raw)
+        half = len(raw) // 2
+        self.assertEqual(self.put(url, raw, 0, half - 1).json()['offset'], half)
+        self.assertEqual(self.driver_client.post(f'{url}finalize/').status_code, 409)
+
+        # A chunk that skips ahead is refused with the offset to resume from
+        response = self.put(url, raw, half + 1, len(raw) - 1)
+        self.assertEqual((response.status_code, response.json()['offset']), (409, half))
+        self.assertEqual(self.driver_client.get(url).json()['offset'], half)
+        self.assertEqual(self.put(url, raw, half, len(raw) - 1).json()['offset'], len(raw))
+
+        response = self.driver_client.post(f'{url}finalize/')
+        self.assertEqual(response.json()['status'], 'finalized')
+        session = UploadSession.objects.get()
+        with open(session.file.path, 'rb') as f:
+            self.assertEqual(f.read(), raw)
+
+    def test_refuses_bad_ranges_and_checksums(self):
+        raw = _png()
+        url = self.start(raw, sha256='0' * 64)
+        response = self.driver_client.put(url, raw, content_type='application/octet-stream',
+                                          HTTP_CONTENT_RANGE=f'bytes 0-{len(raw)}/{len(raw) + 1}')
+        self.assertEqual(response.status_code, 400)
+        self.put(url, raw, 0, len(raw) - 1)
+        response = self.driver_client.post(f'{url}finalize/')
+        self.assertEqual((response.status_code, response.json()['error']), (400, 'Checksum mismatch'))
+
+    def test_delivery_uses_the_upload_once(self):
+        upload_id = self.upload_image()
+        parcel = self.book()
+        pickup = self.assign(parcel, 'pickup')
+        self.driver_client.post(f'/api/jobs/{pickup}/accept/')
+        self.driver_client.post(f'/api/jobs/{pickup}/scan_parcel/')
+        delivery = self.assign(parcel, 'delivery')
+        self.driver_client.post(f'/api/jobs/{delivery}/accept/')
+        self.driver_client.post(f'/api/jobs/{delivery}/scan_parcel/')
+        response = self.driver_client.post(f'/api/jobs/{delivery}/complete_delivery/',
+                                           {'delivery_image_upload_id': upload_id})
+        self.assertEqual(response.status_code, 200, response.content)
+        taskqueue.drain()
+        self.assertEqual(UploadSession.objects.get().status, 'consumed')
+        self.assertTrue(TrackingEvent.objects.get(parcel=parcel, status_update='Delivered successfully').image)
+
+    def test_purges_uploads_that_stopped_receiving_chunks(self):
+        raw = _png()
+        slow, abandoned = self.start(raw), self.start(raw)
+        long_ago = timezone.now() - timedelta(hours=30)
+        UploadSession.objects.update(created_at=long_ago, last_activity=long_ago)
+        # Still sending chunks, a day after it started
+        self.put(slow, raw, 0, 9)
+        self.assertEqual(uploads.purge_stale(24), 1)
+        self.assertEqual(self.driver_client.get(abandoned).status_code, 404)
+        self.assertEqual(self.driver_client.get(slow).json()['offset'], 10)
+
+
+class TokenTests(TrackingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.token_client = APIClient()
+
+    def authorize(self, token):
+        self.token_client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        return self.token_client.get('/api/jobs/my_jobs/').status_code
+
+    def test_obtain_and_use(self):
+        response = self.token_client.post('/api/auth/token/', {'username': 'driver', 'password': 'pw'}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        token = response.json()['token']
+        self.assertEqual(self.authorize(token), 200)
+        tampered = token[:-2] + ('AA' if not token.endswith('AA') else 'BB')
+        self.assertEqual(self.authorize(tampered), 401)
+        self.assertEqual(self.authorize('not-a-token'), 401)
+
+    def test_expiry(self):
+        expired, expires_at = issue_token(self.driver_user, now=0)
+        self.assertEqual(expires_at, settings.AUTH_TOKEN_TTL)
+        self.assertEqual(self.authorize(expired), 401)
+        with override_settings(AUTH_TOKEN_TTL=int(time.time()) + 60):
+            self.assertEqual(self.authorize(expired), 200)
+
+    def test_refresh_and_key_rotation(self):
+        keys = {'new': 'new-secret', 'old': 'old-secret'}
+        with override_settings(AUTH_TOKEN_KEYS=keys, AUTH_TOKEN_ACTIVE_KEY='old'):
+            old, _ = issue_token(self.driver_user)
+        with override_settings(AUTH_TOKEN_KEYS=keys, AUTH_TOKEN_ACTIVE_KEY='new'):
+            self.assertEqual(self.authorize(old), 200)
+            response = self.token_client.post('/api/auth/token/refresh/')
+            self.assertEqual(response.status_code, 200)
+            fresh = response.json()['token']
+            self.assertIn('.new.', fresh)
+        with override_settings(AUTH_TOKEN_KEYS={'new': 'new-secret'}, AUTH_TOKEN_ACTIVE_KEY='new'):
+            self.assertEqual(self.authorize(old), 401)
+            self.assertEqual(self.authorize(fresh), 200)
+
+    def test_inactive_user(self):
+        token, _ = issue_token(self.driver_user)
+        self.assertEqual(self.authorize(token), 200)
+        self.driver_user.is_active = False
+        self.driver_user.save()
+        self.assertEqual(self.authorize(token), 401)
+
+
+class BloomTests(TrackingTestCase):
+    def test_bloom_filter(self):
+        bloom = BloomFilter(1000, error_rate=0.01)
+        for i in range(1000):
+            bloom.add(f'known-{i}')
+        self.assertTrue(all(f'known-{i}' in bloom for i in range(1000)))
+        false_positives = sum(f'guess-{i}' in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+    def test_guessed_numbers_are_rejected_without_a_query(self):
+        parcel = self.book()
+        tracking_numbers.start()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/api/public/track/NOT-A-PARCEL/').status_code, 404)
+        # Booked in this process after the build
+        self.assertEqual(self.client.get(f'/api/public/track/{parcel.tracking_number}/').status_code, 403)
+
+    @override_settings(BLOOM_REFRESH_INTERVAL=0)
+    def test_picks_up_parcels_booked_elsewhere(self):
+        tracking_numbers.build()
+        # bulk_create sends no post_save, like a booking in another process
+        parcel, = Parcel.objects.bulk_create([Parcel(customer=self.customer, **_parcel_data())])
+        self.assertTrue(tracking_numbers.might_exist(parcel.tracking_number))
+
+    def test_builds_on_first_use_if_it_could_not_at_start(self):
+        with mock.patch.object(tracking_numbers, 'build', side_effect=DatabaseError('no such table')), \
+                self.assertLogs('tracking.bloom', 'ERROR'):
+            tracking_numbers.start()
+        parcel = self.book()
+        self.assertTrue(tracking_numbers.might_exist(parcel.tracking_number))
+        self.assertFalse(tracking_numbers.might_exist('NOT-A-PARCEL'))
+
+
+class ThrottleTests(TrackingTestCase):
+    def request(self, ip):
+        return Request(APIRequestFactory().get('/', REMOTE_ADDR=ip))
+
+    def allowed(self, throttle, now, ip='10.0.0.1', count=1):
+        with mock.patch('tracking.throttling.time.monotonic', return_value=now):
+            return [throttle.allow_request(self.request(ip), None) for _ in range(count)]
+
+    def test_sliding_window(self):
+        throttle = PublicTrackingThrottle()
+        throttle.num_requests, throttle.duration = 3, 60
+        self.assertEqual(self.allowed(throttle, 600, count=4), [True, True, True, False])
+        self.assertAlmostEqual(throttle.wait(), 60)
+        self.assertEqual(self.allowed(throttle, 600, ip='10.0.0.2'), [True])
+        # Half way through the next window, half of the last window's requests still count
+        self.assertEqual(self.allowed(throttle, 690, count=3), [True, True, False])
+        self.assertAlmostEqual(throttle.wait(), 30)
+        # Two windows on, nothing counts
+        self.assertEqual(self.allowed(throttle, 780, count=3), [True, True, True])
+
+    def test_public_tracking_is_throttled(self):
+        with mock.patch.dict(api_settings.DEFAULT_THROTTLE_RATES, {'public_tracking': '2/min'}):
+            codes = [self.client.get('/api/public/track/NOT-A-PARCEL/').status_code for _ in range(3)]
+        self.assertEqual(codes, [404, 404, 429])
+
+
+class ReplicaRouterTests(TrackingTestCase):
+    def replica(self):
+        # Only the alias has to exist for the router; nothing is read from it
+        return mock.patch.dict(settings.DATABASES, {REPLICA_ALIAS: {}})
+
+    def test_only_tracking_reads_in_replica_views_go_to_the_replica(self):
+        with self.replica():
+            self.assertEqual(router.db_for_read(Parcel), 'default')
+            with read_from_replica():
+                self.assertEqual(router.db_for_read(Parcel), REPLICA_ALIAS)
+                self.assertEqual(router.db_for_read(Notification), REPLICA_ALIAS)
+                self.assertEqual(router.db_for_read(User), 'default')
+                self.assertEqual(router.db_for_read(Session), 'default')
+                self.assertEqual(router.db_for_write(Parcel), 'default')
+            self.assertEqual(router.db_for_read(Parcel), 'default')
+
+    def test_without_a_replica_everything_stays_on_the_primary(self):
+        with read_from_replica():
+            self.assertEqual(router.db_for_read(Parcel), 'default')
+
+    def test_views_opt_in(self):
+        seen = []
+
+        def db_for_read(*args, **kwargs):
+            with self.replica():
+                seen.append(router.db_for_read(Parcel))
+            return Response(status=201)
+
+        with mock.patch.object(views.AllParcelsView, 'list', side_effect=db_for_read), \
+                mock.patch.object(views.ParcelBookingView, 'post', side_effect=db_for_read):
+            self.controller_client.get('/api/parcels/')
+            self.customer_client.post('/api/parcels/book/')
+        self.assertEqual(seen, [REPLICA_ALIAS, 'default'])
+
+    def test_the_replica_is_not_migrated(self):
+        self.assertIs(ReplicaRouter().allow_migrate(REPLICA_ALIAS, 'tracking'), False)
+        self.assertIsNone(ReplicaRouter().allow_migrate('default', 'tracking'))
+
+
+class CacheTests(TrackingTestCase):
+    def test_single_flight(self):
+        calls = []
+
+        def produce():
+            calls.append(1)
+            time.sleep(0.2)
+            return 42
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get_or_set('answer', produce, 60)))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [42] * 8)
+        self.assertEqual(len(calls), 1)
+
+    @override_settings(CACHE_LOCAL_TTL=0)
+    def test_tag_versions_reach_other_processes(self):
+        other = TieredCache(shared_cache, LocalCache())
+        cache.get_or_set('answer', lambda: 1, 60, tags=['numbers'])
+        self.assertEqual(other.get('answer'), 1)
+        cache.invalidate('numbers')
+        self.assertEqual(other.get_or_set('answer', lambda: 2, 60, tags=['numbers']), 2)
+        # A tag evicted from the shared cache invalidates what was stored under it
+        shared_cache.delete('tag:numbers')
+        self.assertEqual(other.get_or_set('answer', lambda: 3, 60, tags=['numbers']), 3)
+
+    def test_parcel_detail_is_cached_until_it_changes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            parcel = self.book()
+        url = f'/api/parcels/{parcel.tracking_number}/'
+        first = self.controller_client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            second = self.controller_client.get(url)
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(len(queries), 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assign(parcel, 'pickup')
+        self.assertEqual(self.controller_client.get(url).json()['status'], 'awaiting_pickup')
+
+    def test_pings_keep_the_driver_list_cached(self):
+        self.assertIsNone(self.controller_client.get('/api/drivers/').json()['results'][0]['current_latitude'])
+        self.ping(40.7, -74.0)
+        with CaptureQueriesContext(connection) as queries:
+            rows = self.controller_client.get('/api/drivers/').json()['results']
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(rows[0]['current_latitude'], 40.7)
+
+    def test_invalidation_while_computing_leaves_the_value_stale(self):
+        def produce():
+            # Another request changes the data after this one read it
+            cache.invalidate('numbers')
+            return 1
+
+        self.assertEqual(cache.get_or_set('answer', produce, 60, tags=['numbers']), 1)
+        cache.local.clear()
+        self.assertEqual(cache.get_or_set('answer', lambda: 2, 60, tags=['numbers']), 2)
+        self.assertEqual(cache.get('answer'), 2)
+
+    def test_invalidation_while_computing_skips_the_store_for_value_tags(self):
+        cache.get_or_set('warm', lambda: 0, 60, tags=['numbers'])
+
+        def produce():
+            cache.invalidate('numbers')
+            return 1
+
+        self.assertEqual(cache.get_or_set('answer', produce, 60, tags=lambda value: ['numbers']), 1)
+        self.assertEqual(cache.get_or_set('answer', lambda: 2, 60, tags=lambda value: ['numbers']), 2)
+        # Tags seen for the first time are stored as usual
+        self.assertEqual(cache.get_or_set('other', lambda: 3, 60, tags=lambda value: ['fresh']), 3)
+        self.assertEqual(cache.get('other'), 3)
+
+
+class AsyncViewTests(TrackingTestCase):
+    def test_public_tracking(self):
+        parcel = self.book()
+        self.assertEqual(self.client.get('/api/public/track/NOPE/').status_code, 404)
+        self.assertEqual(self.client.get(f'/api/public/track/{parcel.tracking_number}/').status_code, 403)
+        self.deliver(parcel)
+        response = self.client.get(f'/api/public/track/{parcel.tracking_number}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], 'delivered')
+        self.assertEqual(self.client.post(f'/api/public/track/{parcel.tracking_number}/').status_code, 405)
+
+    def test_driver_jobs_match_drf_pagination(self):
+        self.assertEqual(self.client.get('/api/jobs/my_jobs/').json(), {
+            'detail': 'Authentication credentials were not provided.'})
+        for _ in range(api_settings.PAGE_SIZE + 1):
+            self.assign(self.book(), 'pickup')
+
+        with self.assertNumQueries(4):
+            first = self.driver_client.get('/api/jobs/my_jobs/').json()
+        self.assertEqual(first['count'], api_settings.PAGE_SIZE + 1)
+        self.assertEqual(len(first['results']), api_settings.PAGE_SIZE)
+        self.assertIsNone(first['previous'])
+        self.assertTrue(first['next'].endswith('/api/jobs/my_jobs/?page=2'))
+        last = self.driver_client.get('/api/jobs/my_jobs/?page=last').json()
+        self.assertEqual((len(last['results']), last['next']), (1, None))
+        self.assertTrue(last['previous'].endswith('/api/jobs/my_jobs/'))
+
+        response = self.driver_client.get('/api/jobs/my_jobs/?page=9')
+        self.assertEqual((response.status_code, response.json()), (404, {'detail': 'Invalid page.'}))
+        self.assertEqual(self.customer_client.get('/api/jobs/my_jobs/').json()['count'], 0)
+
+    def test_notifications_are_per_user(self):
+        self.assign(self.book(), 'pickup')
+        taskqueue.drain()
+        results = self.driver_client.get('/api/notifications/').json()['results']
+        self.assertEqual([n['title'] for n in results], ['New Pickup Job Assigned'])
+        self.assertEqual(self.controller_client.get('/api/notifications/').json()['count'], 0)
+
+    def test_update_location(self):
+        self.ping(40.7, -74.0)
+        self.driver.refresh_from_db()
+        self.assertEqual((self.driver.current_latitude, self.driver.current_longitude), (40.7, -74.0))
+
+        response = self.driver_client.post('/api/driver/update_location/', {'latitude': 'north'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('latitude', response.json())
+        response = self.customer_client.post('/api/driver/update_location/', {'latitude': 1, 'longitude': 2},
+                                             format='json')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.client.get('/api/driver/update_location/').status_code, 405)
+
+    def test_session_logins_need_a_csrf_token(self):
+        client = APIClient(enforce_csrf_checks=True)
+        client.force_login(self.driver_user)
+        data = {'latitude': 1, 'longitude': 2}
+        response = client.post('/api/driver/update_location/', data, format='json')
+        self.assertEqual(response.status_code, 403)
+        self.assertIn('CSRF', response.json()['detail'])
+
+        client.cookies[settings.CSRF_COOKIE_NAME] = token = 'a' * 32
+        response = client.post('/api/driver/update_location/', data, format='json', HTTP_X_CSRFTOKEN=token)
+        self.assertEqual(response.status_code, 200)
+
+    async def test_served_without_a_thread(self):
+        await self.async_client.aforce_login(self.driver_user)
+        response = await self.async_client.get('/api/jobs/my_jobs/')
+        self.assertEqual(response.json()['count'], 0)
+
+
+class TaskQueueTests(TrackingTestCase):
+    def setUp(self):
+        super().setUp()
+        FAILING.clear()
+
+    @override_settings(TASK_RETRY_BACKOFF=0)
+    def test_retries_until_dead(self):
+        taskqueue.defer(_flaky, 'ok')
+        taskqueue.defer(_flaky, 'bad')
+        with self.assertLogs('tracking.taskqueue', 'ERROR') as logs:
+            self.assertEqual(taskqueue.drain(), (1, 3))
+        self.assertEqual(len(logs.records), 3)
+        task = Task.objects.get()
+        self.assertEqual((task.status, task.attempts), ('dead', 3))
+        self.assertIn('boom', task.last_error)
+        self.assertEqual(FAILING, ['ok', 'bad', 'bad', 'bad'])
+
+    def test_claims_expire(self):
+        task = taskqueue.defer(_flaky, 'ok')
+        [first] = taskqueue.claim('first', 10, 60)
+        self.assertEqual(taskqueue.claim('second', 10, 60), [])
+        Task.objects.filter(pk=task.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+        [second] = taskqueue.claim('second', 10, 60)
+        self.assertEqual(second.attempts, 2)
+        # The first worker finishing late leaves the second one's claim alone
+        taskqueue.execute(first, 'first')
+        self.assertTrue(Task.objects.filter(pk=task.pk).exists())
+        taskqueue.execute(second, 'second')
+        self.assertFalse(Task.objects.filter(pk=task.pk).exists())
+
+    def test_only_tasks_can_be_deferred(self):
+        with self.assertRaises(TypeError):
+            taskqueue.defer(print, 'text')
+
+    def test_a_repeated_notification_task_notifies_once(self):
+        parcel = self.book()
+        task = taskqueue.defer(notify, self.customer.pk, title='Hello', message='Hello', parcel_id=parcel.pk)
+        self.assertTrue(task.kwargs['task_key'])
+        [claimed] = [claimed for claimed in taskqueue.claim('worker', 100, 60) if claimed.pk == task.pk]
+        # A run that finished without its success being recorded
+        notify(*claimed.args, **claimed.kwargs)
+        taskqueue.execute(claimed, 'worker')
+        notification = Notification.objects.get(title='Hello')
+        self.assertEqual(notification.tracking_number, parcel.tracking_number)
+        # Called directly, there's no key to repeat
+        notify(self.customer.pk, 'Direct', 'Direct')
+        notify(self.customer.pk, 'Direct', 'Direct')
+        self.assertEqual(Notification.objects.filter(title='Direct').count(), 2)
+
+
+class MetricsTests(TrackingTestCase):
+    def scrape(self):
+        with override_settings(METRICS_TOKEN='secret'):
+            response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        samples = {}
+        for line in response.content.decode().splitlines():
+            if not line.startswith('#'):
+                name, value = line.rsplit(' ', 1)
+                samples[name] = float(value)
+        return samples
+
+    def test_needs_a_token(self):
+        with override_settings(METRICS_TOKEN=''):
+            self.assertEqual(self.client.get('/metrics').status_code, 403)
+        with override_settings(METRICS_TOKEN='secret'):
+            self.assertEqual(self.client.get('/metrics').status_code, 401)
+            self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer guess').status_code, 401)
+
+    def test_counts_requests_and_their_queries(self):
+        self.assign(self.book(), 'pickup')
+        requests = 'http_requests_total{view="driver_jobs",method="GET",status="200"}'
+        queries = 'http_request_sql_queries_sum{view="driver_jobs",method="GET"}'
+        before = self.scrape()
+        self.driver_client.get('/api/jobs/my_jobs/')
+        self.driver_client.get('/api/jobs/my_jobs/')
+        after = self.scrape()
+        self.assertEqual(after[requests] - before.get(requests, 0), 2)
+        # The async view's queries run in a worker thread and still count
+        self.assertEqual(after[queries] - before.get(queries, 0), 8)
+        self.assertNotIn('view="metrics"', ''.join(after))
+
+    @override_settings(METRICS_SLOW_REQUEST_MS=0)
+    def test_logs_slow_requests_with_their_statements(self):
+        with self.assertLogs('tracking.metrics', 'WARNING') as logs:
+            self.customer_client.get('/api/parcels/my_parcels/')
+        self.assertIn('Slow request GET /api/parcels/my_parcels/', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+
+
+class SyntheticDataTests(TrackingTestCase):
+    def generate(self, seed):
+        User.objects.filter(username__startswith='synth_').delete()
+        counts = SyntheticDataGenerator(customers=5, drivers=3, parcels=40, days=30, pings_per_job=3, seed=seed,
+                                        chunk_size=16, until=date(2026, 1, 1)).run()
+        parcels = list(Parcel.objects.filter(customer__username__startswith='synth_').order_by('tracking_number')
+                       .values_list('tracking_number', 'status', 'customer__username', 'current_driver__user__username',
+                                    'pickup_address', 'weight', 'booked_at', 'closed_at'))
+        events = list(ParcelEvent.objects.filter(parcel__customer__username__startswith='synth_')
+                      .order_by('parcel__tracking_number', 'timestamp', 'event_type')
+                      .values_list('parcel__tracking_number', 'event_type', 'timestamp'))
+        pings = list(LocationPing.objects.order_by('driver__user__username', 'recorded_at', 'latitude')
+                     .values_list('driver__user__username', 'latitude', 'longitude', 'recorded_at'))
+        return counts, parcels, events, pings
+
+    def test_a_seed_always_gives_the_same_data(self):
+        first = self.generate(seed=7)
+        self.assertEqual(first[0]['parcel'], 40)
+        self.assertTrue(first[3])
+        self.assertEqual(self.generate(seed=7), first)
+        self.assertNotEqual(self.generate(seed=8)[1], first[1])
+        # Kept on the notifications for when their parcels are archived
+        self.assertFalse(Notification.objects.filter(tracking_number='').exists())
+
+    def test_refuses_to_generate_twice(self):
+        SyntheticDataGenerator(customers=1, drivers=1, parcels=0).run()
+        with self.assertRaises(ValueError):
+            SyntheticDataGenerator(customers=1, drivers=1, parcels=0).run()
+
+    def test_purges_old_location_pings(self):
+        now = timezone.now()
+        LocationPing.objects.create(driver=self.driver, latitude=1, longitude=1, recorded_at=now - timedelta(days=31))
+        recent = LocationPing.objects.create(driver=self.driver, latitude=1, longitude=1,
+                                             recorded_at=now - timedelta(days=29))
+        out = io.StringIO()
+        call_command('purge_location_pings', stdout=out)
+        self.assertIn('Purged 1 location pings', out.getvalue())
+        self.assertEqual(list(LocationPing.objects.all()), [recent])
+
+
+class CachedPageTests(TrackingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.about = AboutSection.objects.create(heading='Parcels since 1999', sub_heading='About us',
+                                                 description='We move boxes.', image='about/team.jpg')
+
+    def test_anonymous_visitors_share_one_render(self):
+        first = self.client.get('/about-us/')
+        self.assertContains(first, 'Parcels since 1999')
+        self.assertIn('Cookie', first['Vary'])
+        with self.assertNumQueries(0), mock.patch('tracking.views.render') as render:
+            second = Client().get('/about-us/')
+        render.assert_not_called()
+        self.assertEqual(second.content, first.content)
+        self.assertIn('Cookie', second['Vary'])
+
+    def test_signed_in_users_get_their_own_page(self):
+        anonymous = self.client.get('/about-us/').content
+        client = Client()
+        client.force_login(self.customer)
+        with mock.patch('tracking.views.render', wraps=views.render) as render:
+            page = client.get('/about-us/')
+        render.assert_called_once()
+        self.assertContains(page, 'My Parcels')
+        self.assertNotIn(b'My Parcels', anonymous)
+        # ...without replacing the anonymous copy
+        self.assertEqual(Client().get('/about-us/').content, anonymous)
+
+    def test_flash_messages_are_not_cached(self):
+        self.client.get('/about-us/')
+        client = Client()
+        client.cookies['messages'] = 'pending'
+        with mock.patch('tracking.views.render', wraps=views.render) as render:
+            client.get('/about-us/')
+        render.assert_called_once()
+
+    def test_saving_the_about_section_evicts_the_page(self):
+        self.assertContains(self.client.get('/about-us/'), 'Parcels since 1999')
+        self.about.heading = 'Parcels since 2001'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.about.save()
+        self.assertContains(self.client.get('/about-us/'), 'Parcels since 2001')
+
+
+class DeltaSyncTests(TrackingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.parcels = [self.book() for _ in range(3)]
+        self.jobs = [self.assign(parcel, 'pickup') for parcel in self.parcels]
+        # Everything so far happened an hour ago; the driver last synced half an hour ago
+        an_hour_ago = timezone.now() - timedelta(hours=1)
+        Job.objects.update(updated_at=an_hour_ago)
+        Parcel.objects.update(updated_at=an_hour_ago)
+        self.cursor = sync.encode_cursor(timezone.now() - timedelta(minutes=30))
+
+    def changes(self, since):
+        response = self.driver_client.get(f'/api/jobs/my_jobs/?since={since}')
+        self.assertEqual(response.status_code, 200, response.content)
+        data = response.json()
+        return sorted(job['id'] for job in data['results']), data['deleted'], data['reset']
+
+    def test_full_list_starts_the_sync(self):
+        data = self.driver_client.get('/api/jobs/my_jobs/').json()
+        self.assertEqual(data['count'], 3)
+        self.assertTrue(sync.decode_cursor(data['cursor']) < timezone.now())
+        self.assertEqual(self.changes(0), (sorted(self.jobs), [], False))
+
+    def test_only_changed_jobs_are_sent(self):
+        self.assertEqual(self.changes(self.cursor), ([], [], False))
+        self.driver_client.post(f'/api/jobs/{self.jobs[0]}/accept/')
+        # A new tracking event changes what the job shows
+        TrackingEvent.objects.create(parcel=self.parcels[1], status_update='At the depot')
+        self.assertEqual(self.changes(self.cursor), (sorted(self.jobs[:2]), [], False))
+
+    def test_deleted_jobs_leave_a_tombstone(self):
+        Job.objects.filter(pk=self.jobs[2]).delete()
+        self.assertEqual(self.changes(self.cursor), ([], [self.jobs[2]], False))
+
+        JobTombstone.objects.update(deleted_at=timezone.now() - timedelta(days=31))
+        out = io.StringIO()
+        call_command('purge_job_tombstones', stdout=out)
+        self.assertIn('Purged 1 job tombstones', out.getvalue())
+
+    def test_cursors_older_than_the_tombstones_reset(self):
+        old = sync.encode_cursor(timezone.now() - timedelta(days=31))
+        self.assertEqual(self.changes(old), (sorted(self.jobs), [], True))
+
+    def test_invalid_cursors(self):
+        for cursor in ('yesterday', '-1'):
+            response = self.driver_client.get(f'/api/jobs/my_jobs/?since={cursor}')
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json(), {'since': f"Invalid cursor: '{cursor}'"})
+
+
+class BatchTests(TrackingTestCase):
+    def batch(self, actions):
+        response = self.driver_client.post('/api/jobs/batch/', {'actions': actions}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()['results']
+
+    def test_results_in_order(self):
+        parcels = [self.book() for _ in range(3)]
+        jobs = [self.assign(parcel, 'pickup') for parcel in parcels]
+        accepted_at = timezone.now() - timedelta(hours=1)
+        actions = []
+        for job in jobs:
+            actions.append({'action': 'accept', 'job_id': job, 'timestamp': accepted_at.isoformat()})
+            actions.append({'action': 'scan', 'job_id': job})
+        other = User.objects.create_user('other', password='pw', user_type='driver')
+        Driver.objects.create(user=other, is_available=True)
+        not_mine = self.assign(self.book(), 'pickup', driver=other)
+        actions += [{'action': 'scan', 'job_id': jobs[0]}, {'action': 'accept', 'job_id': 0},
+                    {'action': 'scan', 'job_id': not_mine}]
+
+        results = self.batch(actions)
+        self.assertEqual([result['index'] for result in results], list(range(len(actions))))
+        self.assertEqual([result['status'] for result in results], [200] * 7 + [404, 403])
+        self.assertEqual(results[6]['message'], 'Parcel already scanned')
+        for parcel in parcels:
+            parcel.refresh_from_db()
+            self.assertEqual(parcel.status, 'collected')
+        self.assertEqual(Job.objects.get(pk=jobs[1]).accepted_at, accepted_at)
+        # Queued with one INSERT, still keyed so a repeated run notifies once
+        notifications = Task.objects.filter(name='tracking.notifications.notify', kwargs__title='Parcel Status Update')
+        self.assertEqual(notifications.count(), 3)
+        self.assertTrue(all(task.kwargs['task_key'] for task in notifications))
+
+    def test_invalid_transitions_and_requests(self):
+        parcel = self.book()
+        pickup = self.assign(parcel, 'pickup')
+        self.assertEqual(self.batch([{'action': 'complete', 'job_id': pickup}])[0]['status'], 409)
+        response = self.driver_client.post('/api/jobs/batch/', {'actions': []}, format='json')
+        self.assertEqual(response.status_code, 400)
+        response = self.customer_client.post(
+            '/api/jobs/batch/', {'actions': [{'action': 'scan', 'job_id': pickup}]}, format='json')
+        self.assertEqual(response.status_code, 403)
+
+    @override_settings(TASKS_EAGER=True)
+    def test_a_failed_completion_keeps_its_uploads(self):
+        upload_id = self.upload_image()
+        parcel = self.book()
+        delivery = self.assign(parcel, 'delivery')
+        self.assertEqual(self.batch([{'action': 'scan', 'job_id': delivery}])[0]['status'], 200)
+        complete = {'action': 'complete', 'job_id': delivery, 'delivery_image_upload_id': upload_id}
+        results = self.batch([{**complete, 'signature_upload_id': str(uuid.uuid4())}])
+        self.assertEqual(results[0]['status'], 400)
+        self.assertEqual(UploadSession.objects.get(pk=upload_id).status, 'finalized')
+        self.assertEqual(self.batch([complete])[0]['status'], 200)
+        self.assertEqual(UploadSession.objects.get(pk=upload_id).status, 'consumed')
+
+
+class IdempotencyTests(TrackingTestCase):
+    def accept(self, job, key):
+        return self.driver_client.post(f'/api/jobs/{job}/accept/', {}, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_replay(self):
+        job = self.assign(self.book(), 'pickup')
+        first = self.accept(job, 'accept-1')
+        self.assertEqual(first.status_code, 200)
+        events = TrackingEvent.objects.count()
+        with CaptureQueriesContext(connection) as queries:
+            again = self.accept(job, 'accept-1')
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(again['Idempotent-Replayed'], 'true')
+        self.assertEqual(again.json(), first.json())
+        # From the table, once this process has forgotten it
+        idempotency._local.clear()
+        self.assertEqual(self.accept(job, 'accept-1')['Idempotent-Replayed'], 'true')
+        self.assertEqual(TrackingEvent.objects.count(), events)
+
+    def test_key_reuse(self):
+        job = self.assign(self.book(), 'pickup')
+        self.assertEqual(self.accept(job, 'reused').status_code, 200)
+        response = self.driver_client.post(f'/api/jobs/{job}/scan_parcel/', HTTP_IDEMPOTENCY_KEY='reused')
+        self.assertEqual(response.status_code, 422)
+        # Keys belong to a user
+        response = self.customer_client.post('/api/parcels/book/', _parcel_data(), format='json',
+                                             HTTP_IDEMPOTENCY_KEY='reused')
+        self.assertEqual(response.status_code, 201)
+
+    def test_unstored_outcomes_release_the_key(self):
+        self.assertEqual(self.accept(0, 'missing').status_code, 404)
+        self.assertFalse(IdempotencyKey.objects.exists())
+        job = self.assign(self.book(), 'pickup')
+        for _ in range(2):
+            response = self.driver_client.post(f'/api/jobs/{job}/complete_delivery/', {'notes': 'x'},
+                                               HTTP_IDEMPOTENCY_KEY='too-early')
+            self.assertEqual(response.status_code, 409)
+            self.assertNotIn('Idempotent-Replayed', response)
+
+    def test_in_progress_key(self):
+        job = self.assign(self.book(), 'pickup')
+        request = Request(APIRequestFactory().post(f'/api/jobs/{job}/accept/', {}, format='json'),
+                          parsers=[JSONParser()])
+        IdempotencyKey.objects.create(user=self.driver_user, key='busy', fingerprint=idempotency.fingerprint(request))
+        self.assertEqual(self.accept(job, 'busy').status_code, 409)
+        self.assertEqual(Job.objects.get(pk=job).status, 'assigned')
+        # Left behind by a crashed process: taken over
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_LOCK_TIMEOUT))
+        self.assertEqual(self.accept(job, 'busy').status_code, 200)
+        self.assertEqual(IdempotencyKey.objects.get().status_code, 200)
+
+    def test_purge(self):
+        job = self.assign(self.book(), 'pickup')
+        self.accept(job, 'old')
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(days=2))
+        call_command('purge_idempotency_keys', stdout=io.StringIO())
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+
+class ConcurrencyTests(TrackingTestCase):
+    def test_versioned_update(self):
+        job = Job.objects.get(pk=self.assign(self.book(), 'pickup'))
+        stale = Job.objects.get(pk=job.pk)
+        versioned_update(job, notes='first')
+        self.assertEqual(job.version, 1)
+        with self.assertRaises(StaleObject) as raised:
+            versioned_update(stale, notes='second')
+        self.assertEqual(raised.exception.current['notes'], 'first')
+        self.assertEqual(Job.objects.get(pk=job.pk).notes, 'first')
+
+    def test_stale_writes_get_409(self):
+        parcel = self.book()
+        job = self.assign(parcel, 'pickup')
+        fetch = views.get_object_or_404
+
+        def fetch_then_change(model, **lookup):
+            found = fetch(model, **lookup)
+            Job.objects.filter(pk=found.pk).update(version=99, notes='changed meanwhile')
+            return found
+
+        events = TrackingEvent.objects.count()
+        with mock.patch.object(views, 'get_object_or_404', fetch_then_change):
+            response = self.driver_client.post(f'/api/jobs/{job}/accept/')
+        self.assertEqual(response.status_code, 409, response.content)
+        self.assertEqual(response.json()['current']['version'], 99)
+        self.assertEqual(response.json()['current']['status'], 'assigned')
+        self.assertEqual(TrackingEvent.objects.count(), events)
+
+        self.assertEqual(self.driver_client.post(f'/api/jobs/{job}/accept/').status_code, 200)
+        with mock.patch.object(views, 'get_object_or_404', fetch_then_change):
+            response = self.driver_client.post(f'/api/jobs/{job}/scan_parcel/')
+        self.assertEqual(response.status_code, 409)
+        parcel.refresh_from_db()
+        self.assertEqual(parcel.status, 'awaiting_pickup')
+
+    def test_stale_parcel(self):
+        parcel = self.book()
+        Parcel.objects.filter(pk=parcel.pk).update(version=5)
+        with self.assertRaises(StaleObject):
+            apply_event(parcel, 'pickup_assigned')
+        self.assertFalse(ParcelEvent.objects.filter(parcel=parcel, event_type='pickup_assigned').exists())
+
+    def test_versioned_job_updates_evict_cached_views(self):
+        parcel = self.book()
+        job = self.assign(parcel, 'pickup')
+        with mock.patch.object(views, 'invalidate', wraps=views.invalidate) as invalidate:
+            self.driver_client.post(f'/api/jobs/{job}/accept/')
+        # update() sends no post_save for the signal handlers to act on
+        invalidate.assert_called_once_with(parcel_tag(parcel.pk), driver_tag(self.driver.pk),
+                                           stops_tag(self.driver.pk))
+
+
+class GeofenceTests(TrackingTestCase):
+    def test_each_stage_fires_once(self):
+        geo.load_gazetteer([('1 Pickup St', 40.0, -74.0), ('2 Delivery Ave', 40.05, -74.05)])
+        with self.captureOnCommitCallbacks(execute=True):
+            parcel = self.book()
+        self.assertEqual((parcel.pickup_latitude, parcel.delivery_latitude), (40.0, 40.05))
+        with self.captureOnCommitCallbacks(execute=True):
+            job = self.assign(parcel, 'pickup')
+        events = TrackingEvent.objects.filter(parcel=parcel)
+        before = events.count()
+        tasks = Task.objects.count()
+
+        self.ping(40.1, -74.0)
+        self.assertEqual(events.count(), before)
+        for latitude in (40.003, 40.002):  # about 330 and 220 m away
+            self.ping(latitude, -74.0)
+            self.assertEqual(Job.objects.get(pk=job).geofence_status, 'arriving')
+            self.assertEqual(events.count(), before + 1)
+            self.assertEqual(Task.objects.count(), tasks + 1)
+        for latitude in (40.0003, 40.0):
+            self.ping(latitude, -74.0)
+            self.assertEqual(Job.objects.get(pk=job).geofence_status, 'arrived')
+            self.assertEqual(events.count(), before + 2)
+        # Back out and in again: stages only move forward
+        self.ping(40.003, -74.0)
+        self.ping(40.0, -74.0)
+        self.assertEqual(events.count(), before + 2)
+        self.assertEqual(Task.objects.count(), tasks + 2)
+
+    def test_stops_without_coordinates_are_skipped(self):
+        parcel = self.book()
+        self.assertIsNone(parcel.pickup_latitude)
+        with self.captureOnCommitCallbacks(execute=True):
+            job = self.assign(parcel, 'pickup')
+        self.ping(0.0, 0.0)
+        self.assertEqual(Job.objects.get(pk=job).geofence_status, '')
+
+
+class RegistryTests(TrackingTestCase):
+    def state(self):
+        return drivers.get(self.driver_user.pk)
+
+    def test_counts_follow_jobs(self):
+        parcel = self.book(weight=7)
+        self.assertEqual(self.state().open_jobs, 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            pickup = self.assign(parcel, 'pickup')
+        self.assertEqual((self.state().open_jobs, self.state().assigned_weight), (1, 7))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.driver_client.post(f'/api/jobs/{pickup}/scan_parcel/')
+        self.assertEqual(self.state().open_jobs, 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            delivery = self.assign(parcel, 'delivery')
+            self.driver_client.post(f'/api/jobs/{delivery}/scan_parcel/')
+        self.assertEqual(self.state().open_jobs, 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.driver_client.post(
+                '/api/jobs/batch/', {'actions': [{'action': 'complete', 'job_id': delivery}]}, format='json')
+        self.assertEqual(response.json()['results'][0]['status'], 200)
+        self.assertEqual((self.state().open_jobs, self.state().assigned_weight), (0, 0))
+        # A rebuild agrees with the running counts
+        drivers.build()
+        self.assertEqual(self.state().open_jobs, 0)
+
+    def test_deleted_jobs(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            job = self.assign(self.book(), 'pickup')
+        with self.captureOnCommitCallbacks(execute=True):
+            Job.objects.get(pk=job).delete()
+        self.assertEqual(self.state().open_jobs, 0)
+
+    def test_available_drivers(self):
+        nearby = User.objects.create_user('nearby', password='pw', user_type='driver')
+        Driver.objects.create(user=nearby, is_available=True, current_latitude=40.71, current_longitude=-74.0)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assign(self.book(weight=499), 'pickup')
+        response = self.controller_client.get('/api/drivers/available/?weight=5&latitude=40.7&longitude=-74.0')
+        self.assertEqual([row['driver_id'] for row in response.json()['results']], [nearby.pk])
+        self.assertEqual(len(self.controller_client.get('/api/drivers/available/').json()['results']), 2)
+        self.assertEqual(self.controller_client.get('/api/drivers/available/?weight=x').status_code, 400)
+        self.assertEqual(self.driver_client.get('/api/drivers/available/').status_code, 403)
+        rows = {row['user']['id']: row for row in self.controller_client.get('/api/drivers/').json()['results']}
+        self.assertEqual((rows[self.driver_user.pk]['open_jobs'], rows[self.driver_user.pk]['assigned_weight']),
+                         (1, 499))
+
+    def test_start_builds_up_front(self):
+        registry = type(drivers)()
+        with mock.patch('threading.Thread'):
+            registry.start()
+        self.assertIn(self.driver_user.pk, {state.driver_id for state in registry._states.values()})
+        with CaptureQueriesContext(connection) as queries:
+            registry.all()
+        self.assertEqual(len(queries), 0)
+
+
+class SearchTests(TrackingTestCase):
+    def found(self, text, client=None):
+        response = (client or self.controller_client).get('/api/parcels/search/', {'q': text})
+        self.assertEqual(response.status_code, 200, response.content)
+        return [row['id'] for row in response.json()['results']]
+
+    def test_query(self):
+        first = self.book(pickup_address='12 Main St, Springfield', recipient_name='Alice Jones')
+        second = self.book(pickup_address='5 Oak Ave', delivery_address='Main Street 9', description='mainframe')
+        self.assertEqual(set(self.found('main')), {first.pk, second.pk})
+        self.assertEqual(self.found('ali spring'), [first.pk])
+        self.assertEqual(self.found(first.tracking_number), [first.pk])
+        self.assertEqual(self.found(first.tracking_number[:6]), [first.pk])
+        self.assertEqual(len(self.found('cust')), 2)
+        self.assertEqual(self.found('" OR *'), [])
+        self.assertEqual(self.found('main', client=self.customer_client), [])
+        self.assertEqual(self.controller_client.get('/api/parcels/search/').status_code, 400)
+
+    def test_ranking(self):
+        parcel = self.book()
+        mention = self.book(description=f'see {parcel.tracking_number[:8]}')
+        self.assertEqual(self.found(parcel.tracking_number[:8]), [parcel.pk, mention.pk])
+
+    def test_index_follows_writes(self):
+        parcel = self.book(recipient_name='Alice')
+        Parcel.objects.filter(pk=parcel.pk).update(recipient_name='Carol')
+        self.assertEqual(self.found('alice'), [])
+        self.assertEqual(self.found('carol'), [parcel.pk])
+        self.customer.username = 'zebra'
+        self.customer.save()
+        self.assertEqual(self.found('zeb'), [parcel.pk])
+        parcel.delete()
+        self.assertEqual(self.found('carol'), [])
+
+    def test_queries_dont_grow_with_results(self):
+        self.book(description='blue box')
+        with CaptureQueriesContext(connection) as few:
+            self.assertEqual(len(self.found('blue')), 1)
+        for number in range(5):
+            self.assign(self.book(description=f'blue box {number}'), 'pickup')
+        with CaptureQueriesContext(connection) as many:
+            self.assertEqual(len(self.found('blue')), 6)
+        self.assertEqual(len(many), len(few))
+
+
+@override_settings(SHARD_DATABASES=('default',), PASSWORD_HASHERS=FAST_HASHERS)
+class SearchIndexRebuildTests(TransactionTestCase):
+    """SQLite drops a table's triggers when a migration rebuilds it."""
+
+    def test_triggers_survive_a_table_rebuild(self):
+        if search.backend('default') != 'sqlite':
+            self.skipTest('Needs the SQLite index')
+        customer = User.objects.create_user('customer', password='pw', user_type='customer')
+        before = Parcel.objects.create(customer=customer, tracking_number='T-BEFORE', **_parcel_data(
+            recipient_name='Before Rebuild'))
+
+        emit_pre_migrate_signal(0, False, 'default')
+        with connection.schema_editor() as editor:
+            editor._remake_table(Parcel)
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'")
+            self.assertFalse(set(search.SQLITE_TRIGGERS) & {name for name, in cursor.fetchall()})
+        during = Parcel.objects.create(customer=customer, tracking_number='T-DURING', **_parcel_data(
+            recipient_name='During Rebuild'))
+        emit_post_migrate_signal(0, False, 'default')
+
+        self.assertEqual(set(search.search(Parcel.objects.all(), 'rebuild')), {before, during})
+        after = Parcel.objects.create(customer=customer, tracking_number='T-AFTER', **_parcel_data(
+            recipient_name='After Rebuild'))
+        customer.username = 'renamed'
+        customer.save()
+        self.assertEqual(set(search.search(Parcel.objects.all(), 'renamed')), {before, during, after})
+
+
+class EstimatedCountTests(TrackingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.parcels = [self.book() for _ in range(5)]
+        taskqueue.drain()
+        # Leaves a gap in the ids, so the estimate from their range is off by one
+        self.parcels[2].delete()
+
+    def count(self, queryset):
+        return EstimatedCountPaginator(queryset.order_by('pk'), 2).count
+
+    def test_below_the_limit_counts_exactly(self):
+        with self.settings(ADMIN_EXACT_COUNT_LIMIT=10):
+            self.assertEqual(self.count(Parcel.objects.all()), 4)
+            self.assertEqual(self.count(Parcel.objects.filter(pk__gt=self.parcels[0].pk)), 3)
+
+    def test_above_the_limit(self):
+        with self.settings(ADMIN_EXACT_COUNT_LIMIT=3):
+            # Unfiltered: the table's estimated size, without a COUNT(*)
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.count(Parcel.objects.all()), 5)
+            self.assertFalse(any('COUNT(' in query['sql'] for query in queries))
+            # Filtered: counted no further than the limit
+            self.assertEqual(self.count(Parcel.objects.filter(customer=self.customer)), 3)
+            self.assertEqual(self.count(Parcel.objects.filter(pk=self.parcels[0].pk)), 1)
+
+    def test_changelist(self):
+        admin_user = User.objects.create_superuser('admin', password='pw')
+        client = Client()
+        client.force_login(admin_user)
+        with self.settings(ADMIN_EXACT_COUNT_LIMIT=3):
+            response = client.get('/admin/tracking/parcel/')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '5 parcels')
+        self.deliver(self.parcels[0])
+        archive_closed_parcels(0)
+        response = client.get('/admin/tracking/archivedparcel/')
+        self.assertContains(response, self.parcels[0].tracking_number)
+
+
+class HeatmapTests(TrackingTestCase):
+    def test_quadkey(self):
+        self.assertEqual(heatmap.quadkey(3, 3, 5), '213')
+        self.assertEqual(heatmap.quadkey(0, 0, 0), '')
+
+    def test_bin_points(self):
+        rng = np.random.default_rng(1)
+        latitudes, longitudes = rng.uniform(24.7, 25.0, 500), rng.uniform(66.9, 67.2, 500)
+        for zoom in (8, 14):
+            tiles = heatmap.bin_points(latitudes, longitudes, zoom, 64)
+            self.assertEqual(sum(int(counts.sum()) for _, _, _, counts in tiles), 500)
+            cells = {(x, y): set(tile_cells.tolist()) for x, y, tile_cells, _ in tiles}
+            world_x, world_y = heatmap.world_position(latitudes, longitudes)
+            for point in range(0, 500, 50):
+                x, y = world_x[point] * (1 << zoom), world_y[point] * (1 << zoom)
+                cell = int((y - int(y)) * 64) * 64 + int((x - int(x)) * 64)
+                self.assertIn(cell, cells[(int(x), int(y))])
+
+    def test_refresh_and_tiles(self):
+        for latitude, longitude in ((24.86, 67.01), (24.861, 67.011), (31.52, 74.35)):
+            LocationPing.objects.create(driver=self.driver, latitude=latitude, longitude=longitude)
+        self.assertEqual(heatmap.refresh(batch_size=2)['drivers'], 3)
+        self.assertEqual(heatmap.refresh()['drivers'], 0)
+        world_x, world_y = heatmap.world_position(24.86, 67.01)
+        x, y = int(world_x * (1 << 14)), int(world_y * (1 << 14))
+        body = self.controller_client.get(f'/api/heatmaps/drivers/14/{x}/{y}/').json()
+        self.assertEqual((body['total'], body['quadkey']), (2, heatmap.quadkey(14, x, y)))
+        self.assertEqual(sum(map(sum, body['counts'])), 2)
+        self.assertEqual(self.controller_client.get('/api/heatmaps/drivers/14/').json()['count'], 2)
+        self.assertEqual(self.controller_client.get('/api/heatmaps/drivers/13/0/0/').status_code, 404)
+        self.assertEqual(self.customer_client.get(f'/api/heatmaps/drivers/14/{x}/{y}/').status_code, 403)
+
+    def test_purge_keeps_uncounted_pings(self):
+        old = timezone.now() - timedelta(days=31)
+        counted = LocationPing.objects.create(driver=self.driver, latitude=1, longitude=1, recorded_at=old)
+        heatmap.refresh()
+        uncounted = LocationPing.objects.create(driver=self.driver, latitude=1, longitude=1, recorded_at=old)
+        self.assertEqual(pings.purge(), 1)
+        self.assertEqual(list(LocationPing.objects.all()), [uncounted])
+        self.assertFalse(LocationPing.objects.filter(pk=counted.pk).exists())
+        heatmap.refresh()
+        self.assertEqual(pings.purge(), 1)
+
+
+class LoadingTests(TrackingTestCase):
+    def test_parse_dimensions(self):
+        parse = loading.parse_dimensions
+        self.assertEqual(parse('10 x 20 x 30'), (10, 20, 30))
+        self.assertEqual(parse('10x20x30cm'), (10, 20, 30))
+        self.assertEqual(parse('0.4 x 0.3 x 0.2 m'), (40, 30, 20))
+        self.assertEqual(parse('1,5 × 2 × 3'), (1.5, 2, 3))
+        self.assertEqual(parse('10 * 20 * 30 in'), (25.4, 50.8, 76.2))
+        self.assertEqual(parse('100 mm x 20 cm x 3'), (10, 20, 3))
+        for text in ('small box', '', None, '0 x 1 x 1', '1 x 2'):
+            self.assertIsNone(parse(text))
+
+    def test_pack(self):
+        # The 2 m3 parcel fits nowhere; the 8 kg one only in the first vehicle, leaving no room for 3 kg
+        placed = loading.pack(np.array([8.0, 3.0, 1.0]), np.array([np.nan, 0.001, 2.0]),
+                              capacity_kg=[10, 4], capacity_m3=[1, 1], slots=[5, 5])
+        self.assertEqual(placed.tolist(), [0, 1, -1])
+        # Best fit: the vehicle with the least room left that takes it
+        placed = loading.pack(np.array([3.0]), np.array([np.nan]), capacity_kg=[10, 4], capacity_m3=[1, 1],
+                              slots=[5, 5])
+        self.assertEqual(placed.tolist(), [1])
+        placed = loading.pack(np.array([1.0, 1.0]), np.array([np.nan, np.nan]), capacity_kg=[100],
+                              capacity_m3=[10], slots=[1])
+        self.assertEqual(placed.tolist(), [0, -1])
+
+    def test_capacity_on_assignment(self):
+        parcel = self.book(dimensions='50 x 40 x 30')
+        self.assertEqual((parcel.length_cm, parcel.width_cm, parcel.height_cm), (50, 40, 30))
+        Driver.objects.filter(pk=self.driver.pk).update(cargo_volume_m3=0.1, max_load_kg=10)
+        drivers.reset()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assign(parcel, 'pickup')
+        response = self.controller_client.post(
+            f'/api/parcels/{self.book(dimensions="50 x 40 x 30").pk}/assign_driver/',
+            {'driver_id': self.driver_user.pk, 'job_type': 'pickup'}, format='json')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['volume_left_m3'], 0.04)
+
+    def test_plan(self):
+        small = User.objects.create_user('small', password='pw', user_type='driver')
+        Driver.objects.create(user=small, is_available=True, max_load_kg=20, cargo_volume_m3=0.2)
+        Driver.objects.filter(pk=self.driver.pk).update(max_load_kg=1, cargo_volume_m3=0.001)
+        drivers.reset()
+        heavy = self.book(dimensions='20 x 20 x 20', weight=15)
+        bulky = self.book(dimensions='120 x 120 x 120', weight=1)
+        plan = self.controller_client.get('/api/loads/plan/').json()
+        placed = {parcel_id: load['driver_id'] for load in plan['loads'] for parcel_id in load['parcel_ids']}
+        self.assertEqual(placed, {heavy.pk: small.pk})
+        self.assertEqual(plan['unplaced'], [bulky.pk])
+        self.assertEqual(self.customer_client.get('/api/loads/plan/').status_code, 403)
+
+    def test_plan_limit(self):
+        for limit in ('-5', '0', 'abc'):
+            self.assertEqual(self.controller_client.get('/api/loads/plan/', {'limit': limit}).status_code, 400)
+        for _ in range(3):
+            self.book()
+        with override_settings(LOAD_PLAN_MAX_PARCELS=2):
+            plan = self.controller_client.get('/api/loads/plan/', {'limit': 10 ** 7}).json()
+        self.assertEqual(sum(len(load['parcel_ids']) for load in plan['loads']) + len(plan['unplaced']), 2)
+
+
+@skipUnless(len(settings.SHARD_DATABASES) > 1, 'Needs several shards, e.g. SQLITE_SHARD_PATHS=a.sqlite3,b.sqlite3')
+@override_settings(SHARD_DATABASES=settings.SHARD_DATABASES)
+class ShardingTests(TrackingTestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        super().setUp()
+        self.parcels = [self.book() for _ in range(3 * len(sharding.shards()))]
+
+    def test_routing(self):
+        for alias in sharding.shards():
+            self.assertTrue(User.objects.using(alias).filter(pk=self.customer.pk).exists())
+            self.assertTrue(Driver.objects.using(alias).filter(pk=self.driver_user.pk).exists())
+        self.assertEqual({sharding.shard_of(parcel) for parcel in self.parcels}, set(sharding.shards()))
+        for parcel in self.parcels:
+            alias = parcel._state.db
+            self.assertEqual(alias, sharding.shard_for_key(parcel.tracking_number))
+            self.assertEqual(alias, sharding.shard_for_id(parcel.pk))
+            self.assertEqual(Parcel.objects.get(pk=parcel.pk)._state.db, alias)
+            self.assertEqual(Parcel.objects.get(tracking_number=parcel.tracking_number).pk, parcel.pk)
+            self.assertEqual(ParcelEvent.objects.using(alias).filter(parcel_id=parcel.pk).count(), 1)
+            self.assertEqual([event._state.db for event in parcel.tracking_events.all()], [alias])
+        taskqueue.drain()
+        for parcel in self.parcels:
+            self.assertTrue(Notification.objects.using(parcel._state.db).filter(parcel_id=parcel.pk).exists())
+
+    def test_flows_stay_on_their_shard(self):
+        parcel, pickup, delivery = self.deliver(self.parcels[0])
+        self.assertEqual(parcel.status, 'delivered')
+        self.assertEqual(Job.objects.using(parcel._state.db).filter(pk__in=[pickup, delivery]).count(), 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            for other in self.parcels[1:]:
+                self.assign(other, 'pickup')
+        drivers.reset()
+        self.assertEqual(drivers.get(self.driver_user.pk).open_jobs, len(self.parcels) - 1)
+
+    def test_scatter_gather(self):
+        everywhere = Parcel.objects.order_by('-weight', 'id').everywhere()
+        self.assertEqual(everywhere.count(), len(self.parcels))
+        expected = sorted((parcel for parcel in self.parcels), key=lambda parcel: (-parcel.weight, parcel.pk))
+        self.assertEqual(list(everywhere), expected)
+        self.assertEqual(list(everywhere[2:5]), expected[2:5])
+        self.assertEqual(list(everywhere[4:]), expected[4:])
+        self.assertEqual(everywhere[1], expected[1])
+        self.assertEqual(everywhere[2:5].count(), 3)
+        self.assertEqual(list(everywhere.filter(pk__in=[parcel.pk for parcel in expected[:2]])), expected[:2])
+        with self.assertRaises(TypeError):
+            everywhere[1:3].filter(weight=1)
+        with self.assertRaises(ValueError):
+            everywhere[-1:]
+
+    def test_list_views_merge_shards(self):
+        results = self.controller_client.get('/api/parcels/').json()['results']
+        self.assertEqual(sorted(row['id'] for row in results), sorted(parcel.pk for parcel in self.parcels))
+        results = self.customer_client.get('/api/parcels/my_parcels/').json()['results']
+        self.assertEqual([row['id'] for row in results], sorted(parcel.pk for parcel in self.parcels))
+        found = self.controller_client.get('/api/parcels/search/', {'q': 'box'}).json()['results']
+        self.assertEqual(len(found), len(self.parcels))
@@ -0,0 +1,73 @@
+"""
+Per-IP sliding-window throttle backed by a process-local dict.
+
+Uses the sliding window counter approximation: each client keeps the count
+of the current and previous fixed windows, and the request rate is the
+current count plus the previous count weighted by how much of the previous
+window still overlaps the sliding window. That is O(1) time and memory per
+client with no cache round trip, so it is cheap enough for every public
+request.
+"""
+import threading
+import time
+
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+
+class SlidingWindowThrottle(BaseThrottle):
+    scope = None
+    # Entries idle for two windows are dropped once the table grows past this
+    max_clients = 100000
+
+    _lock = threading.Lock()
+    _windows = {}
+
+    def __init__(self):
+        rate = api_settings.DEFAULT_THROTTLE_RATES.get(self.scope)
+        self.num_requests, self.duration = self.parse_rate(rate)
+
+    def parse_rate(self, rate):
+        if rate is None:
+            return None, None
+        num, period = rate.split('/')
+        duration = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}[period[0]]
+        return int(num), duration
+
+    def allow_request(self, request, view):
+        if self.num_requests is None:
+            return True
+
+        key = (self.scope, self.get_ident(request))
+        now = time.monotonic()
+        window = int(now // self.duration)
+        with self._lock:
+            entry = self._windows.get(key)
+            if entry is None or entry[0] < window - 1:
+                entry = [window, 0, 0]
+            elif entry[0] == window - 1:
+                entry = [window, 0, entry[1]]
+            self._windows[key] = entry
+
+            elapsed = (now % self.duration) / self.duration
+            estimate = entry[2] * (1 - elapsed) + entry[1]
+            if estimate >= self.num_requests:
+                self._wait = self.duration * (1 - elapsed)
+                return False
+            entry[1] += 1
+
+            if len(self._windows) > self.max_clients:
+                self._prune(window)
+        return True
+
+    def _prune(self, window):
+        stale = [key for key, entry in self._windows.items() if entry[0] < window - 1]
+        for key in stale:
+            del self._windows[key]
+
+    def wait(self):
+        return getattr(self, '_wait', None)
+
+
+class PublicTrackingThrottle(SlidingWindowThrottle):
+    scope = 'public_tracking'
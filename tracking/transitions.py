@@ -0,0 +1,165 @@
+"""
+Parcel status state machine.
+
+Every status change is appended to ParcelEvent and Parcel.status /
+can_customer_track are kept as a projection of that stream with a single
+targeted UPDATE. `python manage.py replay_parcel_events` rebuilds the
+projection from the stream.
+
+Parcels booked before the stream existed start with a 'baseline' event
+(migration 0004) holding the status and tracking flag they had then.
+"""
+from collections import namedtuple
+
+from django.db import transaction
+from django.utils import timezone
+
+from .cache import invalidate, parcel_tag, user_tag
+from .concurrency import versioned_update
+from .models import ParcelEvent
+
+
+Transition = namedtuple('Transition', ['sources', 'target', 'enables_tracking'])
+
+
+# event_type -> statuses it may be applied from, resulting status, and whether
+# it opens the parcel up for customer tracking
+TRANSITIONS = {
+    'booked': Transition(frozenset({''}), 'order_placed', False),
+    'pickup_assigned': Transition(
+        frozenset({'order_placed', 'awaiting_pickup'}), 'awaiting_pickup', False),
+    'collected': Transition(frozenset({'awaiting_pickup'}), 'collected', False),
+    'departed': Transition(frozenset({'collected'}), 'in_transit', False),
+    'delivery_assigned': Transition(
+        frozenset({'order_placed', 'collected', 'in_transit', 'out_for_delivery', 'failed_delivery'}),
+        'out_for_delivery', True),
+    'out_for_delivery': Transition(
+        frozenset({'collected', 'in_transit', 'out_for_delivery'}), 'out_for_delivery', True),
+    'delivered': Transition(frozenset({'out_for_delivery'}), 'delivered', False),
+    'delivery_failed': Transition(frozenset({'out_for_delivery'}), 'failed_delivery', False),
+    'cancelled': Transition(
+        frozenset({'order_placed', 'awaiting_pickup', 'collected', 'in_transit', 'failed_delivery'}),
+        'cancelled', False),
+}
+
+TERMINAL_STATUSES = frozenset({'delivered', 'cancelled'})
+
+# Not a transition: seeds the projection of a parcel from before the stream
+BASELINE = 'baseline'
+
+
+class InvalidTransition(Exception):
+    def __init__(self, status, event_type):
+        self.status = status
+        self.event_type = event_type
+        super().__init__(
+            f"Cannot apply '{event_type}' to a parcel that is '{status or 'new'}'")
+
+
+def next_status(status, event_type):
+    """Return the status `event_type` leads to from `status`, or raise."""
+    transition = TRANSITIONS.get(event_type)
+    if transition is None or status not in transition.sources:
+        raise InvalidTransition(status, event_type)
+    return transition.target
+
+
+def event_for_status(status, target):
+    """Find the event type that moves a parcel from `status` to `target`."""
+    for event_type, transition in TRANSITIONS.items():
+        if transition.target == target and status in transition.sources:
+            return event_type
+    raise InvalidTransition(status, target)
+
+
+def project(events):
+    """Fold a parcel's (event_type, timestamp, data) rows, oldest first, into
+    its projected fields."""
+    status = ''
+    can_customer_track = False
+    closed_at = None
+    for event_type, timestamp, data in events:
+        if event_type == BASELINE:
+            status = data['status']
+            can_customer_track = data['can_customer_track']
+            closed_at = timestamp if status in TERMINAL_STATUSES else None
+            continue
+        transition = TRANSITIONS[event_type]
+        status = transition.target
+        can_customer_track = can_customer_track or transition.enables_tracking
+        closed_at = timestamp if status in TERMINAL_STATUSES else None
+    return {'status': status, 'can_customer_track': can_customer_track, 'closed_at': closed_at}
+
+
+def record_booking(parcel, created_by=None):
+    """Append the initial event for a freshly created parcel."""
+    return ParcelEvent.objects.create(
+        parcel=parcel,
+        event_type='booked',
+        from_status='',
+        to_status=parcel.status,
+        created_by=created_by,
+    )
+
+
+def apply_event(parcel, event_type, created_by=None, fields=None, **data):
+    """
+    Validate and apply `event_type` to `parcel`.
+
+    Appends a ParcelEvent and updates only the projected columns (plus any
+    extra `fields`, e.g. current_driver) with an UPDATE guarded on the
+    version we validated against, so a concurrent change raises StaleObject
+    instead of being overwritten. `parcel` is updated in place.
+    """
+    transition = TRANSITIONS.get(event_type)
+    previous = parcel.status
+    target = next_status(previous, event_type)
+
+    updates = {'status': target}
+    if transition.enables_tracking:
+        updates['can_customer_track'] = True
+    if target in TERMINAL_STATUSES:
+        updates['closed_at'] = timezone.now()
+    updates.update(fields or {})
+
+    with transaction.atomic():
+        event = ParcelEvent.objects.create(
+            parcel=parcel,
+            event_type=event_type,
+            from_status=previous,
+            to_status=target,
+            data=data,
+            created_by=created_by,
+            timestamp=updates.get('closed_at') or timezone.now(),
+        )
+        versioned_update(parcel, **updates)
+        # update() sends no post_save, so evict cached views explicitly
+        invalidate(parcel_tag(parcel.pk), user_tag(parcel.customer_id))
+    return event
+
+
+def stage_event(parcel, event_type, created_by=None, timestamp=None, **data):
+    """
+    Validate `event_type` against `parcel` and apply it to the instance only,
+    returning the unsaved ParcelEvent. For callers that lock the parcel rows
+    and write many events at once (tracking/batch.py).
+    """
+    transition = TRANSITIONS.get(event_type)
+    previous = parcel.status
+    target = next_status(previous, event_type)
+    timestamp = timestamp or timezone.now()
+
+    parcel.status = target
+    if transition.enables_tracking:
+        parcel.can_customer_track = True
+    if target in TERMINAL_STATUSES:
+        parcel.closed_at = timestamp
+    return ParcelEvent(
+        parcel=parcel,
+        event_type=event_type,
+        from_status=previous,
+        to_status=target,
+        data=data,
+        created_by=created_by,
+        timestamp=timestamp,
+    )
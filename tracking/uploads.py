@@ -0,0 +1,159 @@
+"""
+Resumable chunked uploads for delivery proof media.
+
+A client creates an UploadSession with the total size, PUTs byte ranges
+(`Content-Range: bytes <start>-<end>/<size>`) in any number of requests and
+then finalizes it. Each chunk is streamed straight to its offset in the file
+on disk, so a dropped connection only loses the unfinished chunk and the
+client resumes from the offset the server reports.
+"""
+import hashlib
+import re
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import router, transaction
+from django.db.models import F
+from django.utils import timezone
+from PIL import Image
+
+from .models import UploadSession
+
+CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+|\*)$')
+
+# Upload id parameter of a completed delivery -> TrackingEvent field it goes into
+PROOF_UPLOAD_FIELDS = {'delivery_image_upload_id': 'image', 'signature_upload_id': 'signature'}
+
+
+class UploadError(Exception):
+    pass
+
+
+class OffsetMismatch(UploadError):
+    def __init__(self, offset):
+        self.offset = offset
+        super().__init__(f"Upload is at byte {offset}")
+
+
+def _chunk_size():
+    return getattr(settings, 'UPLOAD_CHUNK_SIZE', 64 * 1024)
+
+
+def create_session(user, filename, size, sha256=''):
+    max_size = getattr(settings, 'UPLOAD_MAX_SIZE', 25 * 1024 * 1024)
+    if size <= 0 or size > max_size:
+        raise UploadError(f"Upload size must be between 1 and {max_size} bytes")
+    session = UploadSession(user=user, filename=filename, size=size, sha256=sha256.lower())
+    session.file.save(f'{session.id}.part', ContentFile(b''), save=False)
+    session.save()
+    return session
+
+
+def parse_content_range(header, session):
+    """Return the (start, end) byte range a PUT declares, inclusive."""
+    if not header:
+        return session.received, None
+    match = CONTENT_RANGE_RE.match(header.strip())
+    if not match:
+        raise UploadError("Malformed Content-Range header")
+    start, end, total = match.groups()
+    start, end = int(start), int(end)
+    if total != '*' and int(total) != session.size:
+        raise UploadError("Content-Range total does not match the upload size")
+    if end < start or end >= session.size:
+        raise UploadError("Content-Range is outside the upload")
+    return start, end
+
+
+def write_chunk(session, stream, start, end=None):
+    """
+    Stream bytes from `stream` into the session file at `start`.
+
+    Writing at an explicit offset (rather than appending) makes a retried
+    chunk harmless. Returns the new offset.
+    """
+    if session.status != 'open':
+        raise UploadError("Upload has already been finalized")
+    if start != session.received:
+        raise OffsetMismatch(session.received)
+
+    limit = (end if end is not None else session.size - 1) - start + 1
+    written = 0
+    with open(session.file.path, 'r+b') as f:
+        f.seek(start)
+        while stream is not None and written < limit:
+            chunk = stream.read(min(_chunk_size(), limit - written))
+            if not chunk:
+                break
+            f.write(chunk)
+            written += len(chunk)
+
+    # Only advance if nobody else moved the offset in the meantime
+    UploadSession.objects.filter(pk=session.pk, received=start).update(
+        received=F('received') + written, last_activity=timezone.now())
+    session.refresh_from_db(fields=['received'])
+    return session.received
+
+
+def finalize(session):
+    if session.status != 'open':
+        return session
+    if session.received != session.size:
+        raise OffsetMismatch(session.received)
+
+    digest = hashlib.sha256()
+    with open(session.file.path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_chunk_size()), b''):
+            digest.update(chunk)
+    if session.sha256 and session.sha256 != digest.hexdigest():
+        raise UploadError("Checksum mismatch")
+
+    try:
+        with open(session.file.path, 'rb') as f:
+            Image.open(f).verify()
+    except Exception:
+        raise UploadError("Upload is not a valid image")
+
+    session.sha256 = digest.hexdigest()
+    session.status = 'finalized'
+    session.finalized_at = timezone.now()
+    session.save(update_fields=['sha256', 'status', 'finalized_at'])
+    return session
+
+
+def claim_finalized(user, upload_id):
+    """Mark a finalized upload as used and return it, or None."""
+    if not UploadSession.objects.filter(pk=upload_id, user=user, status='finalized').update(status='consumed'):
+        return None
+    return UploadSession.objects.get(pk=upload_id)
+
+
+def claim_all(user, upload_ids):
+    """
+    Claim every upload in `upload_ids` (name -> id) or none of them, so a
+    failed delivery can be retried with the same uploads. Returns
+    name -> UploadSession.
+    """
+    claimed = {}
+    with transaction.atomic(using=router.db_for_write(UploadSession)):
+        for name, upload_id in upload_ids.items():
+            upload = claim_finalized(user, upload_id)
+            if upload is None:
+                raise UploadError(f'{name} does not refer to a finalized upload')
+            claimed[name] = upload
+    return claimed
+
+
+def purge_stale(hours=24):
+    """Delete open uploads nobody has sent a chunk to for `hours`."""
+    cutoff = timezone.now() - timedelta(hours=hours)
+    stale = UploadSession.objects.filter(status='open', last_activity__lt=cutoff)
+    count = 0
+    for session in stale:
+        if session.file and default_storage.exists(session.file.name):
+            session.file.delete(save=False)
+        session.delete()
+        count += 1
+    return count
@@ -1,6 +1,6 @@
 from django.urls import path
 from . import views
-from .views import UpdateLocationView
+from .views import update_location
 
 
 urlpatterns = [
@@ -8,29 +8,42 @@ urlpatterns = [
     path('auth/register/', views.RegisterView.as_view(), name='register'),
     path('auth/login/', views.LoginView.as_view(), name='login'),
     path('auth/logout/', views.LogoutView.as_view(), name='logout'),
+    path('auth/token/', views.TokenObtainView.as_view(), name='token_obtain'),
+    path('auth/token/refresh/', views.TokenRefreshView.as_view(), name='token_refresh'),
 
     # Customer endpoints
     path('parcels/book/', views.ParcelBookingView.as_view(), name='book_parcel'),
     path('parcels/my_parcels/', views.CustomerParcelsView.as_view(), name='customer_parcels'),
+    path('parcels/search/', views.ParcelSearchView.as_view(), name='search_parcels'),
     path('parcels/<str:tracking_number>/', views.ParcelDetailView.as_view(), name='parcel_detail'),
 
     # Public tracking
-    path('public/track/<str:tracking_number>/', views.PublicTrackingView.as_view(), name='public_tracking'),
+    path('public/track/<str:tracking_number>/', views.public_tracking, name='public_tracking'),
 
     # Controller endpoints
     path('parcels/', views.AllParcelsView.as_view(), name='all_parcels'),
     path('drivers/', views.AllDriversView.as_view(), name='all_drivers'),
+    path('drivers/available/', views.AvailableDriversView.as_view(), name='available_drivers'),
+    path('loads/plan/', views.LoadPlanView.as_view(), name='load_plan'),
+    path('heatmaps/<str:layer>/<int:zoom>/', views.HeatmapCoverageView.as_view(), name='heatmap_coverage'),
+    path('heatmaps/<str:layer>/<int:zoom>/<int:x>/<int:y>/', views.HeatmapTileView.as_view(), name='heatmap_tile'),
     path('parcels/<int:parcel_id>/assign_driver/', views.AssignDriverView.as_view(), name='assign_driver'),
 
     # Driver endpoints
-    path('jobs/my_jobs/', views.DriverJobsView.as_view(), name='driver_jobs'),
+    path('jobs/my_jobs/', views.driver_jobs, name='driver_jobs'),
+    path('jobs/batch/', views.DriverBatchView.as_view(), name='driver_batch'),
     path('jobs/<int:job_id>/accept/', views.AcceptJobView.as_view(), name='accept_job'),
     path('jobs/<int:job_id>/scan_parcel/', views.ScanParcelView.as_view(), name='scan_parcel'),
     path('jobs/<int:job_id>/complete_delivery/', views.CompleteDeliveryView.as_view(), name='complete_delivery'),
-    path('driver/update_location/', views.UpdateLocationView.as_view(), name='update_location'),
+    path('driver/update_location/', views.update_location, name='update_location'),
+
+    # Resumable uploads
+    path('uploads/', views.UploadSessionCreateView.as_view(), name='upload_create'),
+    path('uploads/<uuid:upload_id>/', views.UploadSessionView.as_view(), name='upload_session'),
+    path('uploads/<uuid:upload_id>/finalize/', views.UploadFinalizeView.as_view(), name='upload_finalize'),
 
     # Notifications
-    path('notifications/', views.NotificationsView.as_view(), name='notifications'),
+    path('notifications/', views.notifications, name='notifications'),
     path('notifications/<int:notification_id>/mark_read/', views.MarkNotificationReadView.as_view(), name='mark_notification_read'),
 
     # Web interface URLs
@@ -47,7 +60,7 @@ urlpatterns = [
     path('admin-dashboard/', views.admin_dashboard_page, name='admin_dashboard'),
     path('driver-dashboard/', views.driver_dashboard_page, name='driver_dashboard'),
     path('profile/', views.profile_page, name='profile'),
-    path('api/driver/update-location/', UpdateLocationView.as_view(), name='update_location'),
+    path('api/driver/update-location/', update_location, name='update_location'),
 
     # path('parcel/<str:tracking_number>/', views.parcel_detail_view, name='view_parcel'),
 
@@ -1,16 +1,44 @@
-from rest_framework import generics, status, permissions
+import math
+import uuid
+
+from asgiref.sync import sync_to_async
+from rest_framework import exceptions, generics, status, permissions
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from django.contrib.auth import login, logout
+from django.conf import settings
+from django.http import Http404, HttpResponse
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
-from .models import User, Driver, Parcel, TrackingEvent, Job, Notification, AboutSection
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from .models import User, Driver, HeatmapTile, LocationPing, Parcel, TrackingEvent, Job, Notification, AboutSection, UploadSession
+from .archive import ChainedResults, find_archived
+from .authentication import issue_token
+from .batch import DriverBatch
+from .bloom import tracking_numbers
+from .async_api import authenticated_request, check_throttles, error_response, json_response, paginate
+from .cache import CachedViewMixin, cached_page, driver_tag, invalidate, parcel_tag, stops_tag, user_tag
+from .concurrency import StaleObject, versioned_update
+from .idempotency import idempotent
+from .media import stage_file, stage_upload
+from .metrics import registry
+from .registry import drivers as driver_registry, job_closed
+from .notifications import notify
+from .routers import ReplicaReadMixin, read_from_replica
+from .taskqueue import defer
+from .throttling import PublicTrackingThrottle
+from .transitions import InvalidTransition, apply_event, record_booking
+from . import geo, geofence, heatmap, loading, search, sharding, sync, uploads
+from .uploads import OffsetMismatch, UploadError
 from .serializers import (
     UserSerializer, LoginSerializer, DriverSerializer, ParcelSerializer,
     ParcelBookingSerializer, JobSerializer, NotificationSerializer,
     ParcelTrackingSerializer, DriverLocationUpdateSerializer,
-    DeliveryCompletionSerializer, TrackingEventSerializer
+    DeliveryCompletionSerializer, DriverBatchSerializer, TrackingEventSerializer, UploadSessionSerializer,
+    HeatmapCoverageSerializer, HeatmapTileSerializer
 )
 
 #website views
@@ -21,6 +49,16 @@ def about_page(request):
     return render(request, 'tracking/about.html', {'about': about})
 
 
+def update_job(job, **changes):
+    versioned_update(job, **changes)
+    # update() sends no post_save, so evict cached views explicitly
+    invalidate(parcel_tag(job.parcel_id), driver_tag(job.driver_id), stops_tag(job.driver_id))
+
+
+def conflict_response(exc):
+    """409 for a lost optimistic update, with the row as it is now."""
+    return Response({'error': str(exc), 'current': exc.current}, status=status.HTTP_409_CONFLICT)
+
 
 # Authentication Views
 class RegisterView(generics.CreateAPIView):
@@ -44,6 +82,26 @@ class LoginView(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+class TokenObtainView(APIView):
+    permission_classes = [permissions.AllowAny]
+
+    def post(self, request):
+        serializer = LoginSerializer(data=request.data)
+        if serializer.is_valid():
+            token, expires_at = issue_token(serializer.validated_data['user'])
+            return Response({'token': token, 'expires_at': expires_at})
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class TokenRefreshView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        # Re-issued tokens are signed with the currently active key
+        token, expires_at = issue_token(request.user)
+        return Response({'token': token, 'expires_at': expires_at})
+
+
 class LogoutView(APIView):
     def post(self, request):
         logout(request)
@@ -55,36 +113,76 @@ class ParcelBookingView(generics.CreateAPIView):
     serializer_class = ParcelBookingSerializer
     permission_classes = [permissions.IsAuthenticated]
 
+    @idempotent
+    def post(self, request, *args, **kwargs):
+        return super().post(request, *args, **kwargs)
+
     def perform_create(self, serializer):
-        parcel = serializer.save()
-        # Create initial tracking event
-        TrackingEvent.objects.create(
-            parcel=parcel,
-            status_update='Order placed',
-            notes='Parcel booking confirmed',
-            created_by=self.request.user
-        )
-        # Create notification for customer
-        Notification.objects.create(
-            user=parcel.customer,
-            title='Parcel Booked Successfully',
-            message=f'Your parcel with tracking number {parcel.tracking_number} has been booked.',
-            parcel=parcel
-        )
+        # Known up front so the whole booking is one transaction on the parcel's shard
+        tracking_number = str(uuid.uuid4())
+        with sharding.atomic(sharding.shard_for_key(tracking_number)):
+            parcel = serializer.save(
+                tracking_number=tracking_number,
+                **loading.dimension_fields(serializer.validated_data['dimensions']),
+                **geo.parcel_coordinates(
+                    serializer.validated_data['pickup_address'], serializer.validated_data['delivery_address']),
+            )
+            if geo.needs_geocoding(parcel):
+                defer(geo.locate_parcel, parcel.pk)
+            record_booking(parcel, created_by=self.request.user)
+            # Create initial tracking event
+            TrackingEvent.objects.create(
+                parcel=parcel,
+                status_update='Order placed',
+                notes='Parcel booking confirmed',
+                created_by=self.request.user
+            )
+            # Create notification for customer
+            defer(
+                notify, parcel.customer_id,
+                title='Parcel Booked Successfully',
+                message=f'Your parcel with tracking number {parcel.tracking_number} has been booked.',
+                parcel_id=parcel.pk,
+            )
 
 
-class CustomerParcelsView(generics.ListAPIView):
+class CustomerParcelsView(CachedViewMixin, generics.ListAPIView):
     serializer_class = ParcelSerializer
     permission_classes = [permissions.IsAuthenticated]
+    cache_timeout = 60
 
-    def get_queryset(self):
-        return Parcel.objects.filter(customer=self.request.user)
-
+    def get_cache_tags(self, data):
+        rows = data['results'] if isinstance(data, dict) else data
+        return [user_tag(self.request.user.pk)] + [parcel_tag(row['id']) for row in rows]
 
-class ParcelDetailView(generics.RetrieveAPIView):
+    def get_queryset(self):
+        return Parcel.objects.filter(customer=self.request.user).order_by('id')
+
+    def list(self, request, *args, **kwargs):
+        # Live parcels first, then archived ones (served from their snapshots)
+        results = ChainedResults(self.get_queryset().everywhere(), request.user.archived_parcels.all())
+        page = self.paginate_queryset(results)
+        rows = page if page is not None else results[:]
+        data = [
+            row.detail if not isinstance(row, Parcel) else self.get_serializer(row).data
+            for row in rows
+        ]
+        if page is not None:
+            return self.get_paginated_response(data)
+        return Response(data)
+
+
+class ParcelDetailView(CachedViewMixin, generics.RetrieveAPIView):
     serializer_class = ParcelSerializer
     permission_classes = [permissions.IsAuthenticated]
     lookup_field = 'tracking_number'
+    cache_timeout = 60
+
+    def get_cache_tags(self, data):
+        tags = [parcel_tag(data['id']), user_tag(data['customer'])]
+        if data.get('current_driver'):
+            tags.append(user_tag(data['current_driver']))
+        return tags
 
     def get_queryset(self):
         user = self.request.user
@@ -94,53 +192,207 @@ class ParcelDetailView(generics.RetrieveAPIView):
             return Parcel.objects.all()
         return Parcel.objects.none()
 
-
-# Public Tracking View
-class PublicTrackingView(generics.RetrieveAPIView):
-    serializer_class = ParcelTrackingSerializer
-    permission_classes = [permissions.AllowAny]
-    lookup_field = 'tracking_number'
-    queryset = Parcel.objects.all()
-
-
-    def get_queryset(self):
-        return Parcel.objects.all()
-
     def retrieve(self, request, *args, **kwargs):
-        instance = self.get_object()
+        try:
+            return super().retrieve(request, *args, **kwargs)
+        except Http404:
+            user = request.user
+            filters = {}
+            if user.user_type == 'customer':
+                filters = {'customer': user, 'can_customer_track': True}
+            elif user.user_type not in ['controller', 'driver']:
+                raise
+            archived = find_archived(kwargs['tracking_number'], **filters)
+            if archived is None:
+                raise
+            return Response(archived.detail)
 
-        if not instance.can_customer_track:
-            return Response({
-                'error': 'Tracking is not available for this parcel yet.'
-            }, status=status.HTTP_403_FORBIDDEN)
 
-        serializer = self.get_serializer(instance)
-        return Response(serializer.data)
+# Public Tracking View
+@require_GET
+async def public_tracking(request, tracking_number):
+    try:
+        check_throttles(request, [PublicTrackingThrottle])
+    except exceptions.APIException as exc:
+        return error_response(exc)
+
+    # Reject unknown tracking numbers without a database lookup
+    if not await sync_to_async(tracking_numbers.might_exist)(tracking_number):
+        return error_response(exceptions.NotFound())
+
+    with read_from_replica():
+        parcels = Parcel.objects.filter(tracking_number=tracking_number)
+        if sharding.enabled():
+            # Location pings only update the driver on `default`, not the shards' copies
+            parcels = parcels.prefetch_related('current_driver')
+        else:
+            parcels = parcels.select_related('current_driver')
+        instance = await parcels.prefetch_related('tracking_events__created_by').afirst()
+        if instance is None:
+            instance = await sync_to_async(find_archived)(tracking_number)
+    if instance is None:
+        return error_response(exceptions.NotFound())
+
+    if not instance.can_customer_track:
+        return json_response({
+            'error': 'Tracking is not available for this parcel yet.'
+        }, status=status.HTTP_403_FORBIDDEN)
+
+    if not isinstance(instance, Parcel):
+        return json_response(instance.tracking)
+    serializer = ParcelTrackingSerializer(instance, context={'request': request})
+    return json_response(serializer.data)
 
 # Controller Views
-class AllParcelsView(generics.ListAPIView):
+class AllParcelsView(ReplicaReadMixin, generics.ListAPIView):
     serializer_class = ParcelSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
         if self.request.user.user_type == 'controller':
-            return Parcel.objects.all()
+            # Pages need a total order, also across shards
+            return Parcel.objects.order_by('-booked_at', 'id').everywhere()
         return Parcel.objects.none()
 
 
-class AllDriversView(generics.ListAPIView):
+class ParcelSearchView(ReplicaReadMixin, generics.ListAPIView):
+    """Parcels matching ?q=, best match first (see tracking/search.py)."""
+    serializer_class = ParcelSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        if self.request.user.user_type != 'controller':
+            return Parcel.objects.none()
+        parcels = (Parcel.objects.select_related('customer', 'current_driver__user')
+                   .prefetch_related('tracking_events__created_by'))
+        return search.search(parcels, self.request.query_params.get('q', ''))
+
+    def list(self, request, *args, **kwargs):
+        if not request.query_params.get('q', '').strip():
+            return Response({'error': 'q is required'}, status=status.HTTP_400_BAD_REQUEST)
+        return super().list(request, *args, **kwargs)
+
+
+class AllDriversView(CachedViewMixin, generics.ListAPIView):
     serializer_class = DriverSerializer
     permission_classes = [permissions.IsAuthenticated]
+    cache_timeout = 30
+
+    def get_cache_tags(self, data):
+        return ['drivers']
 
     def get_queryset(self):
         if self.request.user.user_type == 'controller':
-            return Driver.objects.all()
+            return Driver.objects.select_related('user').order_by('user_id')
         return Driver.objects.none()
 
+    def get(self, request, *args, **kwargs):
+        response = super().get(request, *args, **kwargs)
+        if response.status_code != 200:
+            return response
+        # Workload changes with every job, so it comes from the registry rather
+        # than the cached page; copy the rows, the cached ones are shared
+        data = response.data
+        rows = data['results'] if isinstance(data, dict) else data
+        live = []
+        for row in rows:
+            row = dict(row)
+            state = driver_registry.get(row['user']['id'])
+            if state is not None:
+                row.update(current_latitude=state.latitude, current_longitude=state.longitude,
+                           open_jobs=state.open_jobs, assigned_weight=round(state.assigned_weight, 3),
+                           assigned_volume=round(state.assigned_volume, 4), has_capacity=state.available)
+            live.append(row)
+        return Response({**data, 'results': live} if isinstance(data, dict) else live)
+
+
+class AvailableDriversView(APIView):
+    """Drivers with room for `weight` more kg and `volume` more m3, nearest to `latitude`/`longitude` first."""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        if request.user.user_type != 'controller':
+            return Response({'error': 'Only controllers can list available drivers'},
+                            status=status.HTTP_403_FORBIDDEN)
+        try:
+            weight = float(request.query_params.get('weight', 0))
+            volume = float(request.query_params.get('volume', 0))
+            latitude, longitude = (float(request.query_params[name]) if name in request.query_params else None
+                                   for name in ('latitude', 'longitude'))
+            limit = int(request.query_params.get('limit', 20))
+        except ValueError:
+            return Response({'error': 'weight, volume, latitude, longitude and limit must be numbers'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        states = driver_registry.with_capacity(weight, latitude, longitude, limit=max(limit, 1), volume=volume)
+        return Response({'results': [state.as_dict() for state in states]})
+
+
+class HeatmapCoverageView(ReplicaReadMixin, generics.ListAPIView):
+    """A heatmap layer's tiles at one zoom, with their totals; ?within=<quadkey> limits them to that area."""
+    serializer_class = HeatmapCoverageSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        tiles = HeatmapTile.objects.filter(layer=self.kwargs['layer'], zoom=self.kwargs['zoom'])
+        within = self.request.query_params.get('within')
+        if within:
+            tiles = tiles.filter(quadkey__startswith=within)
+        return tiles.defer('counts').order_by('quadkey')
+
+    def list(self, request, *args, **kwargs):
+        if request.user.user_type != 'controller':
+            return Response({'error': 'Only controllers can view heatmaps'}, status=status.HTTP_403_FORBIDDEN)
+        if kwargs['layer'] not in heatmap.LAYERS or kwargs['zoom'] not in heatmap.zooms():
+            return Response({'error': f'Heatmaps are kept for layers {heatmap.LAYERS} at zooms {heatmap.zooms()}'},
+                            status=status.HTTP_404_NOT_FOUND)
+        return super().list(request, *args, **kwargs)
+
+
+class HeatmapTileView(ReplicaReadMixin, CachedViewMixin, generics.RetrieveAPIView):
+    """One heatmap tile's cell counts, precomputed by tracking/heatmap.py, for the dashboard map."""
+    serializer_class = HeatmapTileSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    cache_timeout = 300
+
+    def get_cache_tags(self, data):
+        return ['heatmap']
+
+    def get_object(self):
+        return heatmap.tile(self.kwargs['layer'], self.kwargs['zoom'], self.kwargs['x'], self.kwargs['y'])
+
+    def retrieve(self, request, *args, **kwargs):
+        if request.user.user_type != 'controller':
+            return Response({'error': 'Only controllers can view heatmaps'}, status=status.HTTP_403_FORBIDDEN)
+        zoom = kwargs['zoom']
+        if kwargs['layer'] not in heatmap.LAYERS or zoom not in heatmap.zooms():
+            return Response({'error': f'Heatmaps are kept for layers {heatmap.LAYERS} at zooms {heatmap.zooms()}'},
+                            status=status.HTTP_404_NOT_FOUND)
+        if kwargs['x'] >= 1 << zoom or kwargs['y'] >= 1 << zoom:
+            return Response({'error': 'No such tile'}, status=status.HTTP_404_NOT_FOUND)
+        return super().retrieve(request, *args, **kwargs)
+
+
+class LoadPlanView(APIView):
+    """Proposed loads for the drivers on duty from the parcels waiting for one (see tracking/loading.py)."""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        if request.user.user_type != 'controller':
+            return Response({'error': 'Only controllers can plan loads'}, status=status.HTTP_403_FORBIDDEN)
+        most = loading.max_parcels()
+        try:
+            limit = int(request.query_params.get('limit', most))
+        except ValueError:
+            return Response({'error': 'limit must be a number'}, status=status.HTTP_400_BAD_REQUEST)
+        if limit < 1:
+            return Response({'error': 'limit must be at least 1'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(loading.plan(driver_registry.all(), limit=min(limit, most)))
+
 
 class AssignDriverView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
+    @idempotent
     def post(self, request, parcel_id):
         if request.user.user_type != 'controller':
             return Response({'error': 'Only controllers can assign drivers'}, 
@@ -154,62 +406,94 @@ class AssignDriverView(APIView):
             return Response({'error': 'Driver ID is required'}, 
                           status=status.HTTP_400_BAD_REQUEST)
 
-        driver = get_object_or_404(Driver, pk=driver_id)
-
-        # Create job
-        job = Job.objects.create(
-            parcel=parcel,
-            driver=driver,
-            job_type=job_type
-        )
-
-        # Update parcel status
-        if job_type == 'pickup':
-            parcel.status = 'awaiting_pickup'
-        else:
-            parcel.status = 'out_for_delivery'
-            parcel.can_customer_track = True  # ✅ Allow customer to track now
-
-        parcel.current_driver = driver
-        parcel.save()
-
-        # Create tracking event
-        TrackingEvent.objects.create(
-            parcel=parcel,
-            status_update=f'Assigned to driver for {job_type}',
-            notes=f'Driver {driver.user.username} assigned for {job_type}',
-            created_by=request.user
-        )
-
-        # Create notification for driver
-        Notification.objects.create(
-            user=driver.user,
-            title=f'New {job_type.title()} Job Assigned',
-            message=f'You have been assigned a {job_type} job for parcel {parcel.tracking_number}',
-            parcel=parcel
-        )
+        driver = get_object_or_404(Driver.objects.select_related('user'), pk=driver_id)
+        event_type = 'pickup_assigned' if job_type == 'pickup' else 'delivery_assigned'
+
+        state = driver_registry.get(driver.pk)
+        if state is not None and not loading.fits(state, parcel.weight, parcel.volume_m3):
+            weight_left, volume_left = loading.remaining_capacity(state)
+            return Response({'error': "The parcel doesn't fit in the driver's vehicle",
+                             'weight_left': round(weight_left, 3),
+                             'volume_left_m3': None if math.isinf(volume_left) else round(volume_left, 4)},
+                            status=status.HTTP_409_CONFLICT)
+
+        try:
+            with sharding.atomic(sharding.shard_of(parcel)):
+                # Update parcel status (delivery assignment also opens customer tracking)
+                apply_event(parcel, event_type, created_by=request.user,
+                            fields={'current_driver': driver}, driver_id=driver.pk)
+
+                # Create job
+                job = Job.objects.create(
+                    parcel=parcel,
+                    driver=driver,
+                    job_type=job_type
+                )
+
+                # Create tracking event
+                TrackingEvent.objects.create(
+                    parcel=parcel,
+                    status_update=f'Assigned to driver for {job_type}',
+                    notes=f'Driver {driver.user.username} assigned for {job_type}',
+                    created_by=request.user
+                )
+
+                # Create notification for driver
+                defer(
+                    notify, driver.user_id,
+                    title=f'New {job_type.title()} Job Assigned',
+                    message=f'You have been assigned a {job_type} job for parcel {parcel.tracking_number}',
+                    parcel_id=parcel.pk,
+                )
+        except InvalidTransition as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_409_CONFLICT)
+        except StaleObject as exc:
+            return conflict_response(exc)
 
         return Response({'message': 'Driver assigned successfully', 'job_id': job.id})
 
 
 # Driver Views
-class DriverJobsView(generics.ListAPIView):
-    serializer_class = JobSerializer
-    permission_classes = [permissions.IsAuthenticated]
-
-    def get_queryset(self):
-        if self.request.user.user_type == 'driver':
-            try:
-                driver = Driver.objects.get(user=self.request.user)
-                return Job.objects.filter(driver=driver)
-            except Driver.DoesNotExist:
-                return Job.objects.none()
-        return Job.objects.none()
+@require_GET
+async def driver_jobs(request):
+    try:
+        api_request = await authenticated_request(request)
+        jobs = Job.objects.none()
+        if api_request.user.user_type == 'driver':
+            # Driver's primary key is its user id
+            jobs = (
+                Job.objects.filter(driver_id=api_request.user.pk)
+                .select_related('driver__user', 'parcel__customer', 'parcel__current_driver__user')
+                .prefetch_related('parcel__tracking_events__created_by')
+                .order_by('id')
+                .everywhere()
+            )
+        now = timezone.now()
+        if 'since' not in request.GET:
+            page = await paginate(request, jobs, JobSerializer)
+            return json_response({**page, 'cursor': sync.next_cursor(now)})
+
+        # Delta sync: only jobs changed since the cursor, plus deleted ids
+        try:
+            since = sync.decode_cursor(request.GET['since'])
+        except sync.InvalidCursor as exc:
+            raise exceptions.ValidationError({'since': str(exc)})
+        changed, deleted, reset = await sync_to_async(sync.job_changes)(jobs, api_request.user.pk, since, now)
+        rows = [row async for row in changed]
+        return json_response({
+            'cursor': sync.next_cursor(now),
+            'reset': reset,
+            'results': JobSerializer(rows, many=True, context={'request': request}).data,
+            'deleted': deleted,
+        })
+    except exceptions.APIException as exc:
+        return error_response(exc)
 
 
 class AcceptJobView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
+    @idempotent
     def post(self, request, job_id):
         if request.user.user_type != 'driver':
             return Response({'error': 'Only drivers can accept jobs'}, 
@@ -221,17 +505,19 @@ class AcceptJobView(APIView):
             return Response({'error': 'You can only accept your own jobs'}, 
                           status=status.HTTP_403_FORBIDDEN)
 
-        job.status = 'accepted'
-        job.accepted_at = timezone.now()
-        job.save()
+        try:
+            with sharding.atomic(sharding.shard_of(job)):
+                update_job(job, status='accepted', accepted_at=timezone.now())
 
-        # Create tracking event
-        TrackingEvent.objects.create(
-            parcel=job.parcel,
-            status_update=f'Driver accepted {job.job_type} job',
-            notes=f'Driver {request.user.username} accepted the job',
-            created_by=request.user
-        )
+                # Create tracking event
+                TrackingEvent.objects.create(
+                    parcel=job.parcel,
+                    status_update=f'Driver accepted {job.job_type} job',
+                    notes=f'Driver {request.user.username} accepted the job',
+                    created_by=request.user
+                )
+        except StaleObject as exc:
+            return conflict_response(exc)
 
         return Response({'message': 'Job accepted successfully'})
 
@@ -239,6 +525,7 @@ class AcceptJobView(APIView):
 class ScanParcelView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
+    @idempotent
     def post(self, request, job_id):
         if request.user.user_type != 'driver':
             return Response({'error': 'Only drivers can scan parcels'}, 
@@ -250,68 +537,88 @@ class ScanParcelView(APIView):
             return Response({'error': 'You can only scan parcels for your own jobs'}, 
                           status=status.HTTP_403_FORBIDDEN)
 
-        # Update job status
-        job.status = 'en_route'
-        job.save()
-
-        # Update parcel status
         if job.job_type == 'pickup':
-            job.parcel.status = 'collected'
+            event_type = 'collected'
             status_message = 'Parcel collected and scanned'
         else:
-            job.parcel.status = 'out_for_delivery'
-            job.parcel.can_customer_track = True  # ✅ Allow customer to track now
+            event_type = 'out_for_delivery'
             status_message = 'Parcel scanned for delivery'
-        
-        job.parcel.save()
-
-        
-
-        # Create tracking event
-        TrackingEvent.objects.create(
-            parcel=job.parcel,
-            status_update=status_message,
-            notes=f'Parcel scanned by driver {request.user.username}',
-            created_by=request.user
-        )
 
-        # Create notification for customer
-        Notification.objects.create(
-            user=job.parcel.customer,
-            title='Parcel Status Update',
-            message=f'Your parcel {job.parcel.tracking_number} has been {status_message.lower()}',
-            parcel=job.parcel
-        )
+        try:
+            with sharding.atomic(sharding.shard_of(job)):
+                # Update parcel status
+                apply_event(job.parcel, event_type, created_by=request.user, job_id=job.pk)
+
+                # Update job status
+                update_job(job, status='en_route')
+                if job.job_type == 'pickup':
+                    job_closed(job)
+
+                # Create tracking event
+                TrackingEvent.objects.create(
+                    parcel=job.parcel,
+                    status_update=status_message,
+                    notes=f'Parcel scanned by driver {request.user.username}',
+                    created_by=request.user
+                )
+
+                # Create notification for customer
+                defer(
+                    notify, job.parcel.customer_id,
+                    title='Parcel Status Update',
+                    message=f'Your parcel {job.parcel.tracking_number} has been {status_message.lower()}',
+                    parcel_id=job.parcel_id,
+                )
+        except InvalidTransition as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_409_CONFLICT)
+        except StaleObject as exc:
+            return conflict_response(exc)
 
         return Response({'message': 'Parcel scanned successfully'})
 
 
-class UpdateLocationView(APIView):
-    permission_classes = [permissions.IsAuthenticated]
+@csrf_exempt
+@require_POST
+async def update_location(request):
+    # CSRF is enforced by SessionAuthentication for session logins, as in DRF views
+    try:
+        api_request = await authenticated_request(request)
+        if api_request.user.user_type != 'driver':
+            return json_response({'error': 'Only drivers can update location'},
+                                 status=status.HTTP_403_FORBIDDEN)
+        serializer = DriverLocationUpdateSerializer(data=api_request.data)
+    except exceptions.APIException as exc:
+        return error_response(exc)
+
+    if serializer.is_valid():
+        updated = await Driver.objects.filter(pk=api_request.user.pk).aupdate(
+            current_latitude=serializer.validated_data['latitude'],
+            current_longitude=serializer.validated_data['longitude'],
+        )
+        if not updated:
+            return json_response({'error': 'Driver profile not found'},
+                                 status=status.HTTP_404_NOT_FOUND)
+        await LocationPing.objects.acreate(
+            driver_id=api_request.user.pk,
+            latitude=serializer.validated_data['latitude'],
+            longitude=serializer.validated_data['longitude'],
+        )
+        # aupdate() sends no post_save. The driver list isn't invalidated: it
+        # takes positions from the registry, updated below
+        await sync_to_async(invalidate)(driver_tag(api_request.user.pk))
+        driver_registry.moved(
+            api_request.user.pk, serializer.validated_data['latitude'], serializer.validated_data['longitude'])
+        await sync_to_async(geofence.check_ping)(
+            api_request.user.pk, serializer.validated_data['latitude'], serializer.validated_data['longitude'])
+        return json_response({'message': 'Location updated successfully'})
 
-    def post(self, request):
-        if request.user.user_type != 'driver':
-            return Response({'error': 'Only drivers can update location'}, 
-                          status=status.HTTP_403_FORBIDDEN)
-
-        serializer = DriverLocationUpdateSerializer(data=request.data)
-        if serializer.is_valid():
-            try:
-                driver = Driver.objects.get(user=request.user)
-                driver.current_latitude = serializer.validated_data['latitude']
-                driver.current_longitude = serializer.validated_data['longitude']
-                driver.save()
-                return Response({'message': 'Location updated successfully'})
-            except Driver.DoesNotExist:
-                return Response({'error': 'Driver profile not found'}, 
-                              status=status.HTTP_404_NOT_FOUND)
-        
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    return json_response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
 class CompleteDeliveryView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
+    @idempotent
     def post(self, request, job_id):
         if request.user.user_type != 'driver':
             return Response({'error': 'Only drivers can complete deliveries'}, 
@@ -323,58 +630,147 @@ class CompleteDeliveryView(APIView):
             return Response({'error': 'You can only complete your own jobs'}, 
                           status=status.HTTP_403_FORBIDDEN)
 
+        if job.status == 'completed':
+            # A retry after a dropped response; don't complete twice
+            return Response({'message': 'Delivery already completed'})
+
         serializer = DeliveryCompletionSerializer(data=request.data)
         if serializer.is_valid():
-            # Update job
-            job.status = 'completed'
-            job.completed_at = timezone.now()
-            job.notes = serializer.validated_data.get('notes', '')
-            job.save()
-
-            # Update parcel
-            job.parcel.status = 'delivered'
-            job.parcel.save()
-
-            # Create tracking event with proof
-            tracking_event = TrackingEvent.objects.create(
-                parcel=job.parcel,
-                status_update='Delivered successfully',
-                notes=serializer.validated_data.get('notes', 'Package delivered'),
-                created_by=request.user
-            )
-
-            # Add delivery proof if provided
-            if 'delivery_image' in serializer.validated_data:
-                tracking_event.image = serializer.validated_data['delivery_image']
-            if 'signature' in serializer.validated_data:
-                tracking_event.signature = serializer.validated_data['signature']
-            tracking_event.save()
-
-            # Create notification for customer
-            Notification.objects.create(
-                user=job.parcel.customer,
-                title='Parcel Delivered',
-                message=f'Your parcel {job.parcel.tracking_number} has been delivered successfully',
-                parcel=job.parcel
-            )
+            try:
+                with sharding.atomic(sharding.shard_of(job)):
+                    # Update parcel
+                    apply_event(job.parcel, 'delivered', created_by=request.user, job_id=job.pk)
+
+                    # Update job
+                    update_job(job, status='completed', completed_at=timezone.now(),
+                               notes=serializer.validated_data.get('notes', ''))
+                    job_closed(job)
+
+                    # Create tracking event with proof
+                    tracking_event = TrackingEvent.objects.create(
+                        parcel=job.parcel,
+                        status_update='Delivered successfully',
+                        notes=serializer.validated_data.get('notes', 'Package delivered'),
+                        created_by=request.user
+                    )
+
+                    # Delivery proof is compressed and thumbnailed in the background
+                    if 'delivery_image' in serializer.validated_data:
+                        stage_upload(tracking_event, 'image', serializer.validated_data['delivery_image'])
+                    if 'signature' in serializer.validated_data:
+                        stage_upload(tracking_event, 'signature', serializer.validated_data['signature'])
+                    upload_ids = {key: serializer.validated_data[key]
+                                  for key in uploads.PROOF_UPLOAD_FIELDS if key in serializer.validated_data}
+                    for key, upload in uploads.claim_all(request.user, upload_ids).items():
+                        stage_file(tracking_event, uploads.PROOF_UPLOAD_FIELDS[key], upload.file.name)
+
+                    # Create notification for customer
+                    defer(
+                        notify, job.parcel.customer_id,
+                        title='Parcel Delivered',
+                        message=f'Your parcel {job.parcel.tracking_number} has been delivered successfully',
+                        parcel_id=job.parcel_id,
+                    )
+            except InvalidTransition as exc:
+                return Response({'error': str(exc)}, status=status.HTTP_409_CONFLICT)
+            except StaleObject as exc:
+                return conflict_response(exc)
+            except UploadError as exc:
+                return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
 
             return Response({'message': 'Delivery completed successfully'})
         
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-# Notification Views
-class NotificationsView(generics.ListAPIView):
-    serializer_class = NotificationSerializer
+class DriverBatchView(APIView):
+    """Apply a list of accept/scan/complete actions at once (see tracking/batch.py)."""
     permission_classes = [permissions.IsAuthenticated]
 
-    def get_queryset(self):
-        return Notification.objects.filter(user=self.request.user)
+    @idempotent
+    def post(self, request):
+        if request.user.user_type != 'driver':
+            return Response({'error': 'Only drivers can submit job actions'},
+                            status=status.HTTP_403_FORBIDDEN)
+        serializer = DriverBatchSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        results = DriverBatch(request.user).run(serializer.validated_data['actions'])
+        return Response({'results': results})
+
+
+# Resumable uploads
+class UploadSessionCreateView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    @idempotent
+    def post(self, request):
+        serializer = UploadSessionSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            session = uploads.create_session(
+                request.user,
+                serializer.validated_data['filename'],
+                serializer.validated_data['size'],
+                serializer.validated_data.get('sha256', ''),
+            )
+        except UploadError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(UploadSessionSerializer(session).data, status=status.HTTP_201_CREATED)
+
+
+class UploadSessionView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, upload_id):
+        session = get_object_or_404(UploadSession, pk=upload_id, user=request.user)
+        return Response(UploadSessionSerializer(session).data)
+
+    def put(self, request, upload_id):
+        session = get_object_or_404(UploadSession, pk=upload_id, user=request.user)
+        try:
+            start, end = uploads.parse_content_range(request.META.get('HTTP_CONTENT_RANGE'), session)
+            offset = uploads.write_chunk(session, request.stream, start, end)
+        except OffsetMismatch as exc:
+            return Response({'error': str(exc), 'offset': exc.offset}, status=status.HTTP_409_CONFLICT)
+        except UploadError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'upload_id': session.pk, 'offset': offset, 'size': session.size})
+
+
+class UploadFinalizeView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    @idempotent
+    def post(self, request, upload_id):
+        session = get_object_or_404(UploadSession, pk=upload_id, user=request.user)
+        try:
+            session = uploads.finalize(session)
+        except OffsetMismatch as exc:
+            return Response({'error': 'Upload is incomplete', 'offset': exc.offset},
+                            status=status.HTTP_409_CONFLICT)
+        except UploadError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(UploadSessionSerializer(session).data)
+
+
+# Notification Views
+@require_GET
+async def notifications(request):
+    try:
+        api_request = await authenticated_request(request)
+        with read_from_replica():
+            queryset = Notification.objects.filter(user=api_request.user).everywhere()
+            return json_response(await paginate(request, queryset, NotificationSerializer))
+    except exceptions.APIException as exc:
+        return error_response(exc)
 
 
 class MarkNotificationReadView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
+    @idempotent
     def post(self, request, notification_id):
         notification = get_object_or_404(Notification, id=notification_id, user=request.user)
         notification.is_read = True
@@ -383,21 +779,37 @@ class MarkNotificationReadView(APIView):
 
 
 
+# Metrics
+def metrics_view(request):
+    token = settings.METRICS_TOKEN
+    if not token:
+        # Closed until a token is configured
+        return HttpResponse('Set METRICS_TOKEN to enable scraping', status=status.HTTP_403_FORBIDDEN,
+                            content_type='text/plain')
+    if not constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponse(status=status.HTTP_401_UNAUTHORIZED)
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 # Web Interface Views
 from django.shortcuts import render, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 
 
+@cached_page(timeout=300)
 def home_view(request):
     return render(request, 'tracking/home.html')
 
+@cached_page(timeout=300)
 def home1_view(request):
     return render(request, 'tracking/index.html')
 
+@cached_page(timeout=300)
 def services_page(request):
     return render(request, 'tracking/service.html')
 
+@cached_page(timeout=300, tags=['about'])
 def about_view(request):
     about = AboutSection.objects.first()
     return render(request, 'tracking/about.html', {'about': about})
@@ -483,13 +895,13 @@ def admin_dashboard_page(request):
 
     from .models import Parcel, Job
 
-    total_parcels = Parcel.objects.count()
-    parcels = Parcel.objects.select_related('customer', 'current_driver__user').all()
-    pending_pickup = Parcel.objects.filter(status='awaiting_pickup').count()
-    in_transit = Parcel.objects.filter(status='out_for_delivery').count()
-    delivered = Parcel.objects.filter(status='delivered').count()
-    total_jobs = Job.objects.count()
-    jobs = Job.objects.select_related('driver', 'parcel').all()
+    total_parcels = Parcel.objects.everywhere().count()
+    parcels = Parcel.objects.select_related('customer', 'current_driver__user').everywhere()
+    pending_pickup = Parcel.objects.filter(status='awaiting_pickup').everywhere().count()
+    in_transit = Parcel.objects.filter(status='out_for_delivery').everywhere().count()
+    delivered = Parcel.objects.filter(status='delivered').everywhere().count()
+    total_jobs = Job.objects.everywhere().count()
+    jobs = Job.objects.select_related('driver', 'parcel').everywhere()
 
     return render(request, 'tracking/admin_dashboard.html', {
         'total_parcels': total_parcels,
@@ -498,5 +910,6 @@ def admin_dashboard_page(request):
         'delivered': delivered,
         'total_jobs': total_jobs,
         'parcels': parcels,
-        'jobs': jobs
+        'jobs': jobs,
+        'heatmap_zooms': heatmap.zooms(),
     })